@@ -0,0 +1,30 @@
+HOT_TABLE = 'api_message'
+ARCHIVE_TABLE = 'api_archivedmessage'
+COLUMNS = ('id', 'user_id', 'chat_id', 'content', 'archived', 'created_at', 'updated_at')
+
+
+def move_messages(connection, archived, chat_id, updated_at, after_id=0, last_id=None):
+    """
+    Move the messages of a chat with after_id < id <= last_id into the archive table, or
+    back into api_message when archived is false, keeping their ids.
+
+    Plain INSERT ... SELECT and DELETE statements, so the rows never leave the database and
+    no delete signals fire: a moved message is not a deleted one. The search index triggers
+    on api_message do fire, so only live messages are searchable. Returns the moved rows.
+    """
+    source, target = (HOT_TABLE, ARCHIVE_TABLE) if archived else (ARCHIVE_TABLE, HOT_TABLE)
+    quote = connection.ops.quote_name
+    where = f"{quote('chat_id')} = %s AND {quote('id')} > %s"
+    params = [chat_id, after_id]
+    if last_id is not None:
+        where += f" AND {quote('id')} <= %s"
+        params.append(last_id)
+    columns = ', '.join(quote(column) for column in COLUMNS)
+    selected = ', '.join('%s' if column in ('archived', 'updated_at') else quote(column) for column in COLUMNS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {quote(target)} ({columns}) SELECT {selected} FROM {quote(source)} WHERE {where}',
+            [archived, connection.ops.adapt_datetimefield_value(updated_at), *params],
+        )
+        cursor.execute(f'DELETE FROM {quote(source)} WHERE {where}', params)
+        return cursor.rowcount
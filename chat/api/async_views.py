@@ -0,0 +1,162 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from rest_framework.exceptions import APIException, AuthenticationFailed, NotAuthenticated, PermissionDenied
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from api.models import Chat, Message
+from api.realtime import group_name
+from api.serializers import MessageSerializer
+
+STREAM_BATCH_SIZE = 100
+
+
+async def authenticate(request):
+    """
+    Run the configured DRF authentication classes for a plain async Django view.
+    Invalid credentials raise their APIException as in DRF, missing ones NotAuthenticated.
+    """
+    drf_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    user = await sync_to_async(lambda: drf_request.user)()
+    if not user.is_authenticated:
+        raise NotAuthenticated()
+    return user
+
+
+def render(data, status=200):
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+
+
+def error(detail, status):
+    return render({'detail': detail}, status)
+
+
+def exception_response(request, exc):
+    """
+    The response APIView.handle_exception gives for exc: its detail, in {"detail": ...}
+    unless it is a dict or list, and for missing or invalid credentials the challenge of
+    the first authentication class, or 403 when it has none.
+    """
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    status = exc.status_code
+    challenge = None
+    if isinstance(exc, (NotAuthenticated, AuthenticationFailed)):
+        authenticators = api_settings.DEFAULT_AUTHENTICATION_CLASSES
+        challenge = authenticators[0]().authenticate_header(Request(request)) if authenticators else None
+        if not challenge:
+            status = 403
+    response = render(data, status)
+    if challenge:
+        response['WWW-Authenticate'] = challenge
+    return response
+
+
+def can_view_chat(user, chat):
+    return chat.user_id == user.pk or user.is_staff or user.is_superuser
+
+
+@asynccontextmanager
+async def subscribe(chat_id):
+    """
+    Join the chat's fan-out group on a private channel and yield a function that
+    waits up to timeout seconds for the next event, returning None on timeout.
+    """
+    channel_layer = get_channel_layer()
+    channel = await channel_layer.new_channel()
+    group = group_name(chat_id)
+    await channel_layer.group_add(group, channel)
+
+    async def wait(timeout):
+        try:
+            return await asyncio.wait_for(channel_layer.receive(channel), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    try:
+        yield wait
+    finally:
+        await channel_layer.group_discard(group, channel)
+
+
+async def get_messages_since(chat_id, since):
+    messages = [
+        message async for message in
+        Message.objects.filter(chat_id=chat_id, id__gt=since).order_by('id')[:STREAM_BATCH_SIZE]
+    ]
+    return MessageSerializer(messages, many=True).data
+
+
+async def event_stream(chat_id, since, timeout):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    async with subscribe(chat_id) as wait:
+        while True:
+            messages = await get_messages_since(chat_id, since)
+            for message in messages:
+                since = message['id']
+                yield f"id: {since}\nevent: message\ndata: {json.dumps(message, cls=DjangoJSONEncoder)}\n\n"
+            if len(messages) == STREAM_BATCH_SIZE:
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            if await wait(min(remaining, settings.CHAT_STREAM_KEEPALIVE)) is None:
+                yield ": keepalive\n\n"
+
+
+async def chat_stream(request, pk):
+    """
+    Deliver the messages of a chat newer than the `since` message id.
+
+    Without `Accept: text/event-stream` this is a long poll: newer messages are returned
+    immediately, otherwise the request waits until one arrives or `timeout` seconds pass.
+    With it, messages are streamed as Server-Sent Events until the timeout, resuming
+    from `Last-Event-ID` on reconnect. Waiting only holds a coroutine, not a thread.
+    """
+    if request.method != 'GET':
+        return error('Method not allowed.', 405)
+    try:
+        user = await authenticate(request)
+    except APIException as exc:
+        return exception_response(request, exc)
+    chat = await Chat.objects.filter(pk=pk).only('user').afirst()
+    if chat is None:
+        return error('No Chat matches the given query.', 404)
+    if not can_view_chat(user, chat):
+        return exception_response(request, PermissionDenied())
+
+    try:
+        since = int(request.headers.get('Last-Event-ID') or request.GET.get('since', 0))
+        timeout = min(float(request.GET.get('timeout', settings.CHAT_STREAM_TIMEOUT)), settings.CHAT_STREAM_TIMEOUT)
+    except ValueError:
+        return error('since and timeout must be numbers.', 400)
+
+    if 'text/event-stream' in request.headers.get('Accept', ''):
+        return StreamingHttpResponse(
+            event_stream(pk, since, timeout),
+            content_type='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+        )
+
+    messages = await get_messages_since(pk, since)
+    if not messages:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        async with subscribe(pk) as wait:
+            # Check again after subscribing, a message may have arrived in between.
+            messages = await get_messages_since(pk, since)
+            while not messages and deadline > loop.time():
+                if await wait(deadline - loop.time()) is None:
+                    break
+                messages = await get_messages_since(pk, since)
+
+    return JsonResponse({
+        'since': messages[-1]['id'] if messages else since,
+        'results': messages,
+    })
@@ -0,0 +1,141 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from api.db import on_commit_everywhere
+
+CLAIM_FIELDS = ('is_staff', 'is_superuser')
+
+
+def claims_key(user_id):
+    return f'api:auth:claims:{user_id}'
+
+
+def user_key(user_id):
+    return f'api:auth:user:{user_id}'
+
+
+def get_user_row(user_id):
+    """
+    The full row of a user, cached for USER_ROW_CACHE_TIMEOUT seconds. None when the user
+    does not exist.
+    """
+    user = cache.get(user_key(user_id))
+    if user is None:
+        user = get_user_model().objects.filter(pk=user_id).first()
+        if user is not None:
+            cache.set(user_key(user_id), user, settings.USER_ROW_CACHE_TIMEOUT)
+    return user
+
+
+def get_claims(user_id):
+    """
+    The current flags of a user, cached for USER_ROW_CACHE_TIMEOUT seconds. They take
+    precedence over the claims signed into its access tokens. A user that does not exist
+    is inactive, a missing cache entry is read again from the database.
+    """
+    claims = cache.get(claims_key(user_id))
+    if claims is None:
+        claims = get_user_model().objects.filter(pk=user_id).values('is_active', *CLAIM_FIELDS).first()
+        claims = claims or {'is_active': False}
+        cache.set(claims_key(user_id), claims, settings.USER_ROW_CACHE_TIMEOUT)
+    return claims
+
+
+def forget_claims(user_id):
+    """
+    Drop the cached flags and row of a user after a change, now and once it committed,
+    so that neither this nor another connection keeps reading the old ones.
+    """
+    keys = [claims_key(user_id), user_key(user_id)]
+    cache.delete_many(keys)
+    on_commit_everywhere(lambda: cache.delete_many(keys))
+
+
+class ClaimsRefreshToken(RefreshToken):
+    """
+    Refresh token whose access tokens carry the flags StatelessJWTAuthentication authorizes
+    with. The flags are read when each access token is issued and never signed into the
+    refresh token itself, which outlives the recorded flag changes.
+    """
+    no_copy_claims = (*RefreshToken.no_copy_claims, *CLAIM_FIELDS)
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token.user = user
+        return token
+
+    @property
+    def access_token(self):
+        access = super().access_token
+        user = getattr(self, 'user', None)
+        if user is None:
+            user_id = self.payload[jwt_settings.USER_ID_CLAIM]
+            user = get_user_model().objects.filter(pk=user_id).only(*CLAIM_FIELDS).first()
+        for field in CLAIM_FIELDS:
+            access[field] = bool(user and getattr(user, field))
+        return access
+
+
+class ClaimsUser(TokenUser):
+    """
+    User built from the signed claims of an access token, corrected by the current flags.
+    Other attributes of the user come from its cached row, see get_user_row.
+    """
+    claims = {}
+
+    @cached_property
+    def id(self):
+        return int(self.token[jwt_settings.USER_ID_CLAIM])
+
+    @cached_property
+    def pk(self):
+        return self.id
+
+    @cached_property
+    def is_staff(self):
+        return self.claims.get('is_staff', self.token.get('is_staff', False))
+
+    @cached_property
+    def is_superuser(self):
+        return self.claims.get('is_superuser', self.token.get('is_superuser', False))
+
+    @cached_property
+    def row(self):
+        return get_user_row(self.pk)
+
+    @cached_property
+    def username(self):
+        return self.row.username if self.row is not None else ''
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name == 'row':
+            raise AttributeError(name)
+        row = self.row
+        if row is not None and hasattr(row, name):
+            return getattr(row, name)
+        return super().__getattr__(name)
+
+
+class StatelessJWTAuthentication(JWTStatelessUserAuthentication):
+    """
+    JWT authentication without the per-request user lookup.
+
+    The user is built from the token's id, is_staff and is_superuser claims, see
+    ClaimsTokenObtainPairSerializer, corrected by the current flags of get_claims, so
+    that flag changes refresh the claims or revoke the token. Those come from the cache,
+    the database is only read when they are not cached.
+    """
+    def get_user(self, validated_token):
+        super().get_user(validated_token)
+        user = ClaimsUser(validated_token)
+        user.claims = get_claims(user.pk)
+        if not user.claims['is_active']:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        return user
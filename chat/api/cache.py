@@ -0,0 +1,106 @@
+import hashlib
+import uuid
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.http import parse_http_date_safe
+from rest_framework.response import Response
+from api.conditional import get_not_modified
+from api.db import on_commit_everywhere
+
+STAFF = 'staff'
+STATS_KEYS = {'hits': 'api:cache:hits', 'misses': 'api:cache:misses'}
+VALIDATOR_HEADERS = ('ETag', 'Last-Modified')
+
+
+def version_key(scope):
+    return f'api:cache:version:{scope}'
+
+
+def get_versions(scopes):
+    """
+    Current version of every scope. A missing version gets a fresh random value,
+    so entries cached under an evicted version can never be served again.
+    """
+    keys = {scope: version_key(scope) for scope in scopes}
+    versions = cache.get_many(keys.values())
+    for scope, key in keys.items():
+        if key not in versions:
+            cache.add(key, uuid.uuid4().hex, None)
+            versions[key] = cache.get(key)
+    return [versions[keys[scope]] for scope in scopes]
+
+
+def invalidate(*scopes):
+    """
+    Bump the versions of scopes once the current transactions commit. Bumped before, a
+    request reading the rows in between would cache the old ones under the new version.
+    """
+    on_commit_everywhere(lambda: cache.set_many({version_key(scope): uuid.uuid4().hex for scope in scopes}, None))
+
+
+def invalidate_users(user_ids):
+    """
+    Drop the cached responses of the given users and every staff response.
+    """
+    invalidate(STAFF, *{f'user:{user_id}' for user_id in user_ids})
+
+
+def invalidate_chats(chat_ids):
+    from api.models import Chat
+
+    invalidate_users(Chat.objects.filter(pk__in=chat_ids).values_list('user_id', flat=True).distinct())
+
+
+def record(outcome):
+    key = STATS_KEYS[outcome]
+    if cache.add(key, 1, None):
+        return
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, None)
+
+
+def get_stats():
+    values = cache.get_many(STATS_KEYS.values())
+    hits, misses = (values.get(STATS_KEYS[outcome], 0) for outcome in ('hits', 'misses'))
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_rate': hits / total if total else None}
+
+
+class CachedResponseMixin:
+    """
+    Read-through cache for the GET responses of a view, keyed per user and per URL.
+
+    Entries are versioned by the user (and for staff by a shared staff version), and the
+    signal handlers in api.signals bump those versions once a change of a chat or message
+    affecting the user commits. Responses cached before are not served again, only
+    between the commit and the bump the previous response can still be. Validators of a
+    cached response are kept with it, so conditional requests are answered from the cache.
+    """
+    def get(self, request, *args, **kwargs):
+        scopes = [f'user:{request.user.pk}']
+        if request.user.is_staff:
+            scopes.append(STAFF)
+        url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+        key = ':'.join(['api:cache:response', type(self).__name__, str(request.user.pk), *get_versions(scopes), url])
+
+        cached = cache.get(key)
+        if cached is not None:
+            record('hits')
+            data, headers = cached
+            response = None
+            if 'ETag' in headers:
+                response = get_not_modified(request, headers['ETag'], parse_http_date_safe(headers.get('Last-Modified')))
+            if response is None:
+                response = Response(data, headers=headers)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        record('misses')
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200:
+            headers = {header: response[header] for header in VALIDATOR_HEADERS if header in response}
+            cache.set(key, (response.data, headers), settings.RESPONSE_CACHE_TIMEOUT)
+        response['X-Cache'] = 'MISS'
+        return response
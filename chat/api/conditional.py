@@ -0,0 +1,110 @@
+import hashlib
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def get_not_modified(request, etag, last_modified):
+    """
+    Evaluate the request's preconditions, returning the 304/412 response or None.
+    """
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+class ConditionalGetMixin:
+    """
+    Strong ETag and Last-Modified for GET responses, answered with 304 Not Modified
+    before the queryset is fetched and serialized.
+
+    The validators come from one max(updated_at)/count aggregate per queryset returned
+    by `get_validator_querysets`, so they change whenever a row the response is built
+    from is created, updated or deleted.
+    """
+    def get(self, request, *args, **kwargs):
+        queryset = self.get_validated_queryset(request, *args, **kwargs)
+        if queryset is None:
+            return super().get(request, *args, **kwargs)
+
+        parts, last_modified = self.get_validators(queryset)
+        parts = [request.user.pk, request.get_full_path(), *parts]
+        etag = quote_etag(hashlib.sha256(repr(parts).encode()).hexdigest()[:32])
+
+        response = get_not_modified(request, etag, last_modified)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        if response.status_code == 200:
+            set_validators(response, etag, last_modified)
+        return response
+
+    def get_validators(self, queryset):
+        """
+        The values the ETag is built from and the Last-Modified timestamp, or None.
+        """
+        parts = []
+        last_modified = None
+        for validator_queryset in self.get_validator_querysets(queryset):
+            aggregate = validator_queryset.order_by().values('pk').aggregate(last=Max('updated_at'), count=Count('pk'))
+            parts += [aggregate['last'], aggregate['count']]
+            if aggregate['last'] is not None:
+                last_modified = max(last_modified or 0, int(aggregate['last'].timestamp()))
+        return parts, last_modified
+
+    def get_validated_queryset(self, request, *args, **kwargs):
+        raise NotImplementedError
+
+    def get_validator_querysets(self, queryset):
+        return [queryset, *self.get_related_validator_querysets(queryset)]
+
+    def get_related_validator_querysets(self, queryset):
+        """
+        Querysets of other rows the response of queryset is built from.
+        """
+        return []
+
+
+class ConditionalListMixin(ConditionalGetMixin):
+    """
+    Validators of the requested page only, however long the list is: the keys and update
+    times of the page's rows, fetched with the page's own keyset query, and the related
+    rows of the page. A row deleted from the page leaves its keys, so it changes the ETag
+    like an edit. Lists have no Last-Modified, deletions would not move it.
+    """
+    def get_validated_queryset(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        return self.paginator.get_page_queryset(queryset, request, view=self)
+
+    def get_validators(self, queryset):
+        # Rows merged from several shards need the ordering columns.
+        ordering = [field.lstrip('-') for field in self.paginator.ordering]
+        rows = [row[:2] for row in queryset.values_list('pk', 'updated_at', *ordering)]
+        page = queryset.model.objects.filter(pk__in=[pk for pk, _ in rows])
+        parts = [rows]
+        for validator_queryset in self.get_related_validator_querysets(page):
+            aggregate = validator_queryset.order_by().values('pk').aggregate(last=Max('updated_at'), count=Count('pk'))
+            parts += [aggregate['last'], aggregate['count']]
+        return parts, None
+
+
+class ConditionalRetrieveMixin(ConditionalGetMixin):
+    def get_validated_queryset(self, request, *args, **kwargs):
+        """
+        Check the object permissions on a lean instance, so a 304 never discloses an object
+        the user may not see. Missing objects fall through to the regular 404.
+        """
+        model = self.get_queryset().model
+        lookup = {self.lookup_field: kwargs[self.lookup_url_kwarg or self.lookup_field]}
+        obj = model.objects.filter(**lookup).only('user').first()
+        if obj is None:
+            return None
+        self.check_object_permissions(request, obj)
+        return model.objects.filter(pk=obj.pk)
@@ -0,0 +1,43 @@
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from api.models import Chat
+from api.realtime import group_name
+
+
+class ChatConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Pushes created, edited and archived messages of a single chat to its participants.
+    The connection is accepted for the chat owner and for staff, like IsOwnerOrAdmin.
+    """
+    async def connect(self):
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close(code=4401)
+            return
+
+        self.chat_id = self.scope['url_route']['kwargs']['pk']
+        if not await self.has_permission(user, self.chat_id):
+            await self.close(code=4403)
+            return
+
+        self.group = group_name(self.chat_id)
+        await self.channel_layer.group_add(self.group, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        if hasattr(self, 'group'):
+            await self.channel_layer.group_discard(self.group, self.channel_name)
+
+    async def receive_json(self, content, **kwargs):
+        if content.get('type') == 'ping':
+            await self.send_json({'type': 'pong'})
+
+    async def chat_event(self, event):
+        await self.send_json({'type': event['event'], 'data': event['payload']})
+
+    @database_sync_to_async
+    def has_permission(self, user, chat_id):
+        chat = Chat.objects.filter(pk=chat_id).only('user').first()
+        if chat is None:
+            return False
+        return chat.user_id == user.pk or user.is_staff or user.is_superuser
@@ -0,0 +1,148 @@
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import BigIntegerField, Case, Count, F, OuterRef, Q, Subquery, Value, When, Window
+from django.db.models.functions import Coalesce, RowNumber
+from api.models import Chat, Message
+from api.sharding import is_sharded
+
+
+def newer_than_last(message):
+    return (
+        Q(last_message_id__isnull=True)
+        | Q(last_message_at__lt=message.created_at)
+        | Q(last_message_at=message.created_at, last_message_id__lt=message.pk)
+    )
+
+
+def messages_added(messages):
+    """
+    Count new or unarchived messages on their chats, one UPDATE per chat. The latest
+    message only replaces last_message_* when it is newer.
+    """
+    by_chat = {}
+    for message in messages:
+        by_chat.setdefault(message.chat_id, []).append(message)
+    for chat_id, chat_messages in by_chat.items():
+        latest = max(chat_messages, key=lambda message: (message.created_at, message.pk))
+        Chat.objects.filter(pk=chat_id).update(
+            message_count=F('message_count') + len(chat_messages),
+            last_message_at=Case(When(newer_than_last(latest), then=Value(latest.created_at)), default=F('last_message_at')),
+            last_message_id=Case(
+                When(newer_than_last(latest), then=Value(latest.pk)), default=F('last_message_id'),
+                output_field=BigIntegerField(),
+            ),
+        )
+
+
+def message_removed(message):
+    """
+    Uncount a deleted or archived message. When it was the latest one, the previous
+    unarchived message is looked up in the same UPDATE, or beforehand when the message
+    is on another shard than its chat.
+    """
+    if is_sharded() and message._state.db != DEFAULT_DB_ALIAS:
+        latest = get_latest_messages(message._state.db, [message.chat_id]).get(message.chat_id)
+        values = {
+            'last_message_at': Value(latest[0]) if latest else F('created_at'),
+            'last_message_id': Value(latest[1] if latest else None, BigIntegerField()),
+        }
+    else:
+        values = get_counter_values()
+    is_last = Q(last_message_id=message.pk)
+    Chat.objects.filter(pk=message.chat_id).update(
+        message_count=F('message_count') - 1,
+        last_message_at=Case(When(is_last, then=values['last_message_at']), default=F('last_message_at')),
+        last_message_id=Case(
+            When(is_last, then=values['last_message_id']), default=F('last_message_id'), output_field=BigIntegerField(),
+        ),
+    )
+
+
+def messages_archived(chat_id, count, archived):
+    """
+    Adjust the count of a chat after its archive job changed count messages. The latest
+    message is recomputed by refresh_chat_counters once the job is done.
+    """
+    Chat.objects.filter(pk=chat_id).update(message_count=F('message_count') + (-count if archived else count))
+
+
+def get_counter_values():
+    """
+    The correct counters of the outer chat, as subqueries over its unarchived messages.
+    """
+    live = Message.objects.filter(chat=OuterRef('pk'), archived=False)
+    latest = live.order_by('-created_at', '-id')
+    return {
+        'message_count': Coalesce(Subquery(live.order_by().values('chat').annotate(count=Count('pk')).values('count')), 0),
+        'last_message_at': Coalesce(Subquery(latest.values('created_at')[:1]), F('created_at')),
+        'last_message_id': Subquery(latest.values('pk')[:1]),
+    }
+
+
+def get_latest_messages(using, chat_ids):
+    """
+    The (created_at, id) of the latest unarchived message of each of the chats on database
+    using, for chats whose messages cannot be reached from a subquery.
+    """
+    latest = Message.objects.using(using).filter(chat_id__in=chat_ids, archived=False).annotate(
+        row=Window(RowNumber(), partition_by='chat_id', order_by=[F('created_at').desc(), F('id').desc()]),
+    ).filter(row=1)
+    return {chat_id: (created_at, pk) for chat_id, created_at, pk in latest.values_list('chat_id', 'created_at', 'pk')}
+
+
+def get_sharded_counters(rows):
+    """
+    Add the correct counters, as expected_<field>, to chat rows with their pk, shard and
+    created_at, with two queries per shard.
+    """
+    by_shard = {}
+    for row in rows:
+        by_shard.setdefault(row['shard'] or DEFAULT_DB_ALIAS, []).append(row['pk'])
+    counts, latest = {}, {}
+    for alias, chat_ids in by_shard.items():
+        live = Message.objects.using(alias).filter(chat_id__in=chat_ids, archived=False).order_by()
+        counts.update(live.values('chat_id').annotate(count=Count('pk')).values_list('chat_id', 'count'))
+        latest.update(get_latest_messages(alias, chat_ids))
+    for row in rows:
+        last_message_at, last_message_id = latest.get(row['pk'], (row['created_at'], None))
+        row.update(
+            expected_message_count=counts.get(row['pk'], 0),
+            expected_last_message_at=last_message_at,
+            expected_last_message_id=last_message_id,
+        )
+    return rows
+
+
+def refresh_chat_counters(chats, batch_size=1000, dry_run=False):
+    """
+    Recompute the counters of the chats in batches and repair the ones that drifted.
+    Returns the number of chats whose counters were wrong.
+
+    With sharded messages a chat is only repaired if its counters did not change since
+    they were read, a chat that is busy meanwhile is checked again on the next run.
+    """
+    values = get_counter_values()
+    fields = list(Chat.COUNTER_FIELDS)
+    expected = {f'expected_{field}': values[field] for field in fields}
+    sharded = is_sharded()
+    stale_count = 0
+    last_pk = 0
+    while True:
+        chats_after = chats.filter(pk__gt=last_pk).order_by('pk')
+        if sharded:
+            batch = get_sharded_counters(list(chats_after.values('pk', 'shard', 'created_at', *fields)[:batch_size]))
+        else:
+            batch = list(chats_after.annotate(**expected).values('pk', *fields, *expected)[:batch_size])
+        if not batch:
+            return stale_count
+        last_pk = batch[-1]['pk']
+        stale = [row for row in batch if any(row[field] != row[f'expected_{field}'] for field in fields)]
+        stale_count += len(stale)
+        if not stale or dry_run:
+            continue
+        if not sharded:
+            Chat.objects.filter(pk__in=[row['pk'] for row in stale]).update(**values)
+            continue
+        for row in stale:
+            Chat.objects.filter(pk=row['pk'], **{field: row[field] for field in fields}).update(
+                **{field: row[f'expected_{field}'] for field in fields}
+            )
@@ -0,0 +1,50 @@
+import logging
+import random
+import time
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+
+def is_locked(exc):
+    message = str(exc).lower()
+    return 'database is locked' in message or 'database table is locked' in message
+
+
+def atomic_with_retry(function, *args, using=None, **kwargs):
+    """
+    Run function in a transaction and run it again, after a growing and jittered delay,
+    while SQLite reports the database locked, at most DATABASE_WRITE_RETRIES more times.
+
+    The busy timeout already waits for the lock inside SQLite, this covers the writers
+    that gave up after it. function has to be safe to run again after a rollback. Inside
+    an outer transaction it runs once in a savepoint, only the outermost transaction can
+    start over.
+    """
+    retries = settings.DATABASE_WRITE_RETRIES
+    if connections[using or DEFAULT_DB_ALIAS].in_atomic_block:
+        retries = 0
+    for attempt in range(retries + 1):
+        try:
+            with transaction.atomic(using=using):
+                return function(*args, **kwargs)
+        except OperationalError as exc:
+            if attempt == retries or not is_locked(exc):
+                raise
+            delay = settings.DATABASE_WRITE_RETRY_DELAY * 2 ** attempt * random.uniform(0.5, 1.5)
+            logger.warning('Database locked, retrying %s in %.3fs (%s/%s)', function.__name__, delay, attempt + 1, retries)
+            time.sleep(delay)
+
+
+def on_commit_everywhere(function, aliases=None):
+    """
+    Run function once the transactions open on every database, or on aliases, committed,
+    or right away outside of transactions. It does not run when one of them rolls back.
+    """
+    if aliases is None:
+        aliases = [connection.alias for connection in connections.all(initialized_only=True) if connection.in_atomic_block]
+    if not aliases:
+        function()
+        return
+    transaction.on_commit(lambda: on_commit_everywhere(function, aliases[1:]), using=aliases[0])
@@ -0,0 +1,50 @@
+import django_filters
+from django import forms
+from api.models import Chat, Message, ArchivedMessage, ArchiveJob
+
+
+class IdFilter(django_filters.Filter):
+    """
+    A foreign key id. Values that are not integers within the range of the column are
+    rejected with 400 instead of reaching the query.
+    """
+    field_class = forms.IntegerField
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('min_value', 1)
+        kwargs.setdefault('max_value', 2**63 - 1)
+        super().__init__(*args, **kwargs)
+
+
+class ChatFilter(django_filters.FilterSet):
+    """
+    Filters on the raw foreign key ids, so validating a filter does not look the related row up.
+    """
+    user = IdFilter(field_name='user_id')
+
+    class Meta:
+        model = Chat
+        fields = ['user']
+
+
+class MessageFilter(django_filters.FilterSet):
+    user = IdFilter(field_name='user_id')
+    chat = IdFilter(field_name='chat_id')
+
+    class Meta:
+        model = Message
+        fields = ['user', 'chat']
+
+
+class ArchivedMessageFilter(MessageFilter):
+    class Meta:
+        model = ArchivedMessage
+        fields = ['user', 'chat']
+
+
+class ArchiveJobFilter(django_filters.FilterSet):
+    chat = IdFilter(field_name='chat_id')
+
+    class Meta:
+        model = ArchiveJob
+        fields = ['chat', 'status']
@@ -0,0 +1,159 @@
+import logging
+import statistics
+import threading
+import time
+from collections import deque
+from django.conf import settings
+from django.db import connection
+from api.counters import messages_added
+from api.db import atomic_with_retry
+from api.models import Message
+from api.sharding import lock_chats
+
+logger = logging.getLogger(__name__)
+
+# Flushes kept for the latency percentiles of get_stats()
+RECENT_FLUSHES = 1000
+
+
+class Pending:
+    __slots__ = ('item', 'enqueued', 'done', 'lead', 'error')
+
+    def __init__(self, item):
+        self.item = item
+        self.enqueued = time.monotonic()
+        self.done = threading.Event()
+        self.lead = False
+        self.error = None
+
+
+class GroupCommitQueue:
+    """
+    In-process queue committing the items of concurrent callers together, with one
+    call of flush per batch.
+
+    The first caller to find no flush in progress becomes the leader: it waits until
+    max_batch items are queued or the oldest one waited max_delay seconds, flushes them
+    and hands over to the oldest item left, which leads the next batch. Everyone else
+    blocks until their batch is flushed, so submit() only returns once its item is
+    committed. When a batch fails, its items are flushed one by one, and only the
+    callers whose item failed get the error.
+    """
+    def __init__(self, flush):
+        self.flush = flush
+        self.lock = threading.Lock()
+        self.arrived = threading.Condition(self.lock)
+        self.pending = []
+        self.leading = False
+        self.reset_stats()
+
+    def submit(self, item, max_batch=None, max_delay=None):
+        max_batch = max_batch or settings.MESSAGE_GROUP_COMMIT_MAX_BATCH
+        max_delay = settings.MESSAGE_GROUP_COMMIT_MAX_DELAY if max_delay is None else max_delay
+        entry = Pending(item)
+        with self.lock:
+            self.pending.append(entry)
+            if not self.leading:
+                self.leading = entry.lead = True
+            elif len(self.pending) >= max_batch:
+                self.arrived.notify()
+        if not entry.lead:
+            entry.done.wait()
+        if entry.lead:
+            self.lead(max_batch, max_delay)
+        if entry.error is not None:
+            raise entry.error
+        return item
+
+    def lead(self, max_batch, max_delay):
+        with self.lock:
+            deadline = self.pending[0].enqueued + max_delay
+            while len(self.pending) < max_batch and (remaining := deadline - time.monotonic()) > 0:
+                self.arrived.wait(remaining)
+            batch = self.pending[:max_batch]
+            del self.pending[:max_batch]
+        try:
+            self.commit(batch)
+        finally:
+            with self.lock:
+                if self.pending:
+                    self.pending[0].lead = True
+                    self.pending[0].done.set()
+                else:
+                    self.leading = False
+            for entry in batch:
+                entry.done.set()
+
+    def commit(self, batch):
+        start = time.perf_counter()
+        try:
+            self.flush([entry.item for entry in batch])
+        except Exception as exc:
+            if len(batch) == 1:
+                batch[0].error = exc
+                return
+            logger.warning('Group commit of %s items failed, committing them one by one: %s', len(batch), exc)
+            for entry in batch:
+                self.commit([entry])
+            return
+        self.record(len(batch), time.perf_counter() - start)
+
+    def record(self, size, seconds):
+        with self.lock:
+            self.batches += 1
+            self.items += size
+            self.max_batch_size = max(self.max_batch_size, size)
+            self.recent.append((size, seconds))
+
+    def reset_stats(self):
+        self.batches = self.items = self.max_batch_size = 0
+        self.recent = deque(maxlen=RECENT_FLUSHES)
+
+    def get_stats(self):
+        """
+        Committed batches and items since the start of the process, and the batch sizes
+        and flush latencies of the latest RECENT_FLUSHES batches.
+        """
+        with self.lock:
+            recent = list(self.recent)
+            stats = {'batches': self.batches, 'messages': self.items, 'max_batch_size': self.max_batch_size}
+        sizes = [size for size, seconds in recent]
+        latencies = sorted(seconds * 1000 for size, seconds in recent)
+        stats.update({
+            'mean_batch_size': statistics.mean(sizes) if sizes else None,
+            'flush_ms_p50': latencies[len(latencies) // 2] if latencies else None,
+            'flush_ms_p95': latencies[int(len(latencies) * 0.95)] if latencies else None,
+            'flush_ms_max': latencies[-1] if latencies else None,
+        })
+        return stats
+
+
+def commit_messages(messages):
+    """
+    Insert new messages with one bulk_create and count them on their chats, in one
+    transaction. Like bulk_create, this skips the post_save receivers: the caller
+    publishes the messages and invalidates the cache once they are committed.
+    """
+    def create():
+        for message in messages:
+            message.pk = None
+        with lock_chats(message.chat_id for message in messages):
+            Message.objects.bulk_create(messages)
+            messages_added(messages)
+
+    atomic_with_retry(create)
+
+
+message_queue = GroupCommitQueue(commit_messages)
+
+
+def save_message(message):
+    """
+    Commit a new message in a group commit with the messages of concurrent requests.
+    Inside a transaction the message is committed on its own, since the batch would
+    otherwise only be durable once that transaction commits.
+    """
+    if connection.in_atomic_block:
+        commit_messages([message])
+        return message
+    return message_queue.submit(message)
@@ -0,0 +1,216 @@
+import heapq
+import zlib
+from itertools import groupby, islice
+from operator import itemgetter
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connections, transaction
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from api.cache import invalidate_users
+from api.counters import refresh_chat_counters
+from api.models import Chat, Message, ArchivedMessage
+from api.pagination import keyset_filter
+from api.renderers import FastJSONRenderer
+from api.representations import MESSAGE_FIELDS, get_datetime_representation, represent_messages
+from api.serializers import ChatSyncSerializer
+from api.sharding import allocate_ids, is_sharded, lock_chats
+
+CHAT_FIELDS = ChatSyncSerializer.Meta.fields
+MESSAGE_ORDERING = ('created_at', 'id')
+MESSAGE_COLUMNS = ('user_id', 'chat_id', 'content', 'archived', 'created_at', 'updated_at')
+
+
+def keyset_chunks(queryset, ordering, chunk_size):
+    """
+    The rows of a values() queryset in ordering, fetched chunk_size at a time after the
+    last row of the previous chunk. Memory and the cost of every query stay the same
+    however many rows there are, and no cursor or transaction stays open in between.
+    """
+    queryset = queryset.order_by(*ordering)
+    chunk = queryset
+    while True:
+        rows = list(chunk[:chunk_size])
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        chunk = queryset.filter(keyset_filter(ordering, [rows[-1][name] for name in ordering]))
+
+
+def export_chats(chats, chunk_size=None, counts=None):
+    """
+    The NDJSON export of the chats of a Chat queryset, in blocks of about chunk_size lines.
+    counts, a dict, gets the number of exported records by type.
+
+    Every chat is a `chat` record in the shape of ChatSyncSerializer, followed by its live
+    and archived messages as `message` records in the shape of MessageSerializer, in
+    (created_at, id) order.
+    """
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    counts = {} if counts is None else counts
+    counts.setdefault('chat', 0)
+    counts.setdefault('message', 0)
+    render = FastJSONRenderer().render
+    represent_datetime = get_datetime_representation()
+    for chat in keyset_chunks(chats.values(*CHAT_FIELDS), ('id',), chunk_size):
+        record = {
+            'type': 'chat', **chat,
+            'created_at': represent_datetime(chat['created_at']), 'updated_at': represent_datetime(chat['updated_at']),
+        }
+        lines = [render(record) + b'\n']
+        counts['chat'] += 1
+        # Messages are moved between both tables by archive jobs, an export during one sees both.
+        sources = [
+            keyset_chunks(model.objects.filter(chat_id=chat['id']).values(*MESSAGE_FIELDS), MESSAGE_ORDERING, chunk_size)
+            for model in (Message, ArchivedMessage)
+        ]
+        messages = heapq.merge(*sources, key=itemgetter(*MESSAGE_ORDERING))
+        while batch := list(islice(messages, chunk_size)):
+            lines += [render({'type': 'message', **message}) + b'\n' for message in represent_messages(batch)]
+            counts['message'] += len(batch)
+            yield b''.join(lines)
+            lines = []
+        if lines:
+            yield b''.join(lines)
+
+
+def gzip_stream(blocks):
+    """
+    Compress a stream of bytes blocks into a gzip stream, without holding it in memory.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for block in blocks:
+        if data := compressor.compress(block):
+            yield data
+    yield compressor.flush()
+
+
+async def iterate_in_thread(blocks):
+    """
+    Iterate over a sync iterator from an async context, each step running in the thread
+    of sync_to_async as the ORM requires.
+    """
+    blocks = iter(blocks)
+    done = object()
+    while (block := await sync_to_async(next)(blocks, done)) is not done:
+        yield block
+
+
+def export_response(chats, filename, compress=False, request=None):
+    """
+    A StreamingHttpResponse downloading the export of chats as filename.ndjson, or
+    filename.ndjson.gz when compress is true.
+
+    Under ASGI Django buffers the whole content of a sync iterator before sending it, so
+    when request is an ASGI request the blocks are streamed from an async iterator.
+    """
+    blocks = export_chats(chats)
+    if compress:
+        blocks = gzip_stream(blocks)
+        content_type = 'application/gzip'
+        filename = f'{filename}.ndjson.gz'
+    else:
+        content_type = 'application/x-ndjson'
+        filename = f'{filename}.ndjson'
+    if isinstance(getattr(request, '_request', request), ASGIRequest):
+        blocks = iterate_in_thread(blocks)
+    response = StreamingHttpResponse(blocks, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def split_chats(records):
+    """
+    Pairs of a chat record and an iterator over its message records, read lazily.
+    """
+    pending = None
+    for is_chat, group in groupby(records, key=lambda record: record.get('type') == 'chat'):
+        if is_chat:
+            if pending is not None:
+                yield pending, iter(())
+            *empty, pending = group
+            for chat in empty:
+                yield chat, iter(())
+        elif pending is None:
+            raise ValueError('The export has to start with a chat record.')
+        else:
+            yield pending, group
+            pending = None
+    if pending is not None:
+        yield pending, iter(())
+
+
+def parse_timestamp(value):
+    parsed = parse_datetime(value) if isinstance(value, str) else None
+    if parsed is None:
+        raise ValueError(f'Invalid timestamp {value!r}.')
+    return parsed
+
+
+def import_chats(records, user_id=None, batch_size=1000):
+    """
+    Create the chats of exported records with their messages, under new ids. Returns the
+    number of imported chats and messages.
+
+    Chats and messages keep their users, or all belong to user_id when given, their
+    content and creation time. Their update time is the time of the import, so clients
+    syncing with `since` receive them. Each chat is imported in one transaction, with its
+    messages inserted batch_size at a time, and archived afterwards if it was archived.
+    """
+    chats = messages = 0
+    for chat_record, message_records in split_chats(records):
+        messages += import_chat(chat_record, message_records, user_id, batch_size)
+        chats += 1
+    return chats, messages
+
+
+def import_chat(record, message_records, user_id, batch_size):
+    now = timezone.now()
+    with transaction.atomic():
+        chat = Chat.objects.create(user_id=user_id or record['user'])
+        Chat.objects.filter(pk=chat.pk).update(created_at=parse_timestamp(record['created_at']))
+        imported = 0
+        with lock_chats([chat.pk]) as shards:
+            alias = shards[chat.pk]
+            while batch := list(islice(message_records, batch_size)):
+                rows = []
+                for message in batch:
+                    if message.get('type') != 'message' or message.get('chat') != record['id']:
+                        raise ValueError(f"Unexpected record after chat {record['id']}: {message!r}")
+                    rows.append((
+                        user_id or message['user'], chat.pk, message['content'], bool(message['archived']),
+                        parse_timestamp(message['created_at']), now,
+                    ))
+                insert_messages(connections[alias], rows)
+                imported += len(rows)
+            refresh_chat_counters(Chat.objects.filter(pk=chat.pk))
+        if record.get('archived'):
+            chat.refresh_from_db()
+            chat.archived = True
+            chat.save()
+    invalidate_users([chat.user_id])
+    return imported
+
+
+def insert_messages(connection, rows):
+    """
+    Insert (user_id, chat_id, content, archived, created_at, updated_at) rows with one
+    executemany, with ids from the message sequence when messages are sharded. Unlike
+    bulk_create, the creation times are kept.
+    """
+    if not rows:
+        return
+    columns = MESSAGE_COLUMNS
+    adapt = connection.ops.adapt_datetimefield_value
+    rows = [(*row[:4], adapt(row[4]), adapt(row[5])) for row in rows]
+    if is_sharded():
+        columns = ('id', *columns)
+        rows = [(pk, *row) for pk, row in zip(allocate_ids(len(rows)), rows)]
+    quote = connection.ops.quote_name
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        quote(Message._meta.db_table), ', '.join(quote(column) for column in columns), ', '.join(['%s'] * len(columns)),
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
@@ -0,0 +1,135 @@
+import logging
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from api.archive import move_messages
+from api.cache import invalidate_chats
+from api.db import atomic_with_retry
+from api.counters import messages_archived, refresh_chat_counters
+from api.models import ArchivedMessage, ArchiveJob, Chat, Message
+from api.realtime import publish
+from api.sharding import lock_chats, shard_for_chat
+
+logger = logging.getLogger(__name__)
+
+
+class JobLost(Exception):
+    """
+    The job was canceled, or claimed by another runner after its lease expired.
+    """
+
+
+def start_archive_jobs(jobs):
+    """
+    Schedule jobs once the current transaction commits, according to ARCHIVE_JOB_RUNNER:
+    'thread' runs them in a background thread, 'eager' runs them inline and 'worker'
+    leaves them to the run_archive_jobs management command.
+
+    The unfinished jobs of the same chats are canceled, the new ones move all messages.
+    """
+    runner = settings.ARCHIVE_JOB_RUNNER
+    job_ids = [job.pk for job in jobs]
+    ArchiveJob.objects.filter(
+        chat_id__in={job.chat_id for job in jobs},
+        status__in=[ArchiveJob.Status.PENDING, ArchiveJob.Status.RUNNING, ArchiveJob.Status.FAILED],
+    ).exclude(pk__in=job_ids).update(status=ArchiveJob.Status.CANCELED, updated_at=timezone.now())
+    if runner == 'thread':
+        transaction.on_commit(lambda: threading.Thread(target=run_archive_jobs_in_thread, args=(job_ids,), daemon=True).start())
+    elif runner == 'eager':
+        transaction.on_commit(lambda: [run_archive_job(job_id) for job_id in job_ids])
+
+
+def run_archive_jobs_in_thread(job_ids):
+    try:
+        for job_id in job_ids:
+            run_archive_job(job_id)
+    finally:
+        connections.close_all()
+
+
+def claim_archive_job(job_id, retry_failed=False):
+    """
+    Mark the job running for this runner, if it is pending, failed with retry_failed, or
+    running with an expired ARCHIVE_JOB_LEASE. Returns whether it was claimed.
+    """
+    now = timezone.now()
+    claimable = Q(status=ArchiveJob.Status.PENDING) | Q(
+        status=ArchiveJob.Status.RUNNING, updated_at__lt=now - timedelta(seconds=settings.ARCHIVE_JOB_LEASE),
+    )
+    if retry_failed:
+        claimable |= Q(status=ArchiveJob.Status.FAILED)
+    return bool(ArchiveJob.objects.filter(claimable, pk=job_id).update(
+        status=ArchiveJob.Status.RUNNING, error='', updated_at=now,
+    ))
+
+
+def advance_archive_job(job, **fields):
+    """
+    Update the job and renew its lease, if it is still running from the cursor this runner
+    last wrote, otherwise raise JobLost.
+    """
+    owned = ArchiveJob.objects.filter(pk=job.pk, status=ArchiveJob.Status.RUNNING, last_message_id=job.last_message_id)
+    if not owned.update(updated_at=timezone.now(), **fields):
+        raise JobLost(job.pk)
+
+
+def run_archive_job(job_id, retry_failed=False):
+    """
+    Move the messages of the job's chat to the archive table, or back, in chunks of
+    ARCHIVE_JOB_CHUNK_SIZE. Messages come back unarchived.
+
+    The job is claimed first, a job another runner holds is returned as it is. Each chunk
+    commits together with the job's cursor, so a job interrupted at any point continues
+    where it stopped when it is run again, and no transaction holds the write lock for
+    longer than one chunk. A chunk only commits while the job is still running from the
+    same cursor, a canceled job or one claimed again meanwhile stops. Sharded messages
+    move on the chat's shard, read again for every chunk under lock_chats, where the chunk
+    commits just before the cursor.
+    """
+    if not claim_archive_job(job_id, retry_failed):
+        return ArchiveJob.objects.get(pk=job_id)
+    job = ArchiveJob.objects.get(pk=job_id)
+    source = Message if job.archived else ArchivedMessage
+    if job.total is None:
+        pending = source.objects.using(shard_for_chat(job.chat_id)).filter(chat_id=job.chat_id)
+        job.total = job.processed + pending.filter(id__gt=job.last_message_id).count()
+        ArchiveJob.objects.filter(pk=job.pk).update(total=job.total)
+
+    def move_chunk():
+        with lock_chats([job.chat_id]) as shards:
+            shard = shards[job.chat_id]
+            chunk = list(
+                source.objects.using(shard).filter(chat_id=job.chat_id, id__gt=job.last_message_id).order_by('id')
+                .values_list('id', 'archived')[:settings.ARCHIVE_JOB_CHUNK_SIZE]
+            )
+            if not chunk:
+                return None
+            last_id = chunk[-1][0]
+            moved = move_messages(connections[shard], job.archived, job.chat_id, timezone.now(), job.last_message_id, last_id)
+            advance_archive_job(job, last_message_id=last_id, processed=job.processed + moved)
+        live = sum(not archived for _, archived in chunk) if job.archived else moved
+        messages_archived(job.chat_id, live, job.archived)
+        return last_id, moved
+
+    try:
+        # The job only advances once a chunk committed, a retried chunk starts from the same cursor.
+        while (progress := atomic_with_retry(move_chunk)) is not None:
+            job.last_message_id, moved = progress
+            job.processed += moved
+        with transaction.atomic():
+            advance_archive_job(job, status=ArchiveJob.Status.DONE)
+            refresh_chat_counters(Chat.objects.filter(pk=job.chat_id))
+            invalidate_chats([job.chat_id])
+            publish(job.chat_id, 'chat.archived' if job.archived else 'chat.unarchived', {'chat': job.chat_id})
+    except JobLost:
+        logger.info('Archive job %s was canceled or claimed by another runner', job.pk)
+    except Exception as exc:
+        logger.exception('Archive job %s failed', job.pk)
+        ArchiveJob.objects.filter(pk=job.pk, status=ArchiveJob.Status.RUNNING).update(
+            status=ArchiveJob.Status.FAILED, error=str(exc), updated_at=timezone.now(),
+        )
+    job.refresh_from_db()
+    return job
@@ -0,0 +1,179 @@
+import json
+import random
+import statistics
+import subprocess
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+from api.models import User, Chat
+
+# Endpoint name: (method, url name, SQL queries a request may issue at most)
+ENDPOINTS = {
+    'messages': ('GET', 'message-list', 3),
+    'chats': ('GET', 'chat-list', 5),
+    'users-me': ('GET', 'user-me', 2),
+    'messages-create': ('POST', 'message-create', 7),
+}
+
+USERNAME_PREFIX = 'bench_'
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the main API endpoints under concurrent load and checks their SQL query budgets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--chats-per-user', type=int, default=5)
+        parser.add_argument('--messages-per-chat', type=int, default=20)
+        parser.add_argument('--skew', type=float, default=0.0, help='Zipf exponent of the chat sizes, see populate_db')
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--endpoints', nargs='+', choices=list(ENDPOINTS), default=list(ENDPOINTS))
+        parser.add_argument('--requests', type=int, default=500, help='Requests per endpoint')
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--url', help='Base URL of a running server, the WSGI application is driven in-process by default')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--check', action='store_true', help='Fail when an endpoint exceeds its query budget or has errors')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        call_command(
+            'populate_db', users=options['users'], chats_per_user=options['chats_per_user'],
+            messages_per_chat=options['messages_per_chat'], skew=options['skew'], seed=options['seed'],
+            batch_size=options['batch_size'], prefix=USERNAME_PREFIX, stdout=self.stdout,
+        )
+
+        users = list(User.objects.filter(username__startswith=USERNAME_PREFIX).order_by('pk')[:options['users']])
+        chats = {}
+        for chat_id, user_id in Chat.objects.filter(user__in=users).values_list('pk', 'user_id'):
+            chats.setdefault(user_id, []).append(chat_id)
+        self.clients = [(str(AccessToken.for_user(user)), user.pk, chats.get(user.pk, [])) for user in users]
+
+        results = {}
+        for name in options['endpoints']:
+            results[name] = self.run(name, options)
+
+        self.stdout.write(
+            f"{'endpoint':<18}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+            f"{'queries':>10}{'budget':>8}{'errors':>8}"
+        )
+        for name, result in results.items():
+            queries = '-' if result['queries_per_request'] is None else f"{result['queries_per_request']:.1f}"
+            self.stdout.write(
+                f"{name:<18}{result['throughput']:>10.1f}{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}"
+                f"{result['p99_ms']:>10.1f}{queries:>10}{result['query_budget']:>8}{result['errors']:>8}"
+            )
+
+        if options['output']:
+            report = {
+                'commit': self.get_commit(),
+                'timestamp': timezone.now().isoformat(),
+                'dataset': {
+                    'users': options['users'],
+                    'chats_per_user': options['chats_per_user'],
+                    'messages_per_chat': options['messages_per_chat'],
+                    'skew': options['skew'],
+                },
+                'requests': options['requests'],
+                'concurrency': options['concurrency'],
+                'url': options['url'],
+                'results': results,
+            }
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+        if options['check']:
+            failed = [name for name, result in results.items() if not result['ok']]
+            if failed:
+                raise CommandError(f"Over budget or failing: {', '.join(failed)}")
+
+    def run(self, name, options):
+        method, url_name, budget = ENDPOINTS[name]
+        path = reverse(url_name)
+        send = self.send_http if options['url'] else self.send_wsgi
+
+        def request(i):
+            token, user_id, chats = self.clients[i % len(self.clients)]
+            body = None
+            if method == 'POST':
+                if not chats:
+                    return 0.0, True, None
+                body = json.dumps({'user': user_id, 'chat': self.random.choice(chats), 'content': 'Benchmark'})
+            return send(options['url'], method, path, token, body)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as clients:
+            responses = list(clients.map(request, range(options['requests'])))
+        elapsed = time.perf_counter() - start
+
+        latencies = [r[0] for r in responses]
+        errors = sum(r[1] for r in responses)
+        queries = [r[2] for r in responses if r[2] is not None]
+        p = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else [latencies[0]] * 99
+        queries_per_request = statistics.mean(queries) if queries else None
+        return {
+            'method': method,
+            'path': path,
+            'requests': len(responses),
+            'errors': errors,
+            'throughput': len(responses) / elapsed,
+            'p50_ms': p[49] * 1000,
+            'p95_ms': p[94] * 1000,
+            'p99_ms': p[98] * 1000,
+            'queries_per_request': queries_per_request,
+            'max_queries': max(queries) if queries else None,
+            'query_budget': budget,
+            'ok': not errors and (not queries or max(queries) <= budget),
+        }
+
+    def send_wsgi(self, url, method, path, token, body):
+        from chat.wsgi import application
+
+        body = (body or '').encode()
+        environ = {
+            'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': '', 'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80', 'HTTP_HOST': 'localhost', 'HTTP_AUTHORIZATION': f'Bearer {token}',
+            'CONTENT_TYPE': 'application/json', 'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': BytesIO(body), 'wsgi.url_scheme': 'http', 'wsgi.errors': BytesIO(),
+        }
+        status = []
+        queries = []
+
+        def count(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        with connection.execute_wrapper(count):
+            b''.join(application(environ, lambda s, headers: status.append(s)))
+        return time.perf_counter() - start, status[0][0] != '2', len(queries)
+
+    def send_http(self, url, method, path, token, body):
+        request = urllib.request.Request(
+            url.rstrip('/') + path, method=method, data=body.encode() if body else None,
+            headers={'Authorization': f'Bearer {token}', 'Content-Type': 'application/json'},
+        )
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+            failed = False
+        except (urllib.error.URLError, OSError):
+            failed = True
+        return time.perf_counter() - start, failed, None
+
+    def get_commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
@@ -0,0 +1,101 @@
+import json
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import CommandError
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+from api.groupcommit import message_queue
+from api.management.commands import bench_api
+from api.models import User, Chat
+
+MODES = ('direct', 'group')
+
+
+class Command(bench_api.Command):
+    help = (
+        'Compares the throughput of /api/messages/create/ on the current database when every message commits '
+        'its own transaction and with the group commit of MESSAGE_GROUP_COMMIT'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+        parser.add_argument('--requests', type=int, default=1000, help='Messages posted in each mode')
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--max-batch', type=int, help='MESSAGE_GROUP_COMMIT_MAX_BATCH of the run')
+        parser.add_argument('--max-delay', type=float, help='MESSAGE_GROUP_COMMIT_MAX_DELAY of the run, in seconds')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        chats = {}
+        for chat_id, user_id in Chat.objects.filter(archived=False).order_by('pk').values_list('pk', 'user_id')[:1000]:
+            chats.setdefault(user_id, []).append(chat_id)
+        if not chats:
+            raise CommandError('There are no chats to post messages in, run populate_db first.')
+        self.clients = [(str(AccessToken.for_user(user)), user.pk, chats[user.pk]) for user in User.objects.filter(pk__in=chats)]
+
+        group_settings = {}
+        if options['max_batch']:
+            group_settings['MESSAGE_GROUP_COMMIT_MAX_BATCH'] = options['max_batch']
+        if options['max_delay'] is not None:
+            group_settings['MESSAGE_GROUP_COMMIT_MAX_DELAY'] = options['max_delay']
+        results = {}
+        for mode in options['modes']:
+            with override_settings(MESSAGE_GROUP_COMMIT=mode == 'group', **group_settings):
+                message_queue.reset_stats()
+                results[mode] = self.run_mode(options)
+                if mode == 'group':
+                    results[mode]['group_commit'] = message_queue.get_stats()
+
+        self.stdout.write(
+            f"{'mode':<8}{'msgs/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'queries':>9}{'errors':>8}{'batch':>8}{'flush ms':>10}"
+        )
+        for mode, result in results.items():
+            stats = result.get('group_commit')
+            batch = f"{stats['mean_batch_size']:>8.1f}{stats['flush_ms_p50']:>10.2f}" if stats and stats['batches'] else ''
+            self.stdout.write(
+                f"{mode:<8}{result['throughput']:>10.1f}{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}"
+                f"{result['queries_per_request']:>9.1f}{result['errors']:>8}{batch}"
+            )
+        if {'direct', 'group'} <= results.keys():
+            self.stdout.write(f"Group commit: {results['group']['throughput'] / results['direct']['throughput']:.1f}x the throughput")
+
+        if options['output']:
+            report = {
+                'commit': self.get_commit(),
+                'timestamp': timezone.now().isoformat(),
+                'requests': options['requests'],
+                'concurrency': options['concurrency'],
+                'results': results,
+            }
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+    def run_mode(self, options):
+        path = reverse('message-create')
+
+        def request(i):
+            token, user_id, chats = self.clients[i % len(self.clients)]
+            body = json.dumps({'user': user_id, 'chat': self.random.choice(chats), 'content': 'Benchmark'})
+            return self.send_wsgi(None, 'POST', path, token, body)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as clients:
+            responses = list(clients.map(request, range(options['requests'])))
+        elapsed = time.perf_counter() - start
+
+        latencies = [response[0] for response in responses]
+        p = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else [latencies[0]] * 99
+        return {
+            'requests': len(responses),
+            'errors': sum(response[1] for response in responses),
+            'throughput': len(responses) / elapsed,
+            'p50_ms': p[49] * 1000,
+            'p95_ms': p[94] * 1000,
+            'queries_per_request': statistics.mean(response[2] for response in responses),
+        }
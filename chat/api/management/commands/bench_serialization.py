@@ -0,0 +1,99 @@
+import json
+import statistics
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework import generics
+from rest_framework.renderers import JSONRenderer
+from api import renderers
+from api.models import Chat, Message
+from api.renderers import FastJSONRenderer
+from api.representations import CHAT_VALUES_FIELDS, MESSAGE_FIELDS, represent_chats, represent_messages
+from api.serializers import ChatSerializer, MessageSerializer
+from api.views import ChatQuerysetMixin
+
+PHASES = ('fetch', 'serialize', 'render')
+
+
+class ChatQueryset(ChatQuerysetMixin, generics.GenericAPIView):
+    queryset = Chat.objects.all()
+
+
+class Command(BaseCommand):
+    help = (
+        'Times fetching, serializing and rendering a page of messages and of chats through the '
+        'serializers and through the values() path of FAST_LIST_SERIALIZATION, per 1,000 rows'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help='Rows of each page, taken from the current database')
+        parser.add_argument('--repeat', type=int, default=20, help='Runs of each path, the median is reported')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+
+    def handle(self, *args, **options):
+        rows, repeat = options['rows'], options['repeat']
+        messages = Message.objects.order_by('created_at', 'id')[:rows]
+        chats = ChatQueryset().get_queryset().order_by('created_at', 'id')[:rows]
+        benchmarks = {
+            'messages': {
+                'serializer': (messages, lambda page: MessageSerializer(page, many=True).data, JSONRenderer()),
+                'values': (messages.values(*MESSAGE_FIELDS), represent_messages, FastJSONRenderer()),
+            },
+            'chats': {
+                'serializer': (chats, lambda page: ChatSerializer(page, many=True).data, JSONRenderer()),
+                'values': (chats.prefetch_related(None).values(*CHAT_VALUES_FIELDS), represent_chats, FastJSONRenderer()),
+            },
+        }
+
+        results = {}
+        for name, paths in benchmarks.items():
+            count = paths['serializer'][0].count()
+            if not count:
+                raise CommandError(f'There are no {name} to serialize, run populate_db first.')
+            result = {'rows': count}
+            rendered = {}
+            for path, (queryset, represent, renderer) in paths.items():
+                timings, rendered[path] = self.run(queryset, represent, renderer, repeat)
+                result[path] = {phase: statistics.median(times) * 1000 / count * 1000 for phase, times in timings.items()}
+            result['speedup'] = result['serializer']['total'] / result['values']['total']
+            result['identical'] = rendered['serializer'] == rendered['values']
+            results[name] = result
+
+        encoder = 'orjson' if renderers.orjson is not None else 'json'
+        self.stdout.write(f'Milliseconds per 1,000 rows, median of {repeat} runs, values path rendered with {encoder}')
+        self.stdout.write(
+            f"{'endpoint':<10}{'path':<12}{'rows':>7}{'fetch':>9}{'serialize':>11}{'render':>9}{'total':>9}{'speedup':>9}"
+        )
+        for name, result in results.items():
+            for path in ('serializer', 'values'):
+                timings = result[path]
+                speedup = f"{result['speedup']:>8.1f}x" if path == 'values' else ''
+                self.stdout.write(
+                    f"{name:<10}{path:<12}{result['rows']:>7}{timings['fetch']:>9.2f}{timings['serialize']:>11.2f}"
+                    f"{timings['render']:>9.2f}{timings['total']:>9.2f}{speedup}"
+                )
+            if not result['identical']:
+                self.stderr.write(f'The two paths rendered different {name}.')
+
+        if options['output']:
+            report = {'timestamp': timezone.now().isoformat(), 'repeat': repeat, 'encoder': encoder, 'results': results}
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+    def run(self, queryset, represent, renderer, repeat):
+        """
+        Seconds spent in each phase on every run, and the bytes of the last run.
+        """
+        timings = {phase: [] for phase in (*PHASES, 'total')}
+        for _ in range(repeat):
+            start = time.perf_counter()
+            page = list(queryset.all())
+            fetched = time.perf_counter()
+            data = represent(page)
+            serialized = time.perf_counter()
+            content = renderer.render(data)
+            rendered = time.perf_counter()
+            for phase, seconds in zip(PHASES, (fetched - start, serialized - fetched, rendered - serialized)):
+                timings[phase].append(seconds)
+            timings['total'].append(rendered - start)
+        return timings, content
@@ -0,0 +1,187 @@
+import json
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from api.db import atomic_with_retry
+from api.models import User, Chat, Message
+
+PROFILES = ('default', 'production')
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures read and write throughput of concurrent clients on a scratch SQLite database, '
+        'with the default connection settings and with the production profile'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', nargs='+', choices=PROFILES, default=list(PROFILES))
+        parser.add_argument('--readers', type=int, default=8, help='Threads listing the latest messages of a chat')
+        parser.add_argument('--writers', type=int, default=4, help='Threads posting messages')
+        parser.add_argument('--seconds', type=float, default=5.0, help='Duration of each run')
+        parser.add_argument('--chats', type=int, default=100)
+        parser.add_argument('--messages', type=int, default=20000, help='Messages in the database before the run')
+        parser.add_argument('--dir', help='Directory of the scratch databases, the system temporary directory by default')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        results = {}
+        for profile in options['profiles']:
+            with self.scratch_database(profile, options['dir']) as alias:
+                self.populate(alias, options)
+                results[profile] = self.run(alias, profile, options)
+
+        self.stdout.write(
+            f"{'profile':<12}{'reads/s':>10}{'writes/s':>10}{'read p95':>10}{'write p95':>11}"
+            f"{'errors':>8}{'retries':>9}"
+        )
+        for profile, result in results.items():
+            self.stdout.write(
+                f"{profile:<12}{result['reads_per_second']:>10.1f}{result['writes_per_second']:>10.1f}"
+                f"{result['read_p95_ms']:>10.1f}{result['write_p95_ms']:>11.1f}{result['errors']:>8}{result['retries']:>9}"
+            )
+
+        if options['output']:
+            report = {
+                'timestamp': timezone.now().isoformat(),
+                'readers': options['readers'],
+                'writers': options['writers'],
+                'seconds': options['seconds'],
+                'messages': options['messages'],
+                'results': results,
+            }
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+    @contextmanager
+    def scratch_database(self, profile, directory):
+        """
+        A migrated database file registered as an extra connection alias for the run.
+        """
+        alias = f'bench_{profile}'
+        with tempfile.TemporaryDirectory(dir=directory) as path:
+            config = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(path, 'db.sqlite3')}
+            if profile == 'production':
+                config.update(OPTIONS=settings.SQLITE_PRODUCTION_OPTIONS, CONN_MAX_AGE=600, CONN_HEALTH_CHECKS=True)
+            connections.settings[alias] = connections.configure_settings({'default': config})['default']
+            try:
+                call_command('migrate', database=alias, verbosity=0)
+                yield alias
+            finally:
+                connections[alias].close()
+                del connections[alias]
+                del connections.settings[alias]
+
+    def populate(self, alias, options):
+        users = User.objects.using(alias).bulk_create([
+            User(username=f'bench_{i}', password='!') for i in range(max(1, options['chats'] // 5))
+        ])
+        chats = Chat.objects.using(alias).bulk_create([
+            Chat(user=users[i % len(users)]) for i in range(options['chats'])
+        ])
+        self.chats = [(chat.pk, chat.user_id) for chat in chats]
+        randomizer = random.Random(options['seed'])
+        batch = []
+        for i in range(options['messages']):
+            chat_id, user_id = randomizer.choice(self.chats)
+            batch.append(Message(chat_id=chat_id, user_id=user_id, content=f'Message {i}'))
+            if len(batch) == 10000:
+                Message.objects.using(alias).bulk_create(batch)
+                batch = []
+        Message.objects.using(alias).bulk_create(batch)
+        connections[alias].close()
+
+    def run(self, alias, profile, options):
+        stop = threading.Event()
+        lock = threading.Lock()
+        reads, writes, errors, retries = [], [], [], []
+
+        def read(randomizer):
+            chat_id, _ = randomizer.choice(self.chats)
+            list(Message.objects.using(alias).filter(chat_id=chat_id).order_by('-created_at', '-id')[:20])
+
+        def write(randomizer):
+            chat_id, user_id = randomizer.choice(self.chats)
+            attempts = []
+
+            # The statements of posting a message: look the chat up, insert, count. bulk_create
+            # skips the signal receivers, which work on the default database.
+            def post():
+                attempts.append(1)
+                chat = Chat.objects.using(alias).get(pk=chat_id)
+                message, = Message.objects.using(alias).bulk_create([Message(chat=chat, user_id=user_id, content='Benchmark')])
+                Chat.objects.using(alias).filter(pk=chat_id).update(
+                    message_count=F('message_count') + 1, last_message_at=message.created_at, last_message_id=message.pk,
+                )
+
+            try:
+                if profile == 'production':
+                    atomic_with_retry(post, using=alias)
+                else:
+                    with transaction.atomic(using=alias):
+                        post()
+            finally:
+                with lock:
+                    retries.append(len(attempts) - 1)
+
+        def client(operation, latencies, seed):
+            randomizer = random.Random(seed)
+            connection = connections[alias]
+            try:
+                while not stop.is_set():
+                    start = time.perf_counter()
+                    try:
+                        operation(randomizer)
+                    except OperationalError:
+                        with lock:
+                            errors.append(1)
+                        continue
+                    finally:
+                        # What request_finished does: close the connection unless it is persistent.
+                        connection.close_if_unusable_or_obsolete()
+                    with lock:
+                        latencies.append(time.perf_counter() - start)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=client, args=(read, reads, options['seed'] + i))
+            for i in range(options['readers'])
+        ] + [
+            threading.Thread(target=client, args=(write, writes, options['seed'] + options['readers'] + i))
+            for i in range(options['writers'])
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(options['seconds'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        return {
+            'reads': len(reads),
+            'writes': len(writes),
+            'reads_per_second': len(reads) / options['seconds'],
+            'writes_per_second': len(writes) / options['seconds'],
+            'read_p95_ms': self.percentile(reads, 95),
+            'write_p95_ms': self.percentile(writes, 95),
+            'errors': len(errors),
+            'retries': sum(retries),
+        }
+
+    @staticmethod
+    def percentile(latencies, percent):
+        if len(latencies) < 2:
+            return latencies[0] * 1000 if latencies else 0.0
+        return statistics.quantiles(latencies, n=100)[percent - 1] * 1000
@@ -0,0 +1,35 @@
+import time
+from api.history import export_chats, gzip_stream
+from api.models import Chat
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        'Writes the given chats, or all chats of the given users, with all their messages to an NDJSON file, '
+        'gzip-compressed when its name ends with .gz'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='File to write, .ndjson or .ndjson.gz')
+        parser.add_argument('--chat', type=int, nargs='+', default=[], help='Chats to export')
+        parser.add_argument('--user', type=int, nargs='+', default=[], help='Users whose chats to export')
+        parser.add_argument('--chunk-size', type=int, default=settings.EXPORT_CHUNK_SIZE, help='Rows read per query')
+
+    def handle(self, *args, **options):
+        if not options['chat'] and not options['user']:
+            raise CommandError('Pass the chats to export with --chat or their users with --user.')
+        chats = Chat.objects.filter(pk__in=options['chat']) | Chat.objects.filter(user_id__in=options['user'])
+        counts = {}
+        blocks = export_chats(chats, options['chunk_size'], counts)
+        if options['output'].endswith('.gz'):
+            blocks = gzip_stream(blocks)
+        start = time.perf_counter()
+        with open(options['output'], 'wb') as f:
+            for block in blocks:
+                f.write(block)
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported {counts['chat']} chats and {counts['message']} messages to {options['output']} "
+            f"in {time.perf_counter() - start:.1f}s."
+        ))
@@ -0,0 +1,47 @@
+import gzip
+import json
+import time
+from api.history import import_chats
+from api.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Imports the chats and messages of an export_history or /api/chats/<id>/export/ file as new chats'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='File to read, .ndjson or .ndjson.gz')
+        parser.add_argument('--user', type=int, help='User owning the imported chats and messages instead of their own')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Messages per INSERT')
+
+    def handle(self, *args, **options):
+        user_ids = {options['user']} if options['user'] else {
+            record['user'] for record in self.read(options['input']) if 'user' in record
+        }
+        if missing := sorted(user_ids - set(User.objects.filter(pk__in=user_ids).values_list('pk', flat=True))):
+            raise CommandError(f'Users not found: {", ".join(map(str, missing))}.')
+
+        start = time.perf_counter()
+        try:
+            chats, messages = import_chats(self.read(options['input']), options['user'], options['batch_size'])
+        except (AttributeError, KeyError, TypeError, ValueError) as exc:
+            # Every chat is imported in its own transaction, the chats before stay imported.
+            raise CommandError(f'Invalid export, the chat it occurred in was not imported: {exc!r}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {chats} chats and {messages} messages in {time.perf_counter() - start:.1f}s.'
+        ))
+
+    def read(self, path):
+        """
+        The records of an export file, decompressed when it is gzipped.
+        """
+        with open(path, 'rb') as f:
+            gzipped = f.read(2) == b'\x1f\x8b'
+        with (gzip.open(path, 'rb') if gzipped else open(path, 'rb')) as f:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    raise CommandError(f'Line {number} is not JSON.')
@@ -1,13 +1,151 @@
 import random
+import time
+from datetime import timedelta
 from api.models import User, Chat, Message
-from django.core.management.base import BaseCommand
-from django.utils import lorem_ipsum
+from api.counters import get_counter_values
+from api.search import deferred_index
+from api.sharding import is_sharded
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import F, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import lorem_ipsum, timezone
 
 
 class Command(BaseCommand):
-    help = 'Creates dummy application data'
+    help = 'Creates dummy application data, or a large generated dataset with --users'
 
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, help='Number of generated users to reach, enables scale mode')
+        parser.add_argument('--chats-per-user', type=int, default=10)
+        parser.add_argument('--messages-per-chat', type=int, default=100, help='Average number of messages per chat')
+        parser.add_argument('--skew', type=float, default=0.0,
+                            help='Zipf exponent of the chat sizes, 0 gives every chat the same size')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=10000, help='Rows per INSERT, users per transaction are derived from it')
+        parser.add_argument('--prefix', default='user_', help='Username prefix of the generated users')
+        parser.add_argument('--days', type=float, default=30,
+                            help='Generated messages are spread over this many days before now, in order within each chat')
+
+    def handle(self, *args, **options):
+        if options['users'] is not None:
+            return self.populate_scale(options)
+        self.populate_demo()
+
+    def populate_scale(self, options):
+        """
+        Top up the users named <prefix><n> to --users, each with --chats-per-user chats.
+
+        Rows are inserted in batches, one transaction per batch of users, and every user
+        shares one pre-computed password hash ("test"). Each chat starts at a random time
+        within the last --days days and its messages follow at random times until now, so
+        they are in the order of their ids. The search index is rebuilt once at the end
+        instead of row by row.
+        """
+        if is_sharded():
+            # The raw inserts bypass the shard directory and the message id sequence.
+            raise CommandError('Scale mode needs MESSAGE_SHARDS to hold a single database.')
+        rng = random.Random(options['seed'])
+        prefix, batch_size = options['prefix'], options['batch_size']
+        existing = User.objects.filter(username__startswith=prefix).count()
+        missing = options['users'] - existing
+        if missing <= 0:
+            self.stdout.write(f'{existing} {prefix}* users already exist.')
+            return
+
+        chats_per_user = options['chats_per_user']
+        counts = self.get_message_counts(missing * chats_per_user, options['messages_per_chat'], options['skew'], rng)
+        password = make_password('test')
+        contents = [lorem_ipsum.words(rng.randint(5, 15), common=False) for _ in range(1000)]
+        now = timezone.now()
+        span = timedelta(days=options['days'])
+        users_per_transaction = max(1, batch_size // max(1, chats_per_user * options['messages_per_chat']))
+
+        start = time.perf_counter()
+        created = 0
+        with deferred_index(connection):
+            for first in range(0, missing, users_per_transaction):
+                numbers = range(existing + first, existing + min(first + users_per_transaction, missing))
+                with transaction.atomic():
+                    users = User.objects.bulk_create(
+                        [User(username=f'{prefix}{n}', password=password) for n in numbers], batch_size=batch_size,
+                    )
+                    chats = Chat.objects.bulk_create(
+                        [Chat(user=user) for user in users for _ in range(chats_per_user)], batch_size=batch_size,
+                    )
+                    rows = []
+                    for chat in chats:
+                        for created_at in self.get_timestamps(counts[created], now - span * rng.random(), now, rng):
+                            rows.append((chat.user_id, chat.pk, rng.choice(contents), False, created_at, created_at))
+                        created += 1
+                        if len(rows) >= batch_size:
+                            self.insert_messages(rows)
+                            rows = []
+                    self.insert_messages(rows)
+                    if chats:
+                        first_message = Message.objects.filter(chat=OuterRef('pk')).values('chat').annotate(first=Min('created_at'))
+                        Chat.objects.filter(pk__gte=chats[0].pk, pk__lte=chats[-1].pk).update(
+                            created_at=Coalesce(Subquery(first_message.values('first')), F('created_at')),
+                            **get_counter_values(),
+                        )
+                self.stdout.write(f'{first + len(numbers)}/{missing} users ({time.perf_counter() - start:.1f}s)')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {missing} users, {len(counts)} chats and {sum(counts)} messages '
+            f'in {time.perf_counter() - start:.1f}s.'
+        ))
+
+    MESSAGE_COLUMNS = ('user_id', 'chat_id', 'content', 'archived', 'created_at', 'updated_at')
+
+    def insert_messages(self, rows):
+        """
+        Insert (user_id, chat_id, content, archived, created_at, updated_at) rows with one
+        executemany. Message.objects.bulk_create prepares every value of every row through
+        the model fields, which costs several times more than the insert itself here.
+        """
+        if not rows:
+            return
+        quote = connection.ops.quote_name
+        sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            quote(Message._meta.db_table),
+            ', '.join(quote(column) for column in self.MESSAGE_COLUMNS),
+            ', '.join(['%s'] * len(self.MESSAGE_COLUMNS)),
+        )
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, rows)
+
+    @staticmethod
+    def get_timestamps(count, start, end, rng):
+        """
+        count increasing random times between start and end, adapted for the raw insert.
+        They are made naive in the database time zone once, adapting aware ones costs more
+        than the rest of a row.
+        """
+        seconds = (end - start).total_seconds()
+        offsets = sorted(rng.random() * seconds for _ in range(count))
+        if timezone.is_aware(start):
+            start = timezone.make_naive(start, connection.timezone)
+        adapt = connection.ops.adapt_datetimefield_value
+        return [adapt(start + timedelta(seconds=offset)) for offset in offsets]
+
+    @staticmethod
+    def get_message_counts(chats, mean, skew, rng):
+        """
+        Split chats * mean messages over the chats with Zipf-distributed sizes, in random order.
+        """
+        if not skew:
+            return [mean] * chats
+        total = chats * mean
+        weights = [1 / rank ** skew for rank in range(1, chats + 1)]
+        scale = total / sum(weights)
+        counts = [int(weight * scale) for weight in weights]
+        for i in rng.sample(range(chats), total - sum(counts)):
+            counts[i] += 1
+        rng.shuffle(counts)
+        return counts
+
+    def populate_demo(self):
 
         admin = User.objects.filter(username='admin').first()
         if not admin:
@@ -0,0 +1,9 @@
+from api.sync import purge_tombstones
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Deletes the sync tombstones older than SYNC_TOMBSTONE_RETENTION'
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Deleted {purge_tombstones()} tombstones.')
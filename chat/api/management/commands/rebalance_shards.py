@@ -0,0 +1,73 @@
+import time
+from api.models import Chat
+from api.sharding import move_chat, plan_rebalance, purge_moved_chats, shard_for_chat
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+
+class Command(BaseCommand):
+    help = (
+        'Evens out the messages over MESSAGE_SHARDS by moving whole chats, '
+        'or moves the given chats to the shard passed with --to'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('chats', nargs='*', type=int, help='Chats to move with --to')
+        parser.add_argument('--to', help='Shard to move the chats to')
+        parser.add_argument('--tolerance', type=float, default=0.1,
+                            help='Fraction above the mean message count a shard may hold before chats move off it')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Messages copied per INSERT')
+        parser.add_argument('--dry-run', action='store_true', help='Only list the moves')
+
+    def handle(self, *args, **options):
+        shards = settings.MESSAGE_SHARDS
+        if len(shards) < 2:
+            raise CommandError('MESSAGE_SHARDS holds a single database, there is nothing to move.')
+        if options['chats']:
+            target = options['to']
+            if target not in shards:
+                raise CommandError(f'--to has to be one of {", ".join(shards)}.')
+            found = set(Chat.objects.filter(pk__in=options['chats']).values_list('pk', flat=True))
+            if missing := sorted(set(options['chats']) - found):
+                raise CommandError(f'Chats not found: {", ".join(map(str, missing))}.')
+            moves = [(chat_id, shard_for_chat(chat_id), target) for chat_id in options['chats']]
+        elif options['to']:
+            raise CommandError('Pass the chats to move to --to.')
+        else:
+            chats = Chat.objects.values_list('pk', 'shard', 'message_count').order_by('pk')
+            moves = plan_rebalance(
+                [(chat_id, shard or DEFAULT_DB_ALIAS, count) for chat_id, shard, count in chats.iterator()],
+                shards, options['tolerance'],
+            )
+
+        moves = [move for move in moves if move[1] != move[2]]
+        if options['dry_run']:
+            for chat_id, source, target in moves:
+                self.stdout.write(f'Chat {chat_id}: {source} -> {target}')
+            self.stdout.write(f'{len(moves)} chats would move.')
+            return
+
+        # Moves and purges an earlier run did not finish.
+        interrupted = dict(Chat.objects.exclude(moving_to='').values_list('pk', 'moving_to'))
+        if Chat.objects.exclude(moved_from='').exists():
+            self.purge()
+        moves = [(chat_id, source, interrupted.pop(chat_id, target)) for chat_id, source, target in moves]
+        moves += [(chat_id, shard_for_chat(chat_id), target) for chat_id, target in interrupted.items()]
+        moved = 0
+        for chat_id, source, target in moves:
+            messages = move_chat(chat_id, target, options['batch_size'])
+            moved += messages
+            self.stdout.write(f'Chat {chat_id}: {source} -> {target}, {messages} messages')
+        self.stdout.write(f'Moved {len(moves)} chats with {moved} messages.')
+        if moves:
+            self.purge()
+
+    def purge(self):
+        """
+        Delete the rows moved chats left behind, once no cached directory entry points at them.
+        """
+        self.stdout.write(f'Waiting {settings.SHARD_DIRECTORY_TIMEOUT}s for cached shard directories to expire.')
+        time.sleep(settings.SHARD_DIRECTORY_TIMEOUT)
+        deleted = purge_moved_chats()
+        self.stdout.write(f'Purged {deleted} rows from the previous shards.')
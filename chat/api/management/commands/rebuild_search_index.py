@@ -0,0 +1,18 @@
+from api.search import optimize_index, rebuild_index
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+
+class Command(BaseCommand):
+    help = 'Recreates the message search index and its triggers from the current messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--optimize', action='store_true', help='Also merge the index into a single segment')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Message search needs SQLite FTS5.')
+        rebuild_index(connection)
+        if options['optimize']:
+            optimize_index(connection)
+        self.stdout.write('Search index rebuilt.')
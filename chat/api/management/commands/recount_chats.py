@@ -0,0 +1,20 @@
+from api.counters import refresh_chat_counters
+from api.models import Chat
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the message counters of chats from their messages and repairs the wrong ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('chats', nargs='*', type=int, help='Only these chats, all by default')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Only report the chats with wrong counters')
+
+    def handle(self, *args, **options):
+        chats = Chat.objects.all()
+        if options['chats']:
+            chats = chats.filter(pk__in=options['chats'])
+        stale = refresh_chat_counters(chats, batch_size=options['batch_size'], dry_run=options['dry_run'])
+        verb = 'have' if options['dry_run'] else 'had'
+        self.stdout.write(f'{stale} chats {verb} wrong counters.')
@@ -0,0 +1,18 @@
+import time
+from api.replication import replicate
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Copies the primary SQLite database onto the DATABASE_REPLICAS, a stand-in for replication in development'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, help='Keep replicating every this many seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            replicate()
+            if not options['interval']:
+                self.stdout.write('Replicated.')
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,21 @@
+from api.jobs import run_archive_job
+from api.models import ArchiveJob
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Runs pending archive jobs and resumes interrupted ones whose lease expired'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retry-failed', action='store_true', help='Also run failed jobs again')
+
+    def handle(self, *args, **options):
+        statuses = [ArchiveJob.Status.PENDING, ArchiveJob.Status.RUNNING]
+        if options['retry_failed']:
+            statuses.append(ArchiveJob.Status.FAILED)
+
+        job_ids = ArchiveJob.objects.filter(status__in=statuses).order_by('pk').values_list('pk', flat=True)
+        for job_id in job_ids:
+            # Running jobs are only claimed once their lease expired, see ARCHIVE_JOB_LEASE.
+            job = run_archive_job(job_id, retry_failed=options['retry_failed'])
+            self.stdout.write(f'{job}: {job.processed}/{job.total} messages')
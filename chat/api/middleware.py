@@ -0,0 +1,119 @@
+import logging
+import time
+from urllib.parse import parse_qs
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import MiddlewareNotUsed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from api.authentication import StatelessJWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, AuthenticationFailed, TokenError
+from api import timing
+from api.routers import ReplicaRequest
+
+logger = logging.getLogger(__name__)
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """
+    Authenticates WebSocket connections with the SimpleJWT access token passed
+    as `?token=<access token>`, since browsers cannot set headers on WebSockets.
+    """
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        query = parse_qs(scope.get('query_string', b'').decode())
+        token = query.get('token', [None])[0]
+        scope['user'] = await self.get_user(token) if token else AnonymousUser()
+        return await super().__call__(scope, receive, send)
+
+    @database_sync_to_async
+    def get_user(self, raw_token):
+        authentication = StatelessJWTAuthentication() if settings.JWT_STATELESS_AUTH else JWTAuthentication()
+        try:
+            return authentication.get_user(authentication.get_validated_token(raw_token))
+        except (InvalidToken, AuthenticationFailed, TokenError):
+            return AnonymousUser()
+
+
+class ServerTimingMiddleware:
+    """
+    Reports query count, SQL, authentication, serializer, render and total view time of each
+    request in a Server-Timing header, and logs requests slower than
+    SLOW_REQUEST_THRESHOLD milliseconds with their slowest statements.
+
+    With REQUEST_TIMING off the middleware removes itself and installs no hooks.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_TIMING:
+            raise MiddlewareNotUsed
+        timing.install()
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        timing.instrument_connections()
+        with timing.RequestTimings() as timings:
+            start = time.perf_counter()
+            response = self.get_response(request)
+            return self.process(request, response, timings, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        timing.instrument_connections()
+        with timing.RequestTimings() as timings:
+            start = time.perf_counter()
+            response = await self.get_response(request)
+            return self.process(request, response, timings, time.perf_counter() - start)
+
+    def process(self, request, response, timings, total):
+        metrics = [f'db;dur={timings.sql_time * 1000:.1f};desc="{timings.query_count} queries"']
+        metrics += [f'{name};dur={duration * 1000:.1f}' for name, duration in timings.durations.items()]
+        metrics.append(f'view;dur={total * 1000:.1f}')
+        response['Server-Timing'] = ', '.join(metrics)
+
+        if total * 1000 >= settings.SLOW_REQUEST_THRESHOLD:
+            statements = ''.join(
+                f'\n  {duration * 1000:.1f}ms {sql}' for duration, sql in timings.slowest(settings.SLOW_REQUEST_STATEMENTS)
+            )
+            logger.warning(
+                'Slow request %s %s %s: %.1fms, %d queries in %.1fms%s', request.method, request.get_full_path(),
+                response.status_code, total * 1000, timings.query_count, timings.sql_time * 1000, statements,
+            )
+        return response
+
+
+class ReplicaMiddleware:
+    """
+    Lets api.routers.ReplicaRouter send the reads of each request to a replica and pin the
+    request, and its user for a while, to the primary once it wrote.
+
+    Without DATABASE_REPLICAS the middleware removes itself.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with ReplicaRequest(request):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        with ReplicaRequest(request):
+            return await self.get_response(request)
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+from api.search import drop_index, rebuild_index
+
+
+def create_search_index(apps, schema_editor):
+    rebuild_index(schema_editor.connection)
+
+
+def drop_search_index(apps, schema_editor):
+    drop_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_archive_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageIndex',
+            fields=[
+                ('message', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='api.message')),
+                ('content', models.TextField()),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'api_message_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index, hints={'model_name': 'message'}),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:58
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    Chat = apps.get_model('api', 'Chat')
+    Message = apps.get_model('api', 'Message')
+    db_alias = schema_editor.connection.alias
+    live = Message.objects.filter(chat=OuterRef('pk'), archived=False)
+    latest = live.order_by('-created_at', '-id')
+    Chat.objects.using(db_alias).update(
+        message_count=Coalesce(Subquery(live.order_by().values('chat').annotate(count=Count('pk')).values('count')), 0),
+        last_message_at=Coalesce(Subquery(latest.values('created_at')[:1]), F('created_at')),
+        last_message_id=Subquery(latest.values('pk')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_sync_tombstones'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='chat',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='last_message_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, help_text='Creation of the latest unarchived message, or of the chat without one'),
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='last_message_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0, help_text='Number of unarchived messages'),
+        ),
+        migrations.AddIndex(
+            model_name='chat',
+            index=models.Index(fields=['user', 'last_message_at', 'id'], name='chat_user_activity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chat',
+            index=models.Index(fields=['last_message_at', 'id'], name='chat_activity_idx'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
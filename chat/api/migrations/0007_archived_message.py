@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:02
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+from django.utils import timezone
+from api.archive import move_messages
+
+
+def archive_messages(apps, schema_editor):
+    Chat = apps.get_model('api', 'Chat')
+    chats = Chat.objects.using(schema_editor.connection.alias).filter(archived=True)
+    now = timezone.now()
+    for chat_id in chats.values_list('pk', flat=True):
+        move_messages(schema_editor.connection, True, chat_id, now)
+    chats.update(message_count=0, last_message_at=F('created_at'), last_message_id=None)
+
+
+def unarchive_messages(apps, schema_editor):
+    Chat = apps.get_model('api', 'Chat')
+    Message = apps.get_model('api', 'Message')
+    chats = Chat.objects.using(schema_editor.connection.alias).filter(archived=True)
+    now = timezone.now()
+    for chat_id in chats.values_list('pk', flat=True):
+        move_messages(schema_editor.connection, False, chat_id, now)
+    Message.objects.using(schema_editor.connection.alias).filter(chat__archived=True).update(archived=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_chat_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedMessage',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('content', models.TextField()),
+                ('archived', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('chat', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_messages', to='api.chat')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_messages', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['chat', 'created_at', 'id'], name='archived_chat_created_idx'), models.Index(fields=['user', 'created_at', 'id'], name='archived_user_created_idx'), models.Index(fields=['created_at', 'id'], name='archived_created_idx')],
+            },
+        ),
+        migrations.RunPython(archive_messages, unarchive_messages),
+    ]
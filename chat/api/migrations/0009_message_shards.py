@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:22
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from api.search import create_index
+
+
+def create_search_triggers(apps, schema_editor):
+    # Changing the foreign keys rebuilds api_message on SQLite, which drops its triggers.
+    create_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_heartbeat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='shard',
+            field=models.CharField(blank=True, editable=False, help_text="Database alias holding the chat's messages, empty for the default database", max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='archivedmessage',
+            name='chat',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='archived_messages', to='api.chat'),
+        ),
+        migrations.AlterField(
+            model_name='archivedmessage',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='archived_messages', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='chat',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='api.chat'),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='messages', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(create_search_triggers, migrations.RunPython.noop, hints={'model_name': 'message'}),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_message_shards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='moved_from',
+            field=models.CharField(blank=True, editable=False, help_text='Previous shard of a moved chat, until its rows there are purged', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='moving_to',
+            field=models.CharField(blank=True, editable=False, help_text="Shard the chat's messages are being copied to, writes to them are refused meanwhile", max_length=100),
+        ),
+    ]
@@ -1,5 +1,8 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
+from api.search import INDEX_TABLE, Match
+from api.sharding import ShardedQuerySet, allocate_ids, is_sharded, place_chat
 
 # Create your models here.
 
@@ -7,32 +10,236 @@ class User(AbstractUser):
     pass
 
 class Chat(models.Model):
+    # Maintained by api.counters, a regular save never writes them.
+    COUNTER_FIELDS = ('message_count', 'last_message_at', 'last_message_id')
+    SHARD_FIELDS = ('shard', 'moving_to', 'moved_from')
+
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chats')
     archived = models.BooleanField(default=False) 
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add, so a new chat's last_message_at can start at the same instant.
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
     updated_at = models.DateTimeField(auto_now=True)
+    message_count = models.PositiveIntegerField(default=0, help_text="Number of unarchived messages")
+    last_message_at = models.DateTimeField(
+        default=timezone.now, help_text="Creation of the latest unarchived message, or of the chat without one",
+    )
+    last_message_id = models.BigIntegerField(null=True, blank=True)
+    shard = models.CharField(
+        max_length=100, blank=True, editable=False,
+        help_text="Database alias holding the chat's messages, empty for the default database",
+    )
+    # Maintained by api.sharding.move_chat, a regular save never writes them.
+    moving_to = models.CharField(
+        max_length=100, blank=True, editable=False,
+        help_text="Shard the chat's messages are being copied to, writes to them are refused meanwhile",
+    )
+    moved_from = models.CharField(
+        max_length=100, blank=True, editable=False,
+        help_text="Previous shard of a moved chat, until its rows there are purged",
+    )
 
     def __str__(self):
         return f"{self.user.username}: {self.id}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'], name='chat_user_created_idx'),
+            models.Index(fields=['created_at', 'id'], name='chat_created_idx'),
+            models.Index(fields=['user', 'updated_at', 'id'], name='chat_user_updated_idx'),
+            models.Index(fields=['updated_at', 'id'], name='chat_updated_idx'),
+            models.Index(fields=['user', 'last_message_at', 'id'], name='chat_user_activity_idx'),
+            models.Index(fields=['last_message_at', 'id'], name='chat_activity_idx'),
+        ]
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_archived = instance.__dict__.get('archived')
+        return instance
+
     def save(self, *args, **kwargs):
         """
-        If the chat is archived, archive all related messages.
+        If the archived flag changed, move all related messages to or from the archive in a
+        background job.
+        The transition is detected against the loaded value, without reading the row again.
+
+        Updates leave the COUNTER_FIELDS and the SHARD_FIELDS alone, so saving a chat loaded
+        before a message was added, or before the chat moved, does not write back stale values.
         """
-        if self.pk:
-            old_chat = Chat.objects.filter(pk=self.pk).first()
-            if old_chat and not old_chat.archived and self.archived:
-                self.messages.update(archived=True)
+        loaded_archived = getattr(self, '_loaded_archived', None)
+        archived_changed = loaded_archived is not None and loaded_archived != self.archived
+        if self._state.adding and self.last_message_id is None:
+            self.last_message_at = self.created_at
+        if self._state.adding and not self.shard and is_sharded():
+            self.shard = place_chat()
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in (*self.COUNTER_FIELDS, *self.SHARD_FIELDS)
+            ]
         super().save(*args, **kwargs)
+        self._loaded_archived = self.archived
+        if archived_changed:
+            from api.jobs import start_archive_jobs
+            start_archive_jobs([ArchiveJob.objects.create(chat=self, archived=self.archived)])
 
 class Message(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='messages')
-    chat = models.ForeignKey(Chat, on_delete=models.CASCADE, related_name="messages")
+    # No database constraints, the users and chats are on another database when the
+    # messages are sharded, see api.sharding.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='messages', db_constraint=False)
+    chat = models.ForeignKey(Chat, on_delete=models.CASCADE, related_name="messages", db_constraint=False)
     content = models.TextField()
     archived = models.BooleanField(default=False) 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ShardedQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.user.username}: {self.content[:20]}..."
-    
\ No newline at end of file
+
+    def save(self, *args, **kwargs):
+        # Sharded messages take their ids from one sequence instead of their shard's.
+        if self._state.adding and self.pk is None and is_sharded():
+            self.pk = allocate_ids(1)[0]
+            kwargs['force_insert'] = True
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_archived = instance.__dict__.get('archived')
+        return instance
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['chat', 'created_at', 'id'], name='message_chat_created_idx'),
+            models.Index(fields=['user', 'created_at', 'id'], name='message_user_created_idx'),
+            models.Index(fields=['created_at', 'id'], name='message_created_idx'),
+            models.Index(fields=['user', 'updated_at', 'id'], name='message_user_updated_idx'),
+            models.Index(fields=['updated_at', 'id'], name='message_updated_idx'),
+            models.Index(fields=['chat'], condition=models.Q(archived=False), name='message_chat_live_idx'),
+        ]
+
+
+class ArchivedMessage(models.Model):
+    """
+    A message of an archived chat. Archive jobs move messages here from Message and back
+    with their ids, see api.archive, so the live table and its indexes only hold live chats.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_messages', db_constraint=False)
+    chat = models.ForeignKey(Chat, on_delete=models.CASCADE, related_name='archived_messages', db_constraint=False)
+    content = models.TextField()
+    archived = models.BooleanField(default=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+
+    objects = ShardedQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.user.username}: {self.content[:20]}..."
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['chat', 'created_at', 'id'], name='archived_chat_created_idx'),
+            models.Index(fields=['user', 'created_at', 'id'], name='archived_user_created_idx'),
+            models.Index(fields=['created_at', 'id'], name='archived_created_idx'),
+        ]
+
+
+class MessageIndex(models.Model):
+    """
+    A message's row in the api_message_fts full-text index, see api.search. Only used
+    to join and filter messages, `rank` is only set in queries with a `match` lookup.
+    """
+    message = models.OneToOneField(Message, primary_key=True, db_column='rowid', db_constraint=False,
+                                   on_delete=models.DO_NOTHING, related_name='search_index')
+    content = models.TextField()
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = INDEX_TABLE
+
+
+MessageIndex._meta.get_field('content').register_lookup(Match)
+
+
+class Heartbeat(models.Model):
+    """
+    A timestamp written on the primary and replicated with everything else. Its age on
+    a replica is that replica's lag, see api.routers.
+    """
+    PK = 1
+
+    at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Heartbeat at {self.at}"
+
+
+class MessageSequence(models.Model):
+    """
+    The last message id handed out while messages are sharded, see api.sharding.allocate_ids.
+    """
+    PK = 1
+
+    last = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"Message ids up to {self.last}"
+
+
+class ArchiveJob(models.Model):
+    """
+    Resumable job (un)archiving the messages of a chat in bounded chunks, see api.jobs.
+    """
+    class Status(models.TextChoices):
+        PENDING = 'pending'
+        RUNNING = 'running'
+        DONE = 'done'
+        FAILED = 'failed'
+        CANCELED = 'canceled'
+
+    chat = models.ForeignKey(Chat, on_delete=models.CASCADE, related_name='archive_jobs')
+    archived = models.BooleanField()
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    last_message_id = models.BigIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(null=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{'Archive' if self.archived else 'Unarchive'} chat {self.chat_id}: {self.status}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status'], name='archivejob_status_idx'),
+        ]
+
+
+class Tombstone(models.Model):
+    """
+    Record of a deleted chat or message, kept for SYNC_TOMBSTONE_RETENTION so the sync
+    feed can report the deletion, see api.sync.
+    """
+    class Kind(models.TextChoices):
+        CHAT = 'chat'
+        MESSAGE = 'message'
+
+    kind = models.CharField(max_length=10, choices=Kind.choices)
+    object_id = models.BigIntegerField()
+    user_id = models.BigIntegerField(help_text="Owner of the deleted object, who may see the deletion")
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Deleted {self.kind} {self.object_id}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user_id', 'deleted_at', 'id'], name='tombstone_user_deleted_idx'),
+            models.Index(fields=['deleted_at', 'id'], name='tombstone_deleted_idx'),
+        ]
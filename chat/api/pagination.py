@@ -0,0 +1,194 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def keyset_filter(ordering, position):
+    """
+    Build the lexicographic "strictly after position" condition for ordering.
+
+    The leading column is additionally bounded with gte/lte so the database can
+    seek into a composite index instead of evaluating the OR on every row.
+    """
+    condition = Q()
+    equal = Q()
+    for field, value in zip(ordering, position):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= equal & Q(**{f'{name}__{lookup}': value})
+        equal &= Q(**{name: value})
+    first = ordering[0]
+    bound = 'lte' if first.startswith('-') else 'gte'
+    return Q(**{f'{first.lstrip("-")}__{bound}': position[0]}) & condition
+
+
+class KeysetCursorPagination(BasePagination):
+    """
+    Opaque cursor pagination keyed on a unique ordering such as (created_at, id).
+
+    Pages are selected with a keyset condition on the ordering columns instead of
+    OFFSET, and no COUNT(*) is issued, so every page costs the same as the first.
+    """
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('created_at', 'id')
+    # Alternative unique orderings selectable with ?ordering=, unknown values are ignored
+    ordering_query_param = 'ordering'
+    orderings = {}
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.get_page_queryset(queryset, request, view)
+        return self.set_page(list(queryset))
+
+    def get_page_queryset(self, queryset, request, view=None):
+        """
+        Return the queryset of the requested page, with one extra row to detect more pages.
+        """
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.reverse, self.position = self.decode_cursor(request, queryset)
+        ordering = self.ordering
+        if self.reverse:
+            ordering = tuple(self._invert(field) for field in ordering)
+
+        queryset = queryset.order_by(*ordering)
+        if self.position is not None:
+            queryset = queryset.filter(self.get_keyset_filter(ordering, self.position))
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, results):
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if self.reverse:
+            self.page.reverse()
+            self.has_next = self.position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.position is not None and bool(self.page)
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                page_size = int(request.query_params[self.page_size_query_param])
+                if page_size > 0:
+                    return min(page_size, self.max_page_size)
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def get_ordering(self, request, queryset, view):
+        return self.orderings.get(request.query_params.get(self.ordering_query_param), self.ordering)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            # A backward page came up empty, so the next page is the first one.
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(False, self.get_position(self.page[-1]))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self.encode_cursor(True, self.get_position(self.page[0]))
+
+    def get_position(self, item):
+        position = []
+        for field in self.ordering:
+            name = field.lstrip('-')
+            value = item[name] if isinstance(item, dict) else getattr(item, name)
+            position.append(value.isoformat() if hasattr(value, 'isoformat') else str(value))
+        return position
+
+    def get_keyset_filter(self, ordering, position):
+        return keyset_filter(ordering, position)
+
+    def encode_cursor(self, reverse, position):
+        payload = json.dumps({'r': int(reverse), 'p': position}, separators=(',', ':'))
+        encoded = base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request, queryset):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return False, None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            reverse = bool(payload['r'])
+            raw_position = payload['p']
+            if len(raw_position) != len(self.ordering):
+                raise ValueError
+            position = [
+                self.get_ordering_field(queryset, field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, raw_position)
+            ]
+        except (TypeError, ValueError, KeyError, UnicodeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        if any(value is None for value in position):
+            raise NotFound(self.invalid_cursor_message)
+        return reverse, position
+
+    @staticmethod
+    def get_ordering_field(queryset, name):
+        """
+        The model field or annotation output field of an ordering column.
+        """
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+        return queryset.model._meta.get_field(name)
+
+    @staticmethod
+    def _invert(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+
+class ChatPagination(KeysetCursorPagination):
+    """
+    Chats by creation, or by latest activity with `?ordering=-last_message_at` for an inbox.
+    """
+    orderings = {
+        'last_message_at': ('last_message_at', 'id'),
+        '-last_message_at': ('-last_message_at', '-id'),
+    }
+
+
+class SearchPagination(KeysetCursorPagination):
+    """
+    Keyset pagination over search results, best matches first. FTS5 ranks are negative
+    and lower for better matches.
+    """
+    ordering = ('rank', 'id')
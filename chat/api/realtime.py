@@ -0,0 +1,26 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+
+def group_name(chat_id):
+    return f'chat_{chat_id}'
+
+
+def publish(chat_id, event, payload):
+    """
+    Fan an event out to every WebSocket connected to the chat once the current
+    transaction commits. The fan-out backend is the configured CHANNEL_LAYERS entry.
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+
+    def send():
+        async_to_sync(channel_layer.group_send)(group_name(chat_id), {
+            'type': 'chat.event',
+            'event': event,
+            'payload': payload,
+        })
+
+    transaction.on_commit(send)
@@ -0,0 +1,30 @@
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer encoding with orjson when it is installed, to the same bytes.
+
+    Values orjson has no native encoding for, datetimes included, are converted by the
+    renderer's encoder class as with JSONRenderer. Indented or ASCII-only output, and
+    data orjson rejects, fall back to JSONRenderer. orjson writes floats in their shortest
+    form without a `+` or leading zeros in the exponent and NaN as null, so views whose
+    data holds floats are better served by JSONRenderer.
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None or data is None or self.ensure_ascii or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Like JSONRenderer, escape the line separators JavaScript does not allow in strings.
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils import timezone
+from api.models import Heartbeat
+
+
+def beat(using=DEFAULT_DB_ALIAS):
+    Heartbeat.objects.using(using).update_or_create(pk=Heartbeat.PK, defaults={'at': timezone.now()})
+
+
+def replicate(replicas=None, source=DEFAULT_DB_ALIAS):
+    """
+    Local stand-in for database replication with SQLite files: write a heartbeat on the
+    primary, then copy the whole primary onto every replica with SQLite's online backup.
+    """
+    beat(source)
+    primary = connections[source]
+    primary.ensure_connection()
+    for alias in settings.DATABASE_REPLICAS if replicas is None else replicas:
+        replica = connections[alias]
+        replica.ensure_connection()
+        primary.connection.backup(replica.connection)
@@ -0,0 +1,118 @@
+from django.conf import settings
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from api.models import Message
+from api.renderers import FastJSONRenderer
+from api.serializers import ChatSerializer, MessagePreviewSerializer, MessageSerializer
+from api.timing import timed
+
+MESSAGE_FIELDS = MessageSerializer.Meta.fields
+CHAT_FIELDS = ChatSerializer.Meta.fields
+PREVIEW_FIELDS = MessagePreviewSerializer.Meta.fields
+CHAT_VALUES_FIELDS = tuple(name for name in CHAT_FIELDS if name != 'latest_messages')
+CHAT_DATETIME_FIELDS = ('last_message_at', 'created_at', 'updated_at')
+
+
+def get_datetime_representation():
+    """
+    Function representing datetimes like the DateTimeField of the serializers. The time
+    zone and format are looked up once, instead of for every value.
+    """
+    field = serializers.DateTimeField()
+    output_format = api_settings.DATETIME_FORMAT
+    if not settings.USE_TZ or output_format is None or output_format.lower() != ISO_8601:
+        return field.to_representation
+    zone = timezone.get_current_timezone()
+
+    def represent(value):
+        if not value or timezone.is_naive(value):
+            return field.to_representation(value)
+        value = value.astimezone(zone).isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+    return represent
+
+
+def represent_messages(rows):
+    """
+    MessageSerializer data of message rows selected with values(*MESSAGE_FIELDS).
+    """
+    represent_datetime = get_datetime_representation()
+    return [
+        {**row, 'created_at': represent_datetime(row['created_at']), 'updated_at': represent_datetime(row['updated_at'])}
+        for row in rows
+    ]
+
+
+def represent_chats(rows):
+    """
+    ChatSerializer data of chat rows selected with values(*CHAT_VALUES_FIELDS). The
+    previews of latest_messages are fetched with one windowed query.
+    """
+    represent_datetime = get_datetime_representation()
+    previews = get_previews([row['id'] for row in rows], represent_datetime)
+    chats = []
+    for row in rows:
+        row = {**row, 'latest_messages': previews.get(row['id'], [])}
+        for name in CHAT_DATETIME_FIELDS:
+            row[name] = represent_datetime(row[name])
+        chats.append({name: row[name] for name in CHAT_FIELDS})
+    return chats
+
+
+def get_previews(chat_ids, represent_datetime):
+    """
+    MessagePreviewSerializer data of the latest CHAT_PREVIEW_SIZE unarchived messages of
+    each chat, newest first, by chat id.
+    """
+    if not chat_ids:
+        return {}
+    latest = Message.objects.filter(chat_id__in=chat_ids, archived=False).annotate(
+        row=Window(RowNumber(), partition_by='chat_id', order_by=[F('created_at').desc(), F('id').desc()]),
+    ).filter(row__lte=settings.CHAT_PREVIEW_SIZE).order_by()
+    rows = sorted(latest.values_list('chat_id', *PREVIEW_FIELDS), key=lambda row: (row[4], row[1]), reverse=True)
+    previews = {}
+    for chat_id, pk, user, content, created_at in rows:
+        previews.setdefault(chat_id, []).append({
+            'id': pk, 'user': user, 'content': content[:settings.CHAT_PREVIEW_LENGTH],
+            'created_at': represent_datetime(created_at),
+        })
+    return previews
+
+
+class ValuesListMixin:
+    """
+    With FAST_LIST_SERIALIZATION, lists pages of values() rows represented by
+    `represent_rows` instead of serializing model instances, and renders JSON with
+    FastJSONRenderer. The response is the same as with the serializer.
+    """
+    # Fields selected for `represent_rows`, none keeps the serializer
+    values_fields = ()
+
+    def uses_values(self):
+        return settings.FAST_LIST_SERIALIZATION and bool(self.values_fields)
+
+    def get_renderers(self):
+        renderers = super().get_renderers()
+        if self.uses_values():
+            renderers = [FastJSONRenderer() if type(renderer) is JSONRenderer else renderer for renderer in renderers]
+        return renderers
+
+    def list(self, request, *args, **kwargs):
+        if not self.uses_values():
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset()).prefetch_related(None).values(*self.values_fields)
+        page = self.paginate_queryset(queryset)
+        # Reported as serialization in the Server-Timing header.
+        represent_rows = timed('serialize', self.represent_rows)
+        if page is None:
+            return Response(represent_rows(list(queryset)))
+        return self.get_paginated_response(represent_rows(page))
+
+    def represent_rows(self, rows):
+        raise NotImplementedError
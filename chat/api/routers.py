@@ -0,0 +1,179 @@
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.utils import timezone
+from django.utils.functional import LazyObject, empty
+from api.sharding import SHARDED_MODELS, is_sharded, shard_for_chat
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('replica_request', default=None)
+_health = {}
+_health_lock = threading.Lock()
+
+
+def pin_key(user_id):
+    return f'replica:pinned:{user_id}'
+
+
+class ReplicaRequest:
+    """
+    Routing state of one request, see ReplicaMiddleware. Once the request wrote, or its
+    user wrote within REPLICA_STICKY_SECONDS, it reads from the primary.
+    """
+    def __init__(self, request):
+        self.request = request
+        self.wrote = False
+        self._pinned_user = None
+        self._pinned = False
+
+    @property
+    def user_id(self):
+        # Only an already resolved user, resolving the session's lazy user reads the database.
+        user = vars(self.request).get('user')
+        if isinstance(user, LazyObject):
+            user = None if user._wrapped is empty else user._wrapped
+        return user.pk if user is not None and user.is_authenticated else None
+
+    def reads_primary(self):
+        if self.wrote:
+            return True
+        user_id = self.user_id
+        if user_id is None:
+            return False
+        if self._pinned_user != user_id:
+            self._pinned_user = user_id
+            self._pinned = bool(cache.get(pin_key(user_id)))
+        return self._pinned
+
+    def finish(self):
+        user_id = self.user_id
+        if self.wrote and user_id is not None:
+            cache.set(pin_key(user_id), True, settings.REPLICA_STICKY_SECONDS)
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _current.reset(self._token)
+        self.finish()
+
+
+def get_lag(alias):
+    """
+    Seconds since the heartbeat replicated to alias was written on the primary.
+    """
+    from api.models import Heartbeat
+
+    beat = Heartbeat.objects.using(alias).filter(pk=Heartbeat.PK).values_list('at', flat=True).first()
+    if beat is None:
+        return float('inf')
+    return (timezone.now() - beat).total_seconds()
+
+
+def is_healthy(alias):
+    """
+    Whether alias is reachable and at most REPLICA_MAX_LAG seconds behind, checked at most
+    every REPLICA_HEALTH_CHECK_INTERVAL seconds per process.
+    """
+    now = time.monotonic()
+    checked = _health.get(alias)
+    if checked is not None and now - checked[0] < settings.REPLICA_HEALTH_CHECK_INTERVAL:
+        return checked[1]
+    try:
+        lag = get_lag(alias)
+        healthy = lag <= settings.REPLICA_MAX_LAG
+        if not healthy:
+            logger.warning('Replica %s is %.1fs behind, reading from the primary', alias, lag)
+    except DatabaseError:
+        logger.warning('Replica %s is unreachable, reading from the primary', alias, exc_info=True)
+        healthy = False
+    with _health_lock:
+        _health[alias] = (now, healthy)
+    return healthy
+
+
+class ReplicaRouter:
+    """
+    Sends the reads of requests to a healthy alias of DATABASE_REPLICAS and everything else
+    to the primary. Reads stay on the primary outside requests, inside transactions, after
+    the request wrote and for REPLICA_STICKY_SECONDS after the user's last write.
+    """
+    def db_for_read(self, model, **hints):
+        state = _current.get()
+        replicas = settings.DATABASE_REPLICAS
+        if state is None or not replicas or state.reads_primary():
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db in (DEFAULT_DB_ALIAS, *replicas):
+            return instance._state.db
+        healthy = [alias for alias in replicas if is_healthy(alias)]
+        return random.choice(healthy) if healthy else None
+
+    def db_for_write(self, model, **hints):
+        state = _current.get()
+        if state is not None:
+            state.wrote = True
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the schema from the primary.
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ShardRouter:
+    """
+    Saves and deletes messages on the shard of their chat and sends the relations followed
+    from a message on a shard back to the default database. Message queries are routed
+    by api.sharding.ShardedQuerySet.
+    """
+    def db_for_read(self, model, **hints):
+        return self.route(model, hints.get('instance'))
+
+    def db_for_write(self, model, **hints):
+        return self.route(model, hints.get('instance'))
+
+    def route(self, model, instance):
+        if instance is None or not is_sharded():
+            return None
+        if model._meta.label_lower not in SHARDED_MODELS:
+            return DEFAULT_DB_ALIAS if instance._state.db in settings.MESSAGE_SHARDS else None
+        if instance._meta.label_lower == 'api.chat':
+            return shard_for_chat(instance)
+        if instance._meta.label_lower in SHARDED_MODELS:
+            # A new message took the alias of the first object assigned to it, the user's
+            # when it was the user, so only a loaded one keeps its alias.
+            if not instance._state.adding:
+                return instance._state.db
+            chat_field = instance._meta.get_field('chat')
+            if chat_field.is_cached(instance):
+                return shard_for_chat(instance.chat)
+            return shard_for_chat(instance.chat_id) if instance.chat_id is not None else None
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if {obj1._meta.label_lower, obj2._meta.label_lower} & SHARDED_MODELS:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Shards only get the tables of the sharded models.
+        if db != DEFAULT_DB_ALIAS and db in settings.MESSAGE_SHARDS:
+            return f'{app_label}.{model_name}' in SHARDED_MODELS
+        return None
@@ -0,0 +1,6 @@
+from django.urls import path
+from api.consumers import ChatConsumer
+
+websocket_urlpatterns = [
+    path('ws/chats/<int:pk>/', ChatConsumer.as_asgi(), name='chat-ws'),
+]
@@ -0,0 +1,131 @@
+import re
+import secrets
+from contextlib import contextmanager
+from django.db import models
+from django.utils.html import escape
+
+INDEX_TABLE = 'api_message_fts'
+# Put around the matches by highlight() before the content is escaped, random so no message can contain them
+MATCH_DELIMITERS = (f'[{secrets.token_hex(8)}]', f'[/{secrets.token_hex(8)}]')
+
+# External content FTS5 table over api_message.content, kept in sync by triggers.
+# Only content changes touch the index, archiving a message leaves it alone.
+CREATE_INDEX = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {INDEX_TABLE} USING fts5(
+        content, content='api_message', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {INDEX_TABLE}_insert AFTER INSERT ON api_message BEGIN
+        INSERT INTO {INDEX_TABLE}(rowid, content) VALUES (new.id, new.content);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {INDEX_TABLE}_delete AFTER DELETE ON api_message BEGIN
+        INSERT INTO {INDEX_TABLE}({INDEX_TABLE}, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {INDEX_TABLE}_update AFTER UPDATE OF content ON api_message BEGIN
+        INSERT INTO {INDEX_TABLE}({INDEX_TABLE}, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO {INDEX_TABLE}(rowid, content) VALUES (new.id, new.content);
+    END""",
+]
+
+DROP_INDEX = [
+    f'DROP TRIGGER IF EXISTS {INDEX_TABLE}_insert',
+    f'DROP TRIGGER IF EXISTS {INDEX_TABLE}_delete',
+    f'DROP TRIGGER IF EXISTS {INDEX_TABLE}_update',
+    f'DROP TABLE IF EXISTS {INDEX_TABLE}',
+]
+
+
+def create_index(connection):
+    """
+    Create the search index and its triggers where missing. SQLite drops the triggers
+    when a migration rebuilds api_message, such migrations call this again.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for sql in CREATE_INDEX:
+            cursor.execute(sql)
+
+
+def drop_index(connection):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for sql in DROP_INDEX:
+            cursor.execute(sql)
+
+
+def rebuild_index(connection):
+    """
+    Re-read every message into the index, for data written while the triggers were missing.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    create_index(connection)
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {INDEX_TABLE}({INDEX_TABLE}) VALUES ('rebuild')")
+
+
+@contextmanager
+def deferred_index(connection):
+    """
+    Skip the index while bulk inserting messages and rebuild it in one pass afterwards,
+    which is several times faster than indexing row by row.
+    """
+    if connection.vendor != 'sqlite':
+        yield
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP TRIGGER IF EXISTS {INDEX_TABLE}_insert')
+    try:
+        yield
+    finally:
+        rebuild_index(connection)
+
+
+def optimize_index(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {INDEX_TABLE}({INDEX_TABLE}) VALUES ('optimize')")
+
+
+def search_query(text):
+    """
+    Turn user input into an FTS5 query matching all of its words. Words are quoted so
+    FTS5 operators and syntax in the input are searched for literally, a trailing *
+    keeps prefix matching.
+    """
+    terms = []
+    for word in text.split():
+        prefix = word.endswith('*')
+        word = word.rstrip('*')
+        if re.search(r'\w', word):
+            terms.append('"{}"{}'.format(word.replace('"', '""'), '*' if prefix else ''))
+    return ' '.join(terms)
+
+
+class Match(models.Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+
+class Highlight(models.Func):
+    """
+    The indexed content of a matched message with the matching words wrapped in start and
+    end, MATCH_DELIMITERS by default. The content is not escaped, see render_highlight.
+    """
+    template = f"highlight({INDEX_TABLE}, 0, %(expressions)s)"
+    output_field = models.TextField()
+
+    def __init__(self, start=MATCH_DELIMITERS[0], end=MATCH_DELIMITERS[1], **extra):
+        super().__init__(models.Value(start), models.Value(end), **extra)
+
+
+def render_highlight(highlighted, start, end):
+    """
+    The output of Highlight() as HTML: the content escaped and the matches wrapped in the
+    start and end markup.
+    """
+    return escape(highlighted).replace(MATCH_DELIMITERS[0], start).replace(MATCH_DELIMITERS[1], end)
@@ -1,26 +1,100 @@
-from api.models import User, Chat, Message
+from django.conf import settings
+from api.models import User, Chat, Message, ArchiveJob
+from api.authentication import ClaimsRefreshToken
+from api.search import render_highlight
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
+from rest_framework.reverse import reverse
+from rest_framework.utils.urls import replace_query_param
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
 
 class UserSerializer(serializers.ModelSerializer):
+    """
+    Lean user representation with relation counts and links to the paginated collections.
+
+    The full `chats`/`messages` id lists are only included when requested through
+    `?expand=chats,messages`.
+    """
+    expandable_fields = ('chats', 'messages')
+
     password = serializers.CharField(write_only=True, required=True)
+    chat_count = serializers.SerializerMethodField()
+    message_count = serializers.SerializerMethodField()
+    chats_url = serializers.SerializerMethodField()
+    messages_url = serializers.SerializerMethodField()
 
     class Meta:
         model = User
-        fields = ('id', 'username', 'password', 'email', 'is_staff', 'is_superuser', 'chats', 'messages')
+        fields = ('id', 'username', 'password', 'email', 'is_staff', 'is_superuser',
+                  'chat_count', 'message_count', 'chats_url', 'messages_url')
         extra_kwargs = {
             "password": {"write_only": True, "required": True},
             "is_staff": {"default": False},
             "is_superuser": {"default": False},
-        }           
+        }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for field in self.get_expand(self.context.get('request')):
+            self.fields[field] = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
+
+    @classmethod
+    def get_expand(cls, request):
+        if request is None:
+            return []
+        expand = request.query_params.get('expand', '')
+        return [field for field in cls.expandable_fields if field in expand.split(',')]
+
+    def get_chat_count(self, obj):
+        if hasattr(obj, 'chat_count'):
+            return obj.chat_count
+        return obj.chats.count()
+
+    def get_message_count(self, obj):
+        if hasattr(obj, 'message_count'):
+            return obj.message_count
+        return obj.messages.count()
+
+    def get_chats_url(self, obj):
+        return self._collection_url('chat-list', obj)
+
+    def get_messages_url(self, obj):
+        return self._collection_url('message-list', obj)
+
+    def _collection_url(self, viewname, obj):
+        url = reverse(viewname, request=self.context.get('request'))
+        return replace_query_param(url, 'user', obj.pk)
+
+class MessagePreviewSerializer(serializers.ModelSerializer):
+    content = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Message
+        fields = ('id', 'user', 'content', 'created_at')
+
+    def get_content(self, obj):
+        return obj.content[:settings.CHAT_PREVIEW_LENGTH]
 
 class ChatSerializer(serializers.ModelSerializer):
+    """
+    Inbox representation of a chat: its activity counters and a preview of its latest messages.
+    """
+    latest_messages = serializers.SerializerMethodField()
+
     class Meta:
         model = Chat
-        fields = ('id', 'user', 'messages', 'archived', 'created_at', 'updated_at')
+        fields = ('id', 'user', 'message_count', 'last_message_at', 'last_message_id', 'latest_messages',
+                  'archived', 'created_at', 'updated_at')
+        read_only_fields = Chat.COUNTER_FIELDS
 
     def validate_user(self, value):
         raise ValidationError("You cannot modify the user field.")
+
+    def get_latest_messages(self, obj):
+        messages = getattr(obj, 'latest_messages', None)
+        if messages is None:
+            messages = obj.messages.filter(archived=False).order_by('-created_at', '-id')[:settings.CHAT_PREVIEW_SIZE]
+        return MessagePreviewSerializer(messages, many=True, context=self.context).data
     
 class ChatCreateSerializer(serializers.ModelSerializer):
     user = serializers.PrimaryKeyRelatedField(queryset=User.objects.all())
@@ -28,10 +102,32 @@ class ChatCreateSerializer(serializers.ModelSerializer):
         model = Chat
         fields = ('user',)
 
+class ChatSyncSerializer(serializers.ModelSerializer):
+    """
+    Chat entry of the sync feed, without the counts and previews of ChatSerializer.
+    """
+    class Meta:
+        model = Chat
+        fields = ('id', 'user', 'archived', 'created_at', 'updated_at')
+
 class MessageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Message
-        fields = ('user', 'chat', 'content', 'archived', 'created_at', 'updated_at')
+        fields = ('id', 'user', 'chat', 'content', 'archived', 'created_at', 'updated_at')
+
+class MessageSearchSerializer(MessageSerializer):
+    """
+    A search result: the message, its relevance and its content as escaped HTML with the
+    matches highlighted.
+    """
+    rank = serializers.FloatField(read_only=True)
+    highlight = serializers.SerializerMethodField()
+
+    class Meta(MessageSerializer.Meta):
+        fields = MessageSerializer.Meta.fields + ('rank', 'highlight')
+
+    def get_highlight(self, message):
+        return render_highlight(message.highlight, *settings.SEARCH_HIGHLIGHT)
 
 class MessageCreateSerializer(serializers.ModelSerializer):
     user = serializers.PrimaryKeyRelatedField(queryset=User.objects.all())
@@ -40,3 +136,39 @@ class MessageCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Message
         fields = ('user', 'chat', 'content')
+
+
+class MessageBulkItemSerializer(serializers.Serializer):
+    """
+    One entry of a bulk message creation. The chat is validated in bulk by the view,
+    so it is taken as a plain id instead of a PrimaryKeyRelatedField lookup per item,
+    bounded to the range of the primary key so the lookup never overflows.
+    """
+    chat = serializers.IntegerField(min_value=1, max_value=2**63 - 1)
+    content = serializers.CharField()
+
+
+class ArchiveJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ArchiveJob
+        fields = ('id', 'chat', 'archived', 'status', 'processed', 'total', 'error', 'created_at', 'updated_at')
+
+
+class ChatBulkArchiveSerializer(serializers.Serializer):
+    chats = serializers.ListField(
+        child=serializers.IntegerField(min_value=1, max_value=2**63 - 1), allow_empty=False, max_length=1000,
+    )
+    archived = serializers.BooleanField(default=True)
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """
+    Token pair whose access token carries the flags StatelessJWTAuthentication authorizes with.
+    """
+    token_class = ClaimsRefreshToken
+
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Access tokens refreshed with the current flags of the user, not those of the refresh token.
+    """
+    token_class = ClaimsRefreshToken
@@ -0,0 +1,530 @@
+import random
+import time
+from bisect import bisect_right
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from operator import attrgetter, itemgetter
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
+from django.db import DEFAULT_DB_ALIAS, NotSupportedError, connections, models, transaction
+from django.db.models import Count, F, Max, Min, Subquery, Sum
+from django.db.models.deletion import Collector
+from django.db.models.expressions import OrderBy
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.lookups import Exact, In
+from django.db.models.query import FlatValuesListIterable, ModelIterable, ValuesIterable
+from django.db.models.sql.where import AND, WhereNode
+from rest_framework.exceptions import APIException
+
+# Models whose rows are partitioned by chat over MESSAGE_SHARDS
+SHARDED_MODELS = {'api.message', 'api.archivedmessage', 'api.messageindex'}
+
+COMBINE_AGGREGATES = {Count: sum, Sum: sum, Max: max, Min: min}
+
+_sequence_ready = False
+# Shards of the chats locked by lock_chats in the current context, ahead of the directory
+_locked_shards = ContextVar('locked_shards', default={})
+
+
+class ChatMoving(APIException):
+    status_code = 503
+    default_detail = "The messages of this chat are being moved, try again shortly."
+    default_code = 'chat_moving'
+
+
+def is_sharded():
+    return len(settings.MESSAGE_SHARDS) > 1
+
+
+def directory_key(chat_id):
+    return f'api:shard:{chat_id}'
+
+
+def place_chat():
+    """
+    Shard of a new chat. Chats are spread at random and keep their shard in Chat.shard,
+    so adding a shard later moves nothing.
+    """
+    return random.choice(settings.MESSAGE_SHARDS)
+
+
+def shard_for_chat(chat):
+    """
+    The alias holding the messages of chat, a Chat or a chat id.
+    """
+    if not is_sharded():
+        return DEFAULT_DB_ALIAS
+    if not isinstance(chat, int):
+        if 'shard' in chat.__dict__ and chat.pk not in _locked_shards.get():
+            return chat.shard or DEFAULT_DB_ALIAS
+        chat = chat.pk
+    return shards_for_chats([chat])[chat]
+
+
+def shards_for_chats(chat_ids):
+    """
+    Map chat ids to the alias holding their messages, from the cached directory and one
+    query on the default database for the chats missing from it. Chats locked with
+    lock_chats map to the shard read under the lock.
+    """
+    from api.models import Chat
+
+    chat_ids = set(chat_ids)
+    if not is_sharded():
+        return dict.fromkeys(chat_ids, DEFAULT_DB_ALIAS)
+    locked = _locked_shards.get()
+    shards = {chat_id: locked[chat_id] for chat_id in chat_ids if chat_id in locked}
+    keys = {directory_key(chat_id): chat_id for chat_id in chat_ids - shards.keys()}
+    shards.update({keys[key]: shard for key, shard in cache.get_many(keys).items()})
+    missing = chat_ids - shards.keys()
+    if missing:
+        found = dict(Chat.objects.using(DEFAULT_DB_ALIAS).filter(pk__in=missing).values_list('pk', 'shard'))
+        cache.set_many({directory_key(chat_id): shard for chat_id, shard in found.items()}, settings.SHARD_DIRECTORY_TIMEOUT)
+        shards.update(found)
+    # Chats placed before sharding, and unknown ones, are on the default database.
+    return {chat_id: shards.get(chat_id) or DEFAULT_DB_ALIAS for chat_id in chat_ids}
+
+
+def filtered_chat_ids(query):
+    """
+    The chat ids a query is restricted to by a `chat` equality or `in` filter that every
+    row has to match, or None.
+    """
+    field = query.get_meta().get_field('chat')
+    nodes = [query.where]
+    while nodes:
+        node = nodes.pop()
+        if node.connector != AND or node.negated:
+            continue
+        for child in node.children:
+            if isinstance(child, WhereNode):
+                nodes.append(child)
+            elif getattr(getattr(child, 'lhs', None), 'target', None) is not field:
+                continue
+            elif isinstance(child, Exact) and isinstance(child.rhs, int):
+                return [child.rhs]
+            elif isinstance(child, In) and isinstance(child.rhs, (list, tuple, set)):
+                if all(isinstance(value, int) for value in child.rhs):
+                    return list(child.rhs)
+    return None
+
+
+class ShardedQuerySet(models.QuerySet):
+    """
+    QuerySet of a model partitioned by chat over MESSAGE_SHARDS.
+
+    A query filtered on its chats runs on their shard. Any other query runs on every shard
+    and the rows are merged in the query's ordering, with counts, aggregates, updates and
+    deletes combined, so callers keep using one table. Subqueries of a query on another
+    database still only see that database.
+    """
+    def get_shards(self):
+        """
+        The aliases this query runs on, or None when it is not sharded because the alias
+        is given with using() or MESSAGE_SHARDS has a single database.
+        """
+        if self._db is not None or not is_sharded():
+            return None
+        chat_ids = filtered_chat_ids(self.query)
+        if chat_ids is None:
+            return list(settings.MESSAGE_SHARDS)
+        return sorted(set(shards_for_chats(chat_ids).values())) or [DEFAULT_DB_ALIAS]
+
+    def get_scattered_shards(self):
+        shards = self.get_shards()
+        return shards if shards is not None and len(shards) > 1 else None
+
+    @property
+    def db(self):
+        shards = self.get_shards()
+        if shards is not None and len(shards) == 1:
+            return shards[0]
+        return super().db
+
+    def _fetch_all(self):
+        if self._result_cache is None and (shards := self.get_scattered_shards()):
+            self._result_cache = self.gather(shards)
+        super()._fetch_all()
+
+    def gather(self, shards):
+        """
+        The rows of every shard in the query's ordering. A sliced query fetches the rows up
+        to the end of the slice from each shard and slices the merged rows.
+        """
+        low, high = self.query.low_mark, self.query.high_mark
+        rows = []
+        for alias in shards:
+            # The prefetches run once on the merged rows.
+            queryset = self.using(alias).prefetch_related(None)
+            queryset.query.clear_limits()
+            queryset.query.set_limits(high=high)
+            rows += [(alias, row) for row in queryset]
+        rows = self.drop_moved_copies(rows)
+        for key, descending in reversed(self.get_merge_keys()):
+            rows.sort(key=key, reverse=descending)
+        return rows[low:high]
+
+    def drop_moved_copies(self, rows):
+        """
+        The rows of (alias, row) pairs without the copies a chat move leaves on the other
+        shard until purge_moved_chats, keeping those on the shard the directory has for the
+        chat. Counts and aggregates over every shard still include them.
+        """
+        try:
+            pk, chat = self.get_row_key('pk'), self.get_row_key('chat')
+        except NotSupportedError:
+            return [row for alias, row in rows]
+        copies = Counter(pk(row) for alias, row in rows)
+        if len(copies) == len(rows):
+            return [row for alias, row in rows]
+        shards = shards_for_chats({chat(row) for alias, row in rows if copies[pk(row)] > 1})
+        return [row for alias, row in rows if copies[pk(row)] == 1 or shards[chat(row)] == alias]
+
+    def get_merge_keys(self):
+        query = self.query
+        if query.order_by:
+            ordering = query.order_by
+        elif query.default_ordering:
+            ordering = query.get_meta().ordering
+        else:
+            ordering = ()
+        keys = []
+        for field in ordering:
+            if isinstance(field, str) and field != '?':
+                name, descending = field.lstrip('-'), field.startswith('-')
+            elif isinstance(field, OrderBy) and isinstance(field.expression, F):
+                name, descending = field.expression.name, field.descending
+            elif isinstance(field, F):
+                name, descending = field.name, False
+            else:
+                raise NotSupportedError(f'Rows from several shards cannot be merged by {field!r}.')
+            keys.append((self.get_row_key(name), descending))
+        return keys
+
+    def get_row_key(self, name):
+        """
+        Function reading the ordering column name from a row of this query.
+        """
+        opts = self.query.get_meta()
+        if name == 'pk':
+            name = opts.pk.name
+        try:
+            candidates = (name, opts.get_field(name).attname)
+        except FieldDoesNotExist:
+            candidates = (name,)
+        if self._iterable_class is ModelIterable:
+            return attrgetter(candidates[-1])
+        query = self.query
+        names = list(query.selected) if query.selected else [
+            *query.extra_select, *query.values_select, *query.annotation_select,
+        ]
+        for candidate in candidates:
+            if candidate in names:
+                if self._iterable_class is FlatValuesListIterable:
+                    return lambda row: row
+                if self._iterable_class is ValuesIterable:
+                    return itemgetter(candidate)
+                return itemgetter(names.index(candidate))
+        raise NotSupportedError(f'Rows from several shards are merged by {name}, it has to be selected.')
+
+    def iterator(self, chunk_size=None):
+        shards = self.get_scattered_shards()
+        if shards is None:
+            return super().iterator(chunk_size=chunk_size)
+        return iter(self.gather(shards))
+
+    def count(self):
+        shards = self.get_scattered_shards()
+        if shards is None or self._result_cache is not None:
+            return super().count()
+        if self.query.is_sliced:
+            return len(self)
+        return sum(self.using(alias).count() for alias in shards)
+
+    def exists(self):
+        shards = self.get_scattered_shards()
+        if shards is None or self._result_cache is not None:
+            return super().exists()
+        return any(self.using(alias).exists() for alias in shards)
+
+    def aggregate(self, *args, **kwargs):
+        shards = self.get_scattered_shards()
+        if shards is None:
+            return super().aggregate(*args, **kwargs)
+        aggregates = {**{arg.default_alias: arg for arg in args}, **kwargs}
+        for name, aggregate in aggregates.items():
+            if type(aggregate) not in COMBINE_AGGREGATES or getattr(aggregate, 'distinct', False):
+                raise NotSupportedError(f'{aggregate!r} cannot be combined over several shards.')
+        results = [self.using(alias).aggregate(**aggregates) for alias in shards]
+        combined = {}
+        for name, aggregate in aggregates.items():
+            values = [result[name] for result in results if result[name] is not None]
+            combined[name] = COMBINE_AGGREGATES[type(aggregate)](values) if values else None
+        return combined
+
+    def update(self, **kwargs):
+        shards = self.get_scattered_shards()
+        if shards is None:
+            return super().update(**kwargs)
+        return sum(self.using(alias).update(**kwargs) for alias in shards)
+
+    def delete(self):
+        shards = self.get_scattered_shards()
+        if shards is None:
+            return super().delete()
+        deleted, counts = 0, Counter()
+        for alias in shards:
+            shard_deleted, shard_counts = self.using(alias).delete()
+            deleted += shard_deleted
+            counts.update(shard_counts)
+        return deleted, dict(counts)
+
+    def create(self, **kwargs):
+        if self.get_shards() is None:
+            return super().create(**kwargs)
+        # Saved without an alias, so the router puts it on the shard of its chat.
+        obj = self.model(**kwargs)
+        self._for_write = True
+        obj.save(force_insert=True)
+        return obj
+
+    def bulk_create(self, objs, *args, **kwargs):
+        if self.get_shards() is None:
+            return super().bulk_create(objs, *args, **kwargs)
+        objs = list(objs)
+        if self.model._meta.auto_field is not None:
+            new = [obj for obj in objs if obj.pk is None]
+            for obj, pk in zip(new, allocate_ids(len(new))):
+                obj.pk = pk
+        shards = shards_for_chats(obj.chat_id for obj in objs)
+        for alias in sorted(set(shards.values())):
+            self.using(alias).bulk_create([obj for obj in objs if shards[obj.chat_id] == alias], *args, **kwargs)
+        return objs
+
+
+def allocate_ids(count):
+    """
+    Reserve count consecutive message ids from MessageSequence on the default database.
+
+    Every shard has its own AUTOINCREMENT, which would hand out the same ids, so sharded
+    messages take theirs from one sequence. The first reservation of a process catches the
+    sequence up with ids inserted on the default database before sharding was enabled.
+    """
+    global _sequence_ready
+    from api.models import ArchivedMessage, Message, MessageSequence
+
+    if not count:
+        return range(0)
+    sequence = MessageSequence.objects.using(DEFAULT_DB_ALIAS).filter(pk=MessageSequence.PK)
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        if not (_sequence_ready and sequence.update(last=F('last') + count)):
+            MessageSequence.objects.using(DEFAULT_DB_ALIAS).bulk_create(
+                [MessageSequence(pk=MessageSequence.PK)], ignore_conflicts=True,
+            )
+            highest = [
+                Coalesce(Subquery(model.objects.using(DEFAULT_DB_ALIAS).order_by('-id').values('id')[:1]), 0)
+                for model in (Message, ArchivedMessage)
+            ]
+            sequence.update(last=Greatest('last', *highest, output_field=models.BigIntegerField()) + count)
+            _sequence_ready = True
+        last = sequence.values_list('last', flat=True).get()
+    return range(last - count + 1, last + 1)
+
+
+@contextmanager
+def atomic_shards(aliases):
+    """
+    Run the block in a transaction on each of aliases but the default database, which the
+    caller's own transaction covers. An error in the block rolls the shards back with it.
+    The shards commit before the caller's transaction and there is no two-phase commit, so
+    a failing commit can still leave the databases apart, recount_chats repairs the counters.
+    """
+    with ExitStack() as stack:
+        for alias in sorted(set(aliases) - {DEFAULT_DB_ALIAS}):
+            stack.enter_context(transaction.atomic(using=alias))
+        yield
+
+
+@contextmanager
+def lock_chats(chat_ids):
+    """
+    Write to the messages of chat_ids: run the block in a transaction on the default
+    database and on the shards of the chats, which it yields as a dict by chat id.
+
+    The shards are read from the chats, not the cached directory, after a write that holds
+    the lock of the default database until the block's shards committed. move_chat has to
+    take the same lock to mark a chat moving or to switch its shard, so every write either
+    commits before a move starts or reaches the chat's shard after the switch. Writes to a
+    chat while it is being moved raise ChatMoving. Without shards the block simply runs in
+    the caller's transaction.
+    """
+    from api.models import Chat
+
+    chat_ids = set(chat_ids)
+    if not is_sharded() or not chat_ids:
+        # Nothing moves, the caller's transaction covers the block.
+        yield dict.fromkeys(chat_ids, DEFAULT_DB_ALIAS)
+        return
+    chats = Chat.objects.using(DEFAULT_DB_ALIAS).filter(pk__in=chat_ids)
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        chats.update(shard=F('shard'))
+        found = {chat_id: (shard, moving_to) for chat_id, shard, moving_to in chats.values_list('pk', 'shard', 'moving_to')}
+        if any(moving_to for _, moving_to in found.values()):
+            raise ChatMoving()
+        cache.set_many(
+            {directory_key(chat_id): shard for chat_id, (shard, _) in found.items()}, settings.SHARD_DIRECTORY_TIMEOUT,
+        )
+        shards = {chat_id: found.get(chat_id, ('', ''))[0] or DEFAULT_DB_ALIAS for chat_id in chat_ids}
+        token = _locked_shards.set({**_locked_shards.get(), **shards})
+        try:
+            with atomic_shards(shards.values()):
+                yield shards
+        finally:
+            _locked_shards.reset(token)
+
+
+def delete_from_shards(origin, aliases, **lookup):
+    """
+    Delete the messages matching lookup from aliases but the default database, where the
+    cascade deleting origin finds them. The signals see origin as in a cascade.
+    """
+    from api.models import ArchivedMessage, Message
+
+    for alias in set(aliases) - {DEFAULT_DB_ALIAS}:
+        collector = Collector(using=alias, origin=origin)
+        for model in (Message, ArchivedMessage):
+            collector.collect(model.objects.using(alias).filter(**lookup))
+        collector.delete()
+
+
+def delete_rows(model, alias, chat_id):
+    connection = connections[alias]
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {quote(model._meta.db_table)} WHERE {quote("chat_id")} = %s', [chat_id])
+        return cursor.rowcount
+
+
+def copy_rows(model, chat_id, source, target, after_id=0, batch_size=1000):
+    """
+    Copy the rows of a chat with an id above after_id from source to target in id order.
+    Returns the last copied id and the number of copied rows.
+    """
+    copied = 0
+    while True:
+        rows = list(model.objects.using(source).filter(chat_id=chat_id, id__gt=after_id).order_by('id')[:batch_size])
+        if not rows:
+            return after_id, copied
+        model.objects.using(target).bulk_create(rows)
+        after_id = rows[-1].pk
+        copied += len(rows)
+
+
+def move_chat(chat_id, target, batch_size=1000):
+    """
+    Move the messages of a chat, live and archived, to the target shard and point the chat
+    at it. Returns the number of copied messages.
+
+    The chat is marked moving_to the target first, lock_chats refuses writes to its
+    messages from then on, and its rows are copied in batches with their ids. The chat then
+    switches shard in one update, which also records the previous shard in moved_from.
+    The rows stay there for readers whose cached directory still points at it, until
+    purge_moved_chats deletes them once SHARD_DIRECTORY_TIMEOUT passed.
+    Plain inserts and deletes, moving fires no signals. An interrupted move starts over
+    when the chat is moved again, the purge of an earlier move finishes first.
+    """
+    from api.models import ArchivedMessage, Chat, Message
+
+    chats = Chat.objects.using(DEFAULT_DB_ALIAS).filter(pk=chat_id)
+    shard, moving_to, moved_from = chats.values_list('shard', 'moving_to', 'moved_from').get()
+    source = shard or DEFAULT_DB_ALIAS
+    if source == target and not moving_to:
+        return 0
+    sharded_models = (Message, ArchivedMessage)
+    if moved_from:
+        # Switched by an earlier run at an unknown time.
+        time.sleep(settings.SHARD_DIRECTORY_TIMEOUT)
+        purge_moved_chats([chat_id])
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        chats.update(moving_to=target)
+    for abandoned in {moving_to} - {'', source, target}:
+        # Rows copied by an interrupted move to another shard.
+        for model in sharded_models:
+            delete_rows(model, abandoned, chat_id)
+    if source == target:
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            chats.update(moving_to='')
+        return 0
+    moved = 0
+    for model in sharded_models:
+        # Rows left on the target by an interrupted move.
+        delete_rows(model, target, chat_id)
+        _, copied = copy_rows(model, chat_id, source, target, batch_size=batch_size)
+        moved += copied
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        switched = chats.filter(moving_to=target).update(shard=target, moving_to='', moved_from=source)
+    if not switched:
+        # The chat was deleted meanwhile, after its cascade reached the target.
+        for model in sharded_models:
+            delete_rows(model, target, chat_id)
+        return 0
+    cache.delete(directory_key(chat_id))
+    return moved
+
+
+def purge_moved_chats(chat_ids=None):
+    """
+    Delete the rows moved chats, or those of chat_ids, left on their previous shard.
+    Returns the number of deleted rows. Only call it SHARD_DIRECTORY_TIMEOUT seconds after
+    the moves, readers may find the chats on the previous shard until then.
+    """
+    from api.models import ArchivedMessage, Chat, Message
+
+    chats = Chat.objects.using(DEFAULT_DB_ALIAS).exclude(moved_from='')
+    if chat_ids is not None:
+        chats = chats.filter(pk__in=chat_ids)
+    deleted = 0
+    for chat_id, shard, moved_from in chats.values_list('pk', 'shard', 'moved_from'):
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            # Locked, so the chat cannot move again meanwhile.
+            if not Chat.objects.using(DEFAULT_DB_ALIAS).filter(pk=chat_id, moved_from=moved_from).update(moved_from=''):
+                continue
+            if moved_from != (shard or DEFAULT_DB_ALIAS):
+                for model in (Message, ArchivedMessage):
+                    deleted += delete_rows(model, moved_from, chat_id)
+    return deleted
+
+
+def plan_rebalance(chats, shards, tolerance=0.1):
+    """
+    Moves evening out the messages over shards, as (chat_id, source, target) tuples.
+
+    chats are (chat_id, shard, message count) tuples, chats on other databases stay put.
+    The largest chat of the fullest shard that fits into half the gap to the emptiest one
+    moves there, until every shard is within tolerance of the mean or no chat fits.
+    """
+    loads = dict.fromkeys(shards, 0)
+    placed = {shard: [] for shard in shards}
+    for chat_id, shard, count in chats:
+        if shard in placed:
+            loads[shard] += count
+            placed[shard].append((count, chat_id))
+    for sizes in placed.values():
+        sizes.sort()
+    mean = sum(loads.values()) / len(shards)
+    moves = []
+    while True:
+        fullest = max(shards, key=loads.get)
+        emptiest = min(shards, key=loads.get)
+        if loads[fullest] <= mean * (1 + tolerance):
+            return moves
+        index = bisect_right(placed[fullest], ((loads[fullest] - loads[emptiest]) / 2, float('inf'))) - 1
+        if index < 0 or placed[fullest][index][0] == 0:
+            return moves
+        count, chat_id = placed[fullest].pop(index)
+        placed[emptiest].insert(bisect_right(placed[emptiest], (count, chat_id)), (count, chat_id))
+        loads[fullest] -= count
+        loads[emptiest] += count
+        moves.append((chat_id, fullest, emptiest))
@@ -0,0 +1,105 @@
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from api.authentication import forget_claims
+from api.cache import invalidate_users
+from api.counters import message_removed, messages_added
+from api.models import User, Chat, Message, Tombstone
+from api.realtime import publish
+from api.sharding import delete_from_shards, is_sharded, shard_for_chat
+
+
+@receiver(post_save, sender=Message)
+def publish_message(sender, instance, created, **kwargs):
+    from api.serializers import MessageSerializer
+
+    # Runs before count_message, which records the saved flag as the loaded one.
+    loaded_archived = getattr(instance, '_loaded_archived', None)
+    if created:
+        event = 'message.created'
+    elif instance.archived and loaded_archived is False:
+        event = 'message.archived'
+    else:
+        event = 'message.updated'
+    publish(instance.chat_id, event, dict(MessageSerializer(instance).data))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user(sender, instance, **kwargs):
+    invalidate_users([instance.pk])
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def update_claims(sender, instance, **kwargs):
+    forget_claims(instance.pk)
+
+
+@receiver(post_save, sender=Chat)
+@receiver(post_delete, sender=Chat)
+def invalidate_chat(sender, instance, **kwargs):
+    invalidate_users([instance.user_id])
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+def invalidate_message(sender, instance, **kwargs):
+    if Message.chat.field.is_cached(instance):
+        chat_owner = instance.chat.user_id
+    else:
+        # The chat of a message deleted in a cascade may already be gone, its own
+        # deletion invalidates the owner then.
+        chat_owner = Chat.objects.filter(pk=instance.chat_id).values_list('user_id', flat=True).first()
+    invalidate_users({instance.user_id, chat_owner} - {None})
+
+
+@receiver(post_delete, sender=Chat)
+def record_chat_deletion(sender, instance, **kwargs):
+    Tombstone.objects.create(kind=Tombstone.Kind.CHAT, object_id=instance.pk, user_id=instance.user_id)
+
+
+def deleted_with_chat(origin):
+    return isinstance(origin, Chat) or getattr(origin, 'model', None) is Chat
+
+
+@receiver(post_delete, sender=Message)
+def record_message_deletion(sender, instance, origin=None, **kwargs):
+    # Messages deleted along with their chat are covered by the chat's tombstone.
+    if deleted_with_chat(origin):
+        return
+    Tombstone.objects.create(kind=Tombstone.Kind.MESSAGE, object_id=instance.pk, user_id=instance.user_id)
+
+
+@receiver(post_save, sender=Message)
+def count_message(sender, instance, created, **kwargs):
+    loaded_archived = getattr(instance, '_loaded_archived', None)
+    if created and not instance.archived:
+        messages_added([instance])
+    elif loaded_archived is not None and loaded_archived != instance.archived:
+        if instance.archived:
+            message_removed(instance)
+        else:
+            messages_added([instance])
+    instance._loaded_archived = instance.archived
+
+
+@receiver(post_delete, sender=Message)
+def uncount_message(sender, instance, origin=None, **kwargs):
+    if not deleted_with_chat(origin) and not instance.archived:
+        message_removed(instance)
+
+
+# The cascades deleting chats and users only reach the messages on the default database.
+@receiver(pre_delete, sender=Chat)
+def delete_chat_shard_messages(sender, instance, **kwargs):
+    if is_sharded():
+        # A chat deleted while it moves also has rows on the other shard of the move.
+        shards = {shard_for_chat(instance), instance.moving_to, instance.moved_from} - {''}
+        delete_from_shards(instance, shards, chat_id=instance.pk)
+
+
+@receiver(pre_delete, sender=User)
+def delete_user_shard_messages(sender, instance, **kwargs):
+    if is_sharded():
+        delete_from_shards(instance, settings.MESSAGE_SHARDS, user_id=instance.pk)
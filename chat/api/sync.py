@@ -0,0 +1,142 @@
+import base64
+import json
+from datetime import datetime
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.exceptions import APIException, ValidationError
+from api.models import Chat, Message, Tombstone
+from api.pagination import KeysetCursorPagination
+
+
+class SyncTokenExpired(APIException):
+    status_code = 410
+    default_detail = "The sync token is older than the deletion history, fetch everything again without `since`."
+    default_code = 'sync_token_expired'
+
+
+class ChangeStream:
+    """
+    One table of the change feed, read in (timestamp, id) order after a position.
+    """
+    def __init__(self, key, queryset, field):
+        self.key = key
+        self.queryset = queryset
+        self.field = field
+        self.ordering = (field, 'id')
+
+    def read(self, position, limit):
+        """
+        At most limit + 1 rows after position.
+        """
+        queryset = self.queryset.order_by(*self.ordering)
+        if position is not None:
+            queryset = queryset.filter(KeysetCursorPagination().get_keyset_filter(self.ordering, position))
+        return list(queryset[:limit + 1])
+
+    def get_position(self, obj):
+        return [getattr(obj, self.field), obj.pk]
+
+
+def get_streams(user):
+    chats = Chat.objects.all()
+    messages = Message.objects.all()
+    tombstones = Tombstone.objects.all()
+    if not user.is_staff:
+        chats = chats.filter(user_id=user.pk)
+        messages = messages.filter(user_id=user.pk)
+        tombstones = tombstones.filter(user_id=user.pk)
+    return [
+        ChangeStream('c', chats, 'updated_at'),
+        ChangeStream('m', messages, 'updated_at'),
+        ChangeStream('t', tombstones, 'deleted_at'),
+    ]
+
+
+def encode_token(started_at, positions, more):
+    payload = {'at': started_at.isoformat(), 'more': more}
+    for key, position in positions.items():
+        payload[key] = None if position is None else [position[0].isoformat(), position[1]]
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+
+def decode_token(token):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+        started_at = datetime.fromisoformat(payload['at'])
+        positions = {}
+        for key in ('c', 'm', 't'):
+            position = payload[key]
+            positions[key] = None if position is None else [datetime.fromisoformat(position[0]), int(position[1])]
+    except (TypeError, ValueError, KeyError, IndexError, UnicodeError, AttributeError):
+        raise ValidationError({'since': ["Invalid sync token."]})
+    return started_at, positions, bool(payload.get('more'))
+
+
+def get_changes(user, since=None, limit=100):
+    """
+    The changes visible to user after the since token, oldest first, at most limit of them.
+
+    Every table is read with its own keyset position, so a page costs O(limit) whatever
+    the size of the history. Without a token the feed starts with every chat and message
+    and only reports deletions from now on.
+
+    Timestamps are set before their transaction commits, so a row can become visible
+    after a read passed its timestamp. A sync therefore starts SYNC_COMMIT_WINDOW before
+    the time the previous one started, when that is behind its position, and pages on
+    from there until `more` is false. Rows of that window are delivered again, clients
+    drop them by id. The token only holds the positions and that time, so its size does
+    not depend on the write rate. Writes committing later than the window can still be
+    missed.
+    """
+    now = timezone.now()
+    if since is None:
+        started_at, positions = now, {'c': None, 'm': None, 't': [now, 0]}
+        starts = dict(positions)
+    else:
+        started_at, positions, more = decode_token(since)
+        if started_at < now - settings.SYNC_TOMBSTONE_RETENTION:
+            raise SyncTokenExpired()
+        if more:
+            # The previous page left rows behind, carry on where it stopped.
+            starts = dict(positions)
+        else:
+            floor = [started_at - settings.SYNC_COMMIT_WINDOW, 0]
+            starts = {key: position and min(position, floor) for key, position in positions.items()}
+            started_at = now
+
+    rows = {}
+    merged = []
+    for stream in get_streams(user):
+        rows[stream.key] = stream.read(starts[stream.key], limit)
+        merged += [(stream.get_position(obj), stream, obj) for obj in rows[stream.key]]
+    merged.sort(key=lambda change: change[0])
+    page = merged[:limit]
+
+    taken = dict.fromkeys(rows, 0)
+    changes = {'chats': [], 'messages': [], 'deleted': {'chats': [], 'messages': []}}
+    for position, stream, obj in page:
+        taken[stream.key] += 1
+        positions[stream.key] = position
+        if stream.key == 'c':
+            changes['chats'].append(obj)
+        elif stream.key == 'm':
+            changes['messages'].append(obj)
+        else:
+            changes['deleted'][f'{obj.kind}s'].append(obj.object_id)
+    for key in rows:
+        if not taken[key] and rows[key]:
+            # Rows after the start were crowded out of the page by other tables.
+            positions[key] = starts[key]
+
+    changes['more'] = any(len(rows[key]) > taken[key] for key in rows)
+    changes['next'] = encode_token(started_at, positions, changes['more'])
+    return changes
+
+
+def purge_tombstones():
+    """
+    Delete the tombstones older than the retention window, returning how many were deleted.
+    """
+    cutoff = timezone.now() - settings.SYNC_TOMBSTONE_RETENTION
+    deleted, _ = Tombstone.objects.filter(deleted_at__lt=cutoff).delete()
+    return deleted
@@ -0,0 +1,193 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from django.core.management import call_command
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from django.db import connection
+from django.utils import timezone
+from api.archive import move_messages
+from api.counters import messages_archived
+from api.jobs import claim_archive_job, run_archive_job
+from api.models import User, Chat, Message, ArchivedMessage, ArchiveJob, Tombstone
+
+
+@override_settings(ARCHIVE_JOB_RUNNER='eager', ARCHIVE_JOB_CHUNK_SIZE=3)
+class ArchiveJobTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='test')
+        self.admin = User.objects.create_superuser(username='admin', password='test')
+        self.chat = Chat.objects.create(user=self.user)
+        self.chat2 = Chat.objects.create(user=self.user)
+        for chat in (self.chat, self.chat2):
+            for i in range(10):
+                Message.objects.create(user=self.user, chat=chat, content=f"Message {i}")
+
+    def test_archive_and_unarchive(self):
+        self.client.login(username='admin', password='test')
+        url = reverse('chat-action', args=[self.chat.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(url, {"archived": True})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(self.chat.messages.exists())
+        self.assertEqual(self.chat.archived_messages.count(), 10)
+        self.assertEqual(self.chat2.messages.filter(archived=False).count(), 10)
+
+        job = ArchiveJob.objects.get(chat=self.chat)
+        response = self.client.get(reverse('archive-job-action', args=[job.pk]))
+        self.assertEqual(response.data['status'], 'done')
+        self.assertEqual((response.data['processed'], response.data['total']), (10, 10))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(url, {"archived": False})
+        self.assertEqual(self.chat.messages.filter(archived=False).count(), 10)
+        self.assertFalse(self.chat.archived_messages.exists())
+        response = self.client.get(reverse('archive-job-list'), {'chat': self.chat.pk})
+        self.assertEqual([job['archived'] for job in response.data['results']], [True, False])
+
+    def test_save_without_change_starts_no_job(self):
+        chat = Chat.objects.get(pk=self.chat.pk)
+        with self.assertNumQueries(1):
+            chat.save()
+        self.assertFalse(ArchiveJob.objects.exists())
+
+    def test_resume_interrupted_job(self):
+        with override_settings(ARCHIVE_JOB_RUNNER='worker'):
+            chat = Chat.objects.get(pk=self.chat.pk)
+            chat.archived = True
+            chat.save()
+        job = ArchiveJob.objects.get(chat=self.chat)
+        self.assertEqual(job.status, 'pending')
+        self.assertFalse(self.chat.archived_messages.exists())
+
+        # Simulate a job that stopped after its first chunk.
+        first_chunk = list(self.chat.messages.order_by('id').values_list('id', flat=True)[:3])
+        move_messages(connection, True, self.chat.pk, timezone.now(), last_id=first_chunk[-1])
+        ArchiveJob.objects.filter(pk=job.pk).update(status='running', last_message_id=first_chunk[-1], processed=3, total=10)
+
+        # Another runner may still hold it until its lease expires.
+        call_command('run_archive_jobs', stdout=StringIO())
+        self.assertEqual(ArchiveJob.objects.get(pk=job.pk).processed, 3)
+        ArchiveJob.objects.filter(pk=job.pk).update(updated_at=timezone.now() - timedelta(seconds=301))
+        call_command('run_archive_jobs', stdout=StringIO())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed, job.total), ('done', 10, 10))
+        self.assertFalse(self.chat.messages.exists())
+        self.assertEqual(self.chat.archived_messages.count(), 10)
+        self.assertEqual(run_archive_job(job.pk).processed, 10)
+
+    def test_claim_once(self):
+        with override_settings(ARCHIVE_JOB_RUNNER='worker'):
+            self.chat.archived = True
+            self.chat.save()
+        job = ArchiveJob.objects.get(chat=self.chat)
+        self.assertTrue(claim_archive_job(job.pk))
+        self.assertFalse(claim_archive_job(job.pk))
+        self.assertEqual(run_archive_job(job.pk).processed, 0)
+        self.assertFalse(self.chat.archived_messages.exists())
+
+        ArchiveJob.objects.filter(pk=job.pk).update(status='failed')
+        self.assertFalse(claim_archive_job(job.pk))
+        self.assertEqual(run_archive_job(job.pk, retry_failed=True).status, 'done')
+        self.assertEqual(self.chat.archived_messages.count(), 10)
+
+    def test_new_job_cancels_older_ones(self):
+        with override_settings(ARCHIVE_JOB_RUNNER='worker'):
+            self.chat.archived = True
+            self.chat.save()
+            self.chat.archived = False
+            self.chat.save()
+        archive, unarchive = ArchiveJob.objects.filter(chat=self.chat).order_by('pk')
+        self.assertEqual((archive.archived, archive.status), (True, 'canceled'))
+        self.assertEqual(unarchive.status, 'pending')
+        call_command('run_archive_jobs', '--retry-failed', stdout=StringIO())
+        self.assertEqual(ArchiveJob.objects.get(pk=archive.pk).status, 'canceled')
+        self.assertEqual(self.chat.messages.filter(archived=False).count(), 10)
+        self.assertFalse(self.chat.archived_messages.exists())
+
+    def test_canceled_while_running(self):
+        with override_settings(ARCHIVE_JOB_RUNNER='worker'):
+            self.chat.archived = True
+            self.chat.save()
+        job = ArchiveJob.objects.get(chat=self.chat)
+
+        def cancel_after_first_chunk(*args, **kwargs):
+            ArchiveJob.objects.filter(pk=job.pk).update(status='canceled')
+            return moved(*args, **kwargs)
+
+        moved = messages_archived
+        with mock.patch('api.jobs.messages_archived', cancel_after_first_chunk):
+            job = run_archive_job(job.pk)
+        # The first chunk committed, the second one found the job canceled and rolled back.
+        self.assertEqual((job.status, job.processed), ('canceled', 3))
+        self.assertEqual(self.chat.archived_messages.count(), 3)
+
+    def test_bulk_archive(self):
+        url = reverse('chat-bulk-archive')
+        self.client.login(username='testuser', password='test')
+        response = self.client.post(url, {"chats": [self.chat.pk, self.chat2.pk]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.login(username='admin', password='test')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, {"chats": [self.chat.pk, self.chat2.pk, 999]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(len(response.data), 2)
+        self.assertEqual(Chat.objects.filter(archived=True).count(), 2)
+        self.assertFalse(Message.objects.exists())
+        self.assertEqual(ArchivedMessage.objects.count(), 20)
+        self.assertEqual(ArchiveJob.objects.filter(status='done').count(), 2)
+
+    def test_bulk_archive_chat_out_of_range(self):
+        self.client.login(username='admin', password='test')
+        for chats in ([2**63], [0], [self.chat.pk, -1]):
+            response = self.client.post(reverse('chat-bulk-archive'), {"chats": chats}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(ArchiveJob.objects.exists())
+
+    def archive(self, chat, archived=True):
+        with self.captureOnCommitCallbacks(execute=True):
+            chat.archived = archived
+            chat.save()
+
+    def test_list_archive(self):
+        self.archive(self.chat)
+        other = User.objects.create_user(username='other', password='test')
+        other_chat = Chat.objects.create(user=other)
+        Message.objects.create(user=other, chat=other_chat, content="Not yours")
+        self.archive(other_chat)
+
+        self.client.login(username='testuser', password='test')
+        url = reverse('message-list')
+        response = self.client.get(url, {'page_size': 100})
+        self.assertEqual({m['chat'] for m in response.data['results']}, {self.chat2.pk})
+
+        response = self.client.get(url, {'archive': 'true', 'page_size': 100})
+        self.assertEqual(len(response.data['results']), 10)
+        self.assertEqual({(m['chat'], m['archived']) for m in response.data['results']}, {(self.chat.pk, True)})
+        response = self.client.get(url, {'archive': 'true', 'chat': self.chat2.pk})
+        self.assertEqual(response.data['results'], [])
+
+        self.client.login(username='admin', password='test')
+        response = self.client.get(url, {'archive': 'true', 'page_size': 100})
+        self.assertEqual(len(response.data['results']), 11)
+
+    def test_move_keeps_messages(self):
+        ids = list(self.chat.messages.order_by('id').values_list('id', flat=True))
+        self.archive(self.chat)
+        self.assertFalse(Tombstone.objects.exists())
+        self.assertEqual(Chat.objects.get(pk=self.chat.pk).message_count, 0)
+        self.assertFalse(Message.objects.filter(search_index__content__match='message').exclude(chat=self.chat2).exists())
+
+        self.archive(self.chat, False)
+        self.assertEqual(list(self.chat.messages.order_by('id').values_list('id', flat=True)), ids)
+        self.assertEqual(Chat.objects.get(pk=self.chat.pk).message_count, 10)
+        self.assertEqual(Message.objects.filter(chat=self.chat, search_index__content__match='message').count(), 10)
+        self.assertFalse(Tombstone.objects.exists())
+
+    def test_delete_archived_chat(self):
+        self.archive(self.chat)
+        Chat.objects.get(pk=self.chat.pk).delete()
+        self.assertFalse(ArchivedMessage.objects.exists())
@@ -0,0 +1,113 @@
+from unittest import mock
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+from rest_framework.views import APIView
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from api.authentication import ClaimsUser, StatelessJWTAuthentication, claims_key
+from api.models import User, Chat, Message
+
+
+@mock.patch.object(APIView, 'authentication_classes', [StatelessJWTAuthentication])
+class StatelessJWTAuthenticationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='test')
+        self.admin = User.objects.create_superuser(username='admin', password='test')
+        self.chat = Chat.objects.create(user=self.user)
+        Message.objects.create(user=self.user, chat=self.chat, content="Hello!")
+        self.authenticate('testuser')
+
+    def authenticate(self, username, client=None):
+        response = self.client.post(reverse('token-obtain-pair'), {'username': username, 'password': 'test'})
+        (client or self.client).credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        self.refresh = response.data['refresh']
+        return response.data['access']
+
+    def test_token_carries_flags(self):
+        token = AccessToken(self.authenticate('admin'))
+        self.assertTrue(token['is_staff'])
+        self.assertTrue(token['is_superuser'])
+        # Only access tokens do, a refresh token outlives the recorded flag changes.
+        self.assertNotIn('is_staff', RefreshToken(self.refresh).payload)
+
+    def test_refresh_reads_current_flags(self):
+        self.authenticate('admin')
+        self.admin.is_staff = self.admin.is_superuser = False
+        self.admin.save()
+        response = self.client.post(reverse('token-refresh'), {'refresh': self.refresh})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        token = AccessToken(response.data['access'])
+        self.assertEqual((token['is_staff'], token['is_superuser']), (False, False))
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        self.assertEqual(self.client.get(reverse('user-list')).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_cached_user_row(self):
+        user = ClaimsUser(AccessToken(self.authenticate('testuser')))
+        with self.assertNumQueries(1):
+            self.assertEqual(user.username, 'testuser')
+            self.assertEqual(user.date_joined, self.user.date_joined)
+            self.assertEqual(ClaimsUser(user.token).email, '')
+        self.user.email = 'test@example.com'
+        self.user.save()
+        self.assertEqual(ClaimsUser(user.token).email, 'test@example.com')
+
+    def test_no_user_lookup(self):
+        # The first request reads the flags of the user into the cache.
+        self.client.get(reverse('chat-list'))
+        for name in ('chat-list', 'message-list'):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse(name))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.data['results']), 1)
+            self.assertFalse([q for q in queries if 'FROM "api_user"' in q['sql']])
+
+    def test_create_message(self):
+        response = self.client.post(reverse('message-create'), {'user': self.user.id, 'chat': self.chat.id, 'content': "Hi"})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Message.objects.get(content="Hi").user, self.user)
+
+        response = self.client.post(reverse('message-bulk-create'), [{'chat': self.chat.id, 'content': "Hey"}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Message.objects.get(content="Hey").user, self.user)
+
+    def test_flag_changes_apply_to_issued_tokens(self):
+        admin_client = APIClient()
+        self.authenticate('admin', admin_client)
+        url = reverse('user-action', args=[self.user.pk])
+
+        self.assertEqual(self.client.get(reverse('user-list')).status_code, status.HTTP_403_FORBIDDEN)
+        admin_client.patch(url, {'is_staff': True})
+        self.assertEqual(self.client.get(reverse('user-list')).status_code, status.HTTP_200_OK)
+        admin_client.patch(url, {'is_staff': False})
+        self.assertEqual(self.client.get(reverse('user-list')).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_evicted_flags(self):
+        admin_client = APIClient()
+        self.authenticate('admin', admin_client)
+        self.assertEqual(admin_client.get(reverse('user-list')).status_code, status.HTTP_200_OK)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.admin.is_staff = self.admin.is_superuser = False
+            self.admin.save()
+        self.assertEqual(admin_client.get(reverse('user-list')).status_code, status.HTTP_403_FORBIDDEN)
+        # Evicted or lost flags are read again from the database, not taken from the token.
+        cache.delete(claims_key(self.admin.pk))
+        self.assertEqual(admin_client.get(reverse('user-list')).status_code, status.HTTP_403_FORBIDDEN)
+        cache.clear()
+        self.assertEqual(admin_client.get(reverse('user-list')).status_code, status.HTTP_403_FORBIDDEN)
+
+        self.admin.delete()
+        cache.clear()
+        self.assertEqual(admin_client.get(reverse('chat-list')).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deleted_and_inactive_users(self):
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('chat-list')).status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.authenticate('admin')
+        self.admin.delete()
+        self.assertEqual(self.client.get(reverse('chat-list')).status_code, status.HTTP_401_UNAUTHORIZED)
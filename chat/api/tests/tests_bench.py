@@ -0,0 +1,81 @@
+import json
+import os
+import tempfile
+from io import StringIO
+from django.core.management import call_command
+from django.test import TransactionTestCase, override_settings
+from api.models import User, Chat, Message
+
+
+# Tests run with DEBUG off, where localhost has to be allowed explicitly
+@override_settings(ALLOWED_HOSTS=['localhost'])
+class BenchAPICommandTests(TransactionTestCase):
+    def test_report(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'bench.json')
+            # The in-memory test database raises "table is locked" on concurrent writes
+            # instead of waiting, so the clients run one at a time.
+            call_command(
+                'bench_api', users=3, chats_per_user=2, messages_per_chat=4, requests=6, concurrency=1,
+                output=output, check=True, stdout=StringIO(),
+            )
+            with open(output) as f:
+                report = json.load(f)
+
+        self.assertEqual(User.objects.count(), 3)
+        self.assertEqual(Chat.objects.count(), 6)
+        self.assertEqual(Message.objects.count(), 24 + 6)
+        self.assertEqual(set(report['results']), {'messages', 'chats', 'users-me', 'messages-create'})
+        for result in report['results'].values():
+            self.assertEqual(result['requests'], 6)
+            self.assertEqual(result['errors'], 0)
+            self.assertLessEqual(result['max_queries'], result['query_budget'])
+
+    def test_reuses_dataset(self):
+        call_command('bench_api', users=2, chats_per_user=1, messages_per_chat=1, requests=2, endpoints=['users-me'], stdout=StringIO())
+        call_command('bench_api', users=2, chats_per_user=1, messages_per_chat=1, requests=2, endpoints=['users-me'], stdout=StringIO())
+        self.assertEqual(User.objects.count(), 2)
+
+
+class BenchSQLiteCommandTests(TransactionTestCase):
+    def allow_scratch_databases(self):
+        # The command adds its scratch databases as connection aliases while it runs.
+        databases = type(self).databases
+        type(self).databases = {*databases, 'bench_default', 'bench_production'}
+        self.addCleanup(setattr, type(self), 'databases', databases)
+
+    def test_report(self):
+        self.allow_scratch_databases()
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'bench.json')
+            call_command(
+                'bench_sqlite', readers=1, writers=1, seconds=0.2, chats=5, messages=50, dir=directory,
+                output=output, stdout=StringIO(),
+            )
+            with open(output) as f:
+                report = json.load(f)
+            self.assertEqual(os.listdir(directory), ['bench.json'])
+
+        self.assertEqual(set(report['results']), {'default', 'production'})
+        for result in report['results'].values():
+            self.assertGreater(result['reads'], 0)
+            self.assertGreater(result['writes'], 0)
+        self.assertFalse(Message.objects.exists())
+
+
+@override_settings(ALLOWED_HOSTS=['localhost'], MESSAGE_GROUP_COMMIT_MAX_DELAY=0)
+class BenchGroupCommitCommandTests(TransactionTestCase):
+    def test_report(self):
+        user = User.objects.create_user(username='testuser', password='test')
+        Chat.objects.create(user=user)
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'bench.json')
+            call_command('bench_group_commit', requests=4, concurrency=1, output=output, stdout=StringIO())
+            with open(output) as f:
+                report = json.load(f)
+
+        self.assertEqual(set(report['results']), {'direct', 'group'})
+        for result in report['results'].values():
+            self.assertEqual((result['requests'], result['errors']), (4, 0))
+        self.assertEqual(report['results']['group']['group_commit']['messages'], 4)
+        self.assertEqual(Message.objects.count(), 8)
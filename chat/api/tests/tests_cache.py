@@ -0,0 +1,108 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework.test import APITestCase
+from api.models import User, Chat, Message
+
+
+class ResponseCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='test')
+        self.user2 = User.objects.create_user(username='testuser2', password='test')
+        self.admin = User.objects.create_superuser(username='admin', password='test')
+        self.chat = Chat.objects.create(user=self.user)
+        self.client.login(username='testuser', password='test')
+
+    def get(self, name, **params):
+        response = self.client.get(reverse(name), params)
+        return response['X-Cache'], response.data
+
+    def test_hit_and_miss(self):
+        self.assertEqual(self.get('chat-list')[0], 'MISS')
+        self.assertEqual(self.get('chat-list')[0], 'HIT')
+        self.assertEqual(self.get('chat-list', page_size=1)[0], 'MISS')
+        self.assertEqual(self.get('user-me')[0], 'MISS')
+        self.assertEqual(self.get('user-me')[0], 'HIT')
+
+        self.client.login(username='admin', password='test')
+        response = self.client.get(reverse('cache-stats'))
+        self.assertEqual(response.data['hits'], 2)
+        self.assertEqual(response.data['misses'], 3)
+
+    def test_per_user(self):
+        self.get('chat-list')
+        self.client.login(username='testuser2', password='test')
+        cached, data = self.get('chat-list')
+        self.assertEqual(cached, 'MISS')
+        self.assertEqual(data['results'], [])
+
+    def test_message_invalidates_owner_author_and_staff(self):
+        self.get('chat-list')
+        self.get('user-me')
+        self.client.login(username='admin', password='test')
+        self.get('chat-list')
+        self.client.login(username='testuser2', password='test')
+        self.get('user-me')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(user=self.admin, chat=self.chat, content="Hello!")
+
+        self.assertEqual(self.get('user-me')[0], 'HIT')
+        self.client.login(username='admin', password='test')
+        cached, data = self.get('chat-list')
+        self.assertEqual(cached, 'MISS')
+        self.assertEqual(data['results'][0]['message_count'], 1)
+        self.client.login(username='testuser', password='test')
+        cached, data = self.get('chat-list')
+        self.assertEqual(cached, 'MISS')
+        self.assertEqual(data['results'][0]['latest_messages'][0]['content'], "Hello!")
+
+    def test_chat_changes_invalidate(self):
+        self.get('chat-list')
+        with self.captureOnCommitCallbacks(execute=True):
+            Chat.objects.create(user=self.user)
+        cached, data = self.get('chat-list')
+        self.assertEqual(cached, 'MISS')
+        self.assertEqual(len(data['results']), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.chat.delete()
+        cached, data = self.get('chat-list')
+        self.assertEqual(cached, 'MISS')
+        self.assertEqual(len(data['results']), 1)
+
+    def test_invalidates_on_commit(self):
+        self.get('chat-list')
+        with self.captureOnCommitCallbacks() as callbacks:
+            Chat.objects.create(user=self.user)
+            # Uncommitted, so other requests still read the old rows.
+            self.assertEqual(self.get('chat-list')[0], 'HIT')
+        with self.assertRaises(ValueError), transaction.atomic():
+            Chat.objects.create(user=self.user)
+            raise ValueError
+        self.assertEqual(len(callbacks), 1)
+        callbacks[0]()
+        cached, data = self.get('chat-list')
+        self.assertEqual(cached, 'MISS')
+        self.assertEqual(len(data['results']), 2)
+
+    @override_settings(ARCHIVE_JOB_RUNNER='eager')
+    def test_bulk_archive_invalidates(self):
+        self.get('chat-list')
+        self.client.login(username='admin', password='test')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('chat-bulk-archive'), {"chats": [self.chat.pk]}, format='json')
+        self.client.login(username='testuser', password='test')
+        cached, data = self.get('chat-list')
+        self.assertEqual(cached, 'MISS')
+        self.assertTrue(data['results'][0]['archived'])
+
+    def test_bulk_create_invalidates(self):
+        self.get('chat-list')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('message-bulk-create'), [{"chat": self.chat.pk, "content": "Hello!"}], format='json')
+        cached, data = self.get('chat-list')
+        self.assertEqual(cached, 'MISS')
+        self.assertEqual(data['results'][0]['message_count'], 1)
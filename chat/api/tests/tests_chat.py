@@ -1,10 +1,14 @@
 from rest_framework.test import APITestCase
 from rest_framework import status
+from django.core.cache import cache
 from django.urls import reverse
-from api.models import Chat, User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from api.models import Chat, Message, User
 
 class ChatListAPIViewTests(APITestCase): 
     def setUp(self):
+        cache.clear()
         self.user = User.objects.create_user(username='testuser', password='test')
         self.chat = Chat.objects.create(user=self.user)
         self.url = reverse('chat-list')
@@ -19,6 +23,51 @@ class ChatListAPIViewTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['results'][0]['user'], self.user.pk)
 
+    def test_user_filter(self):
+        self.client.login(username='testuser', password='test')
+        response = self.client.get(self.url, {'user': self.user.pk})
+        self.assertEqual(len(response.data['results']), 1)
+        for value in (2**63, 0, 1.5, 'x'):
+            response = self.client.get(self.url, {'user': value})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, value)
+
+    def test_cursor_pagination(self):
+        for _ in range(6):
+            Chat.objects.create(user=self.user)
+        self.client.login(username='testuser', password='test')
+        response = self.client.get(self.url)
+        self.assertNotIn('count', response.data)
+        self.assertEqual(len(response.data['results']), 5)
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNone(response.data['next'])
+        self.assertIsNotNone(response.data['previous'])
+
+    def test_latest_messages_preview(self):
+        for i in range(5):
+            Message.objects.create(user=self.user, chat=self.chat, content=f"Message {i}")
+        self.client.login(username='testuser', password='test')
+        response = self.client.get(self.url)
+        chat = response.data['results'][0]
+        self.assertEqual(chat['message_count'], 5)
+        self.assertEqual([m['content'] for m in chat['latest_messages']], ["Message 4", "Message 3", "Message 2"])
+        self.assertEqual(chat['latest_messages'][0]['user'], self.user.pk)
+        self.assertNotIn('messages', chat)
+
+    def test_preview_queries_do_not_grow_with_chats(self):
+        self.client.login(username='testuser', password='test')
+        with CaptureQueriesContext(connection) as one_chat:
+            self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(4):
+                chat = Chat.objects.create(user=self.user)
+                for i in range(4):
+                    Message.objects.create(user=self.user, chat=chat, content=f"Message {i}")
+        with CaptureQueriesContext(connection) as many_chats:
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertEqual(len(one_chat), len(many_chats))
+
 class ChatCreateAPIViewTests(APITestCase):
     def setUp(self):
         self.admin = User.objects.create_superuser(username='admin', password='test')
@@ -0,0 +1,89 @@
+from django.core.cache import cache
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from api.models import User, Chat, Message
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='test')
+        self.user2 = User.objects.create_user(username='testuser2', password='test')
+        self.chat = Chat.objects.create(user=self.user)
+        self.message = Message.objects.create(user=self.user, chat=self.chat, content="Hello!")
+        self.client.login(username='testuser', password='test')
+
+    def assertNotModified(self, url, listed=False):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['ETag'].startswith('"'))
+        # Lists have no Last-Modified, deleting one of their rows would not move it.
+        self.assertEqual('Last-Modified' in response, not listed)
+        etag = response['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+        return etag
+
+    def test_message_list(self):
+        url = reverse('message-list')
+        etag = self.assertNotModified(url, listed=True)
+        Message.objects.create(user=self.user, chat=self.chat, content="New")
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_message_list_delete_changes_etag(self):
+        Message.objects.create(user=self.user, chat=self.chat, content="New")
+        url = reverse('message-list')
+        etag = self.assertNotModified(url, listed=True)
+        self.message.delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_list_validates_its_page(self):
+        newer = [Message.objects.create(user=self.user, chat=self.chat, content=f"New {i}") for i in range(3)]
+        url = reverse('message-list') + '?page_size=1'
+        etag = self.assertNotModified(url, listed=True)
+        # Past the page and the row telling whether there is a next page.
+        newer[-1].delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        self.message.delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+    def test_chat_list_tracks_messages(self):
+        url = reverse('chat-list')
+        etag = self.assertNotModified(url, listed=True)
+        self.message.content = "Edited"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.message.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['latest_messages'][0]['content'], "Edited")
+
+    def test_chat_list_not_modified_from_cache(self):
+        url = reverse('chat-list')
+        etag = self.assertNotModified(url, listed=True)
+        with self.assertNumQueries(2):  # session and user
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+    def test_retrieve(self):
+        self.assertNotModified(reverse('chat-action', args=[self.chat.pk]))
+        url = reverse('message-action', args=[self.message.pk])
+        etag = self.assertNotModified(url)
+        self.client.patch(url, {"content": "Edited"})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_retrieve_permission_before_validators(self):
+        url = reverse('chat-action', args=[self.chat.pk])
+        etag = self.client.get(url)['ETag']
+        self.client.login(username='testuser2', password='test')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.get(reverse('chat-action', args=[999]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,125 @@
+from io import StringIO
+from django.core.management import call_command
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from api.models import User, Chat, Message
+
+
+class ChatCounterTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='test')
+        self.admin = User.objects.create_superuser(username='admin', password='test')
+        self.chat = Chat.objects.create(user=self.user)
+        self.messages = [Message.objects.create(user=self.user, chat=self.chat, content=f"Hello {i}") for i in range(3)]
+
+    def assertCounters(self, chat, count, last_message):
+        chat.refresh_from_db()
+        self.assertEqual(chat.message_count, count)
+        self.assertEqual(chat.last_message_id, last_message and last_message.pk)
+        self.assertEqual(chat.last_message_at, last_message.created_at if last_message else chat.created_at)
+
+    def test_new_chat(self):
+        chat = Chat.objects.create(user=self.user)
+        self.assertCounters(chat, 0, None)
+
+    def test_create(self):
+        self.assertCounters(self.chat, 3, self.messages[-1])
+        self.client.login(username='testuser', password='test')
+        response = self.client.post(reverse('message-create'), {'user': self.user.pk, 'chat': self.chat.pk, 'content': "New"})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertCounters(self.chat, 4, self.chat.messages.latest('id'))
+
+    def test_bulk_create(self):
+        self.client.login(username='testuser', password='test')
+        data = [{"chat": self.chat.pk, "content": f"Message {i}"} for i in range(5)]
+        response = self.client.post(reverse('message-bulk-create'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertCounters(self.chat, 8, self.chat.messages.latest('id'))
+
+    def test_delete(self):
+        self.messages[0].delete()
+        self.assertCounters(self.chat, 2, self.messages[-1])
+        self.messages[-1].delete()
+        self.assertCounters(self.chat, 1, self.messages[1])
+        self.messages[1].delete()
+        self.assertCounters(self.chat, 0, None)
+
+    def test_archive_message(self):
+        message = self.messages[-1]
+        message.archived = True
+        message.save()
+        self.assertCounters(self.chat, 2, self.messages[1])
+        message.delete()
+        self.assertCounters(self.chat, 2, self.messages[1])
+
+        message = Message.objects.get(pk=self.messages[0].pk)
+        message.archived = True
+        message.save()
+        message.archived = False
+        message.save()
+        self.assertCounters(self.chat, 2, self.messages[1])
+
+    def test_chat_save_keeps_counters(self):
+        chat = Chat.objects.get(pk=self.chat.pk)
+        Message.objects.create(user=self.user, chat=self.chat, content="Meanwhile")
+        chat.save()
+        self.assertCounters(chat, 4, self.chat.messages.latest('created_at', 'id'))
+
+    @override_settings(ARCHIVE_JOB_RUNNER='eager', ARCHIVE_JOB_CHUNK_SIZE=2)
+    def test_archive_job(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.chat.archived = True
+            self.chat.save()
+        self.assertCounters(self.chat, 0, None)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.chat.archived = False
+            self.chat.save()
+        self.assertCounters(self.chat, 3, self.messages[-1])
+
+    def test_serialized(self):
+        self.client.login(username='testuser', password='test')
+        response = self.client.get(reverse('chat-action', args=[self.chat.pk]))
+        self.assertEqual(response.data['message_count'], 3)
+        self.assertEqual(response.data['last_message_id'], self.messages[-1].pk)
+
+    def test_counters_read_only(self):
+        self.client.login(username='admin', password='test')
+        response = self.client.patch(reverse('chat-action', args=[self.chat.pk]), {'message_count': 100})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertCounters(self.chat, 3, self.messages[-1])
+
+    def test_order_by_activity(self):
+        older = Chat.objects.create(user=self.user)
+        empty = Chat.objects.create(user=self.user)
+        Message.objects.create(user=self.user, chat=older, content="Old")
+        latest = Chat.objects.create(user=self.user)
+        Message.objects.create(user=self.user, chat=latest, content="Latest")
+        self.client.login(username='testuser', password='test')
+
+        url = reverse('chat-list')
+        response = self.client.get(url, {'ordering': '-last_message_at'})
+        expected = [latest.pk, older.pk, empty.pk, self.chat.pk]
+        self.assertEqual([chat['id'] for chat in response.data['results']], expected)
+
+        ids = []
+        params = {'ordering': '-last_message_at', 'page_size': 1}
+        while url:
+            response = self.client.get(url, params)
+            ids += [chat['id'] for chat in response.data['results']]
+            url, params = response.data['next'], None
+        self.assertEqual(ids, expected)
+
+    def test_recount(self):
+        Chat.objects.filter(pk=self.chat.pk).update(message_count=10, last_message_id=None)
+        out = StringIO()
+        call_command('recount_chats', dry_run=True, stdout=out)
+        self.assertIn('1 chats have wrong counters', out.getvalue())
+        self.assertEqual(Chat.objects.get(pk=self.chat.pk).message_count, 10)
+
+        call_command('recount_chats', batch_size=1, stdout=StringIO())
+        self.assertCounters(self.chat, 3, self.messages[-1])
+        out = StringIO()
+        call_command('recount_chats', stdout=out)
+        self.assertIn('0 chats had wrong counters', out.getvalue())
@@ -0,0 +1,47 @@
+from django.db import OperationalError, connection, transaction
+from django.test import TransactionTestCase, override_settings
+from api.db import atomic_with_retry
+from api.models import User
+
+
+@override_settings(DATABASE_WRITE_RETRIES=2, DATABASE_WRITE_RETRY_DELAY=0)
+class AtomicWithRetryTests(TransactionTestCase):
+    def flaky(self, failures, error='database is locked'):
+        calls = []
+
+        def create():
+            calls.append(connection.in_atomic_block)
+            User.objects.create(username=f'user{len(calls)}')
+            if len(calls) <= failures:
+                raise OperationalError(error)
+            return len(calls)
+        return create, calls
+
+    def test_retries_locked(self):
+        create, calls = self.flaky(2)
+        with self.assertLogs('api.db', 'WARNING'):
+            self.assertEqual(atomic_with_retry(create), 3)
+        self.assertEqual(calls, [True] * 3)
+        # The failed attempts were rolled back.
+        self.assertEqual(list(User.objects.values_list('username', flat=True)), ['user3'])
+
+    def test_gives_up(self):
+        create, calls = self.flaky(3)
+        with self.assertLogs('api.db', 'WARNING'), self.assertRaises(OperationalError):
+            atomic_with_retry(create)
+        self.assertEqual(len(calls), 3)
+        self.assertFalse(User.objects.exists())
+
+    def test_other_errors_are_not_retried(self):
+        create, calls = self.flaky(1, 'no such table: api_user')
+        with self.assertRaises(OperationalError):
+            atomic_with_retry(create)
+        self.assertEqual(len(calls), 1)
+
+    def test_nested(self):
+        create, calls = self.flaky(1)
+        with transaction.atomic():
+            with self.assertRaises(OperationalError):
+                atomic_with_retry(create)
+            self.assertFalse(User.objects.exists())
+        self.assertEqual(len(calls), 1)
@@ -0,0 +1,139 @@
+import threading
+import time
+from django.core.cache import cache
+from django.db import connections
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from api.groupcommit import GroupCommitQueue, message_queue, save_message
+from api.models import User, Chat, Message
+
+
+class GroupCommitQueueTests(SimpleTestCase):
+    def setUp(self):
+        self.batches = []
+        self.queue = GroupCommitQueue(self.flush)
+
+    def flush(self, items):
+        time.sleep(0.01)
+        if 'bad' in items:
+            raise ValueError('bad item')
+        self.batches.append(items)
+
+    def submit_all(self, items, **kwargs):
+        results, errors = {}, {}
+
+        def submit(item):
+            try:
+                results[item] = (self.queue.submit(item, **kwargs), sum(item in batch for batch in self.batches))
+            except ValueError as exc:
+                errors[item] = exc
+
+        threads = [threading.Thread(target=submit, args=(item,)) for item in items]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_batches(self):
+        results, errors = self.submit_all(range(20), max_batch=5, max_delay=1)
+        self.assertEqual(errors, {})
+        # Every item was committed exactly once before its submit() returned.
+        self.assertEqual(results, {item: (item, 1) for item in range(20)})
+        self.assertEqual(sorted(item for batch in self.batches for item in batch), list(range(20)))
+        self.assertTrue(all(len(batch) <= 5 for batch in self.batches))
+        self.assertLess(len(self.batches), 20)
+        stats = self.queue.get_stats()
+        self.assertEqual((stats['batches'], stats['messages']), (len(self.batches), 20))
+        self.assertEqual(stats['max_batch_size'], max(map(len, self.batches)))
+        self.assertGreaterEqual(stats['flush_ms_p50'], 10)
+        self.assertFalse(self.queue.leading)
+
+    def test_delay(self):
+        start = time.monotonic()
+        self.assertEqual(self.queue.submit('alone', max_batch=10, max_delay=0.05), 'alone')
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+        self.assertEqual(self.batches, [['alone']])
+
+    def test_failed_items(self):
+        with self.assertLogs('api.groupcommit', 'WARNING'):
+            results, errors = self.submit_all(['a', 'bad', 'b', 'c'], max_batch=4, max_delay=1)
+        self.assertEqual(set(results), {'a', 'b', 'c'})
+        self.assertEqual(list(errors), ['bad'])
+        self.assertEqual(self.queue.get_stats()['messages'], 3)
+        self.assertFalse(self.queue.leading)
+
+
+@override_settings(MESSAGE_GROUP_COMMIT=True)
+class MessageGroupCommitTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='test')
+        self.admin = User.objects.create_superuser(username='admin', password='test')
+        self.chat = Chat.objects.create(user=self.user)
+        self.client.force_authenticate(self.user)
+
+    def test_create(self):
+        self.client.get(reverse('chat-list'))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('message-create'), {'user': self.user.pk, 'chat': self.chat.pk, 'content': 'Hello'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data, {'user': self.user.pk, 'chat': self.chat.pk, 'content': 'Hello'})
+        message = Message.objects.get()
+        self.chat.refresh_from_db()
+        self.assertEqual((self.chat.message_count, self.chat.last_message_id), (1, message.pk))
+        # The cached chat list was invalidated.
+        response = self.client.get(reverse('chat-list'))
+        self.assertEqual(response.data['results'][0]['message_count'], 1)
+
+    def test_permissions(self):
+        other = Chat.objects.create(user=self.admin)
+        response = self.client.post(reverse('message-create'), {'user': self.user.pk, 'chat': other.pk, 'content': 'Hello'})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertFalse(Message.objects.exists())
+
+    def test_stats(self):
+        url = reverse('group-commit-stats')
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(self.admin)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('mean_batch_size', response.data)
+        self.assertIn('flush_ms_p95', response.data)
+
+
+@override_settings(MESSAGE_GROUP_COMMIT_MAX_BATCH=10, MESSAGE_GROUP_COMMIT_MAX_DELAY=0.05)
+class SaveMessageTests(TransactionTestCase):
+    def test_concurrent_messages(self):
+        user = User.objects.create_user(username='testuser', password='test')
+        chats = [Chat.objects.create(user=user) for _ in range(3)]
+        message_queue.reset_stats()
+        errors = []
+
+        def post(i):
+            try:
+                message = save_message(Message(user_id=user.pk, chat=chats[i % 3], content=f'Message {i}'))
+                # Committed, so visible to any other connection.
+                self.assertIsNotNone(message.pk)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=post, args=(i,)) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+        self.assertEqual(Message.objects.count(), 20)
+        for chat in chats:
+            chat.refresh_from_db()
+            latest = chat.messages.latest('created_at', 'id')
+            self.assertEqual((chat.message_count, chat.last_message_id), (chat.messages.count(), latest.pk))
+        stats = message_queue.get_stats()
+        self.assertEqual(stats['messages'], 20)
+        self.assertLess(stats['batches'], 20)
@@ -0,0 +1,169 @@
+import gzip
+import json
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from asgiref.sync import sync_to_async
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+from api.models import User, Chat, Message, ArchivedMessage
+
+
+@override_settings(ARCHIVE_JOB_RUNNER='eager', EXPORT_CHUNK_SIZE=3)
+class ChatExportTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='test')
+        self.other = User.objects.create_user(username='other', password='test')
+        self.admin = User.objects.create_superuser(username='admin', password='test')
+        self.chat = Chat.objects.create(user=self.user)
+        self.archived = Chat.objects.create(user=self.user)
+        self.empty = Chat.objects.create(user=self.user)
+        start = timezone.now() - timedelta(days=1)
+        for chat in (self.chat, self.archived):
+            for i in range(8):
+                message = Message.objects.create(user=self.user if i % 2 else self.admin, chat=chat, content=f"Message {i} ✓")
+                # Pairs of messages share their creation time, the export breaks the ties by id.
+                Message.objects.filter(pk=message.pk).update(created_at=start + timedelta(minutes=i // 2))
+        self.archived.archived = True
+        with self.captureOnCommitCallbacks(execute=True):
+            self.archived.save()
+        self.client.force_authenticate(self.user)
+
+    def export(self, chat, **params):
+        response = self.client.get(reverse('chat-export', args=[chat.pk]), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def records(self, content):
+        return [json.loads(line) for line in content.decode().splitlines()]
+
+    def test_export(self):
+        response, content = self.export(self.chat)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(response['Content-Disposition'], f'attachment; filename="chat-{self.chat.pk}.ndjson"')
+        chat, *messages = self.records(content)
+        self.assertEqual(chat, {
+            'type': 'chat', 'id': self.chat.pk, 'user': self.user.pk, 'archived': False,
+            'created_at': chat['created_at'], 'updated_at': chat['updated_at'],
+        })
+        expected = self.chat.messages.order_by('created_at', 'id')
+        self.assertEqual([message['id'] for message in messages], list(expected.values_list('pk', flat=True)))
+        self.assertEqual(messages[0], {
+            'type': 'message', 'id': expected[0].pk, 'user': self.admin.pk, 'chat': self.chat.pk,
+            'content': 'Message 0 ✓', 'archived': False,
+            'created_at': messages[0]['created_at'], 'updated_at': messages[0]['updated_at'],
+        })
+
+    def test_archived_and_empty_chats(self):
+        _, content = self.export(self.archived)
+        chat, *messages = self.records(content)
+        self.assertTrue(chat['archived'])
+        self.assertEqual(len(messages), 8)
+        self.assertEqual(
+            [message['id'] for message in messages],
+            list(ArchivedMessage.objects.filter(chat=self.archived).order_by('created_at', 'id').values_list('pk', flat=True)),
+        )
+        _, content = self.export(self.empty)
+        self.assertEqual([record['type'] for record in self.records(content)], ['chat'])
+
+    def test_gzip(self):
+        _, plain = self.export(self.chat)
+        response, compressed = self.export(self.chat, compression='gzip')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('.ndjson.gz', response['Content-Disposition'])
+        self.assertEqual(gzip.decompress(compressed), plain)
+
+        response = self.client.get(reverse('chat-export', args=[self.chat.pk]), {'compression': 'brotli'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_asgi_streams(self):
+        _, plain = await sync_to_async(self.export)(self.chat)
+        response = await self.async_client.get(
+            reverse('chat-export', args=[self.chat.pk]),
+            headers={'Authorization': f'Bearer {AccessToken.for_user(self.user)}'},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Streamed chunk by chunk instead of being consumed and buffered first.
+        self.assertTrue(response.is_async)
+        blocks = [block async for block in response.streaming_content]
+        self.assertEqual(len(blocks), 3)
+        self.assertEqual(b''.join(blocks), plain)
+
+    def test_permissions(self):
+        url = reverse('chat-export', args=[self.chat.pk])
+        self.client.force_authenticate(self.other)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(self.admin)
+        self.assertEqual(self.client.get(url, HTTP_ACCEPT='application/x-ndjson').status_code, status.HTTP_200_OK)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_queries_per_chunk(self):
+        response = self.client.get(reverse('chat-export', args=[self.chat.pk]))
+        with self.assertNumQueries(1 + 3 + 1):
+            # The chat, its eight messages in chunks of three and its archived messages.
+            b''.join(response.streaming_content)
+
+    def test_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'history.ndjson.gz')
+            out = StringIO()
+            call_command('export_history', path, user=[self.user.pk], chunk_size=2, stdout=out)
+            self.assertIn('Exported 3 chats and 16 messages', out.getvalue())
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command('import_history', path, user=self.other.pk, batch_size=5, stdout=out)
+        self.assertIn('Imported 3 chats and 16 messages', out.getvalue())
+
+        chats = Chat.objects.filter(user=self.other).order_by('pk')
+        self.assertEqual([chat.archived for chat in chats], [False, True, False])
+        imported, archived, empty = chats
+        self.assertEqual(imported.created_at, self.chat.created_at)
+        self.assertEqual((imported.message_count, empty.message_count, archived.message_count), (8, 0, 0))
+        self.assertEqual(
+            list(imported.messages.order_by('created_at', 'id').values_list('content', 'created_at')),
+            list(self.chat.messages.order_by('created_at', 'id').values_list('content', 'created_at')),
+        )
+        self.assertEqual(imported.last_message_id, imported.messages.latest('created_at', 'id').pk)
+        self.assertFalse(imported.messages.exclude(user=self.other).exists())
+        self.assertEqual(archived.archived_messages.count(), 8)
+
+        self.client.force_authenticate(self.other)
+        response = self.client.get(reverse('message-search'), {'q': 'Message'})
+        self.assertEqual({message['chat'] for message in response.data['results']}, {imported.pk})
+
+    def test_import_keeps_users(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'chat.ndjson')
+            call_command('export_history', path, chat=[self.chat.pk], stdout=StringIO())
+            call_command('import_history', path, stdout=StringIO())
+        imported = Chat.objects.latest('pk')
+        self.assertEqual(imported.user, self.user)
+        self.assertEqual(imported.messages.filter(user=self.admin).count(), 4)
+
+    def test_invalid_imports(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'chat.ndjson')
+            call_command('export_history', path, chat=[self.chat.pk], stdout=StringIO())
+            with self.assertRaisesMessage(CommandError, 'Users not found: 999.'):
+                call_command('import_history', path, user=999)
+
+            with open(path, 'a') as f:
+                f.write('{"type": "message", "chat": 12345}\n')
+            with self.assertRaisesMessage(CommandError, 'Invalid export'):
+                call_command('import_history', path, stdout=StringIO())
+            with open(path, 'a') as f:
+                f.write('not json\n')
+            with self.assertRaisesMessage(CommandError, 'is not JSON'):
+                call_command('import_history', path, stdout=StringIO())
+        self.assertEqual(Chat.objects.count(), 3)
+
+        with self.assertRaisesMessage(CommandError, '--chat'):
+            call_command('export_history', 'unused.ndjson')
@@ -1,7 +1,8 @@
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.urls import reverse
-from api.models import User, Chat, Message
+from django.test import override_settings
+from api.models import User, Chat, Message, ArchivedMessage
 
 class MessageChatIntegrationTest(APITestCase):
     def setUp(self):
@@ -12,20 +13,22 @@ class MessageChatIntegrationTest(APITestCase):
         self.message_admin = Message.objects.create(user=self.admin, chat=self.chat, content="Hi!")
 
 
+    @override_settings(ARCHIVE_JOB_RUNNER='eager')
     def test_chat_archive(self):
         self.client.login(username='admin', password='test')
         url = reverse('chat-action', args=[self.chat.pk])
         data = {
             "archived": True,
         }
-        response = self.client.patch(url, data)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(url, data)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.chat.refresh_from_db()
         self.assertTrue(self.chat.archived)
-        self.message_user.refresh_from_db()
-        self.assertTrue(self.message_user.archived)
-        self.message_admin.refresh_from_db()
-        self.assertTrue(self.message_admin.archived)
+        self.assertFalse(Message.objects.filter(chat=self.chat).exists())
+        archived = ArchivedMessage.objects.filter(chat=self.chat).order_by('id')
+        self.assertEqual([message.pk for message in archived], [self.message_user.pk, self.message_admin.pk])
+        self.assertTrue(all(message.archived for message in archived))
 
     def test_message_create_with_chat(self):
         self.client.login(username='testuser', password='test')
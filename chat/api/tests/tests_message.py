@@ -104,4 +104,114 @@ class MessageRetrieveUpdateDestroyAPIViewTests(APITestCase):
         self.client.login(username='admin', password='test')
         response = self.client.delete(self.url)
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
-        self.assertEqual(Message.objects.count(), 1)
\ No newline at end of file
+        self.assertEqual(Message.objects.count(), 1)
+
+class MessageCursorPaginationTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='test')
+        self.chat = Chat.objects.create(user=self.user)
+        self.messages = [
+            Message.objects.create(user=self.user, chat=self.chat, content=f"Message {i}")
+            for i in range(12)
+        ]
+        self.url = reverse('message-list')
+        self.client.login(username='testuser', password='test')
+
+    def test_first_page(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', response.data)
+        self.assertIsNone(response.data['previous'])
+        self.assertIsNotNone(response.data['next'])
+        self.assertEqual([m['content'] for m in response.data['results']], [f"Message {i}" for i in range(5)])
+
+    def test_forward_and_backward(self):
+        contents = []
+        url = self.url
+        while url:
+            response = self.client.get(url)
+            contents += [m['content'] for m in response.data['results']]
+            last_page, url = response, response.data['next']
+        self.assertEqual(contents, [m.content for m in self.messages])
+
+        response = self.client.get(last_page.data['previous'])
+        self.assertEqual([m['content'] for m in response.data['results']], [f"Message {i}" for i in range(5, 10)])
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([m['content'] for m in response.data['results']], [f"Message {i}" for i in range(5)])
+        self.assertIsNone(response.data['previous'])
+
+    def test_page_size(self):
+        response = self.client.get(self.url, {'page_size': 10})
+        self.assertEqual(len(response.data['results']), 10)
+        response = self.client.get(self.url, {'page_size': 1000})
+        self.assertEqual(len(response.data['results']), 12)
+
+    def test_filters(self):
+        response = self.client.get(self.url, {'chat': self.chat.pk, 'user': self.user.pk})
+        self.assertEqual(len(response.data['results']), 5)
+        for name in ('chat', 'user'):
+            for value in (2**63, 0, 1.5, 'x'):
+                response = self.client.get(self.url, {name: value})
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, (name, value))
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {'cursor': 'invalid'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class MessageBulkCreateAPIViewTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='test')
+        self.user2 = User.objects.create_user(username='testuser2', password='test')
+        self.chat = Chat.objects.create(user=self.user)
+        self.chat2 = Chat.objects.create(user=self.user2)
+        self.url = reverse('message-bulk-create')
+
+    def test_not_authenticated(self):
+        response = self.client.post(self.url, [], format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_authenticated(self):
+        self.client.login(username='testuser', password='test')
+        data = [{"chat": self.chat.pk, "content": f"Message {i}"} for i in range(20)]
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data), 20)
+        self.assertEqual(Message.objects.filter(chat=self.chat, user=self.user).count(), 20)
+        self.assertEqual(response.data[3]['message']['content'], "Message 3")
+
+    def test_per_item_results(self):
+        self.client.login(username='testuser', password='test')
+        data = [
+            {"chat": self.chat.pk, "content": "Hello!"},
+            {"chat": self.chat2.pk, "content": "Not my chat"},
+            {"chat": 999, "content": "No chat"},
+            {"chat": self.chat.pk},
+        ]
+        # session, user, one chat lookup, a single INSERT and one counter UPDATE per chat
+        # inside its savepoint
+        with self.assertNumQueries(7):
+            response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([r['status'] for r in response.data], [201, 403, 404, 400])
+        self.assertEqual(Message.objects.count(), 1)
+
+    def test_chat_out_of_range(self):
+        self.client.login(username='testuser', password='test')
+        data = [
+            {"chat": self.chat.pk, "content": "Hello!"},
+            {"chat": 2**63, "content": "Too large"},
+            {"chat": 0, "content": "Too small"},
+        ]
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([r['status'] for r in response.data], [201, 400, 400])
+        self.assertEqual(Message.objects.count(), 1)
+
+    def test_max_batch_size(self):
+        self.client.login(username='testuser', password='test')
+        with self.settings(MESSAGE_BULK_MAX_SIZE=2):
+            data = [{"chat": self.chat.pk, "content": "Hello!"}] * 3
+            response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Message.objects.count(), 0)
@@ -0,0 +1,54 @@
+from datetime import timedelta
+from io import StringIO
+from django.core.management import call_command
+from django.db.models import Count, F, Max, Min
+from django.test import TestCase
+from django.utils import timezone
+from api.models import User, Chat, Message
+
+
+class PopulateDBCommandTests(TestCase):
+    def populate(self, **options):
+        call_command('populate_db', stdout=StringIO(), **options)
+
+    def test_demo(self):
+        self.populate()
+        self.assertEqual(User.objects.count(), 4)
+        self.assertEqual(Chat.objects.count(), 2)
+        self.assertEqual(Message.objects.count(), 20)
+
+    def test_scale(self):
+        self.populate(users=5, chats_per_user=3, messages_per_chat=7, batch_size=10)
+        self.assertEqual(User.objects.filter(username__startswith='user_').count(), 5)
+        self.assertEqual(Chat.objects.count(), 15)
+        self.assertEqual(set(Chat.objects.annotate(n=Count('messages')).values_list('n', flat=True)), {7})
+        self.assertFalse(Message.objects.exclude(user=F('chat__user')).exists())
+        self.assertTrue(User.objects.get(username='user_4').check_password('test'))
+
+        message = Message.objects.first()
+        self.assertFalse(message.archived)
+        self.assertIsNotNone(message.created_at)
+
+        self.populate(users=7, chats_per_user=1, messages_per_chat=1)
+        self.assertEqual(User.objects.filter(username__startswith='user_').count(), 7)
+        self.assertEqual(Chat.objects.count(), 17)
+        self.populate(users=7)
+        self.assertEqual(Chat.objects.count(), 17)
+
+    def test_skew(self):
+        self.populate(users=10, chats_per_user=10, messages_per_chat=20, skew=1.2, seed=1)
+        sizes = sorted(Chat.objects.annotate(n=Count('messages')).values_list('n', flat=True), reverse=True)
+        self.assertEqual(sum(sizes), 2000)
+        self.assertGreater(sizes[0], 10 * sizes[50])
+
+    def test_timestamps(self):
+        self.populate(users=2, chats_per_user=2, messages_per_chat=20, days=7, seed=1)
+        now = timezone.now()
+        for chat in Chat.objects.all():
+            timestamps = list(chat.messages.order_by('id').values_list('created_at', flat=True))
+            self.assertEqual(timestamps, sorted(timestamps))
+            self.assertEqual(len(set(timestamps)), 20)
+            self.assertGreater(timestamps[0], now - timedelta(days=7))
+            self.assertEqual(chat.created_at, timestamps[0])
+            self.assertEqual(chat.last_message_at, timestamps[-1])
+        self.assertGreater(Message.objects.aggregate(span=Max('created_at') - Min('created_at'))['span'], timedelta(days=1))
@@ -0,0 +1,87 @@
+import re
+from datetime import datetime, timezone
+from rest_framework.test import APITestCase, APIRequestFactory
+from api.models import User, Chat, Message
+from api.views import ChatListAPIView, MessageListAPIView
+from api.pagination import ChatPagination, KeysetCursorPagination
+from api.sync import get_streams
+
+FULL_SCAN = re.compile(r'\bSCAN api_\w+\b(?! USING)')
+SORT = re.compile(r'USE TEMP B-TREE FOR ORDER BY')
+
+
+class QueryPlanTests(APITestCase):
+    """
+    Guards the composite indexes: the querysets behind the list views have to be
+    served by an index, both for the first page and for a keyset page.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='test')
+        self.admin = User.objects.create_superuser(username='admin', password='test')
+        self.chat = Chat.objects.create(user=self.user)
+        Message.objects.create(user=self.user, chat=self.chat, content="Hello!")
+
+    def get_queryset(self, view_class, user, params=None):
+        request = APIRequestFactory().get('/', params)
+        view = view_class()
+        view.setup(request)
+        view.request = view.initialize_request(request)
+        view.request.user = user
+        return view.get_queryset()
+
+    def get_plans(self, view_class, user, params=None):
+        paginator = view_class.pagination_class()
+        queryset = self.get_queryset(view_class, user, params).order_by(*paginator.ordering)
+        position = [datetime(2025, 1, 1, tzinfo=timezone.utc), 1]
+        return [
+            queryset.explain(),
+            queryset.filter(paginator.get_keyset_filter(paginator.ordering, position)).explain(),
+        ]
+
+    def assertIndexed(self, plan):
+        self.assertIsNone(FULL_SCAN.search(plan), plan)
+        self.assertIsNone(SORT.search(plan), plan)
+
+    def test_message_list(self):
+        for plan in self.get_plans(MessageListAPIView, self.user):
+            self.assertIndexed(plan)
+
+    def test_message_list_as_admin(self):
+        for plan in self.get_plans(MessageListAPIView, self.admin):
+            self.assertIndexed(plan)
+
+    def test_archived_message_list(self):
+        for user in (self.user, self.admin):
+            for plan in self.get_plans(MessageListAPIView, user, {'archive': 'true'}):
+                self.assertIn('api_archivedmessage', plan)
+                self.assertIndexed(plan)
+
+    def test_chat_list(self):
+        for plan in self.get_plans(ChatListAPIView, self.user):
+            self.assertIndexed(plan)
+
+    def test_chat_list_as_admin(self):
+        for plan in self.get_plans(ChatListAPIView, self.admin):
+            self.assertIndexed(plan)
+
+    def test_chat_archive_update(self):
+        queryset = self.chat.messages.filter(archived=False)
+        self.assertIndexed(queryset.explain())
+
+    def test_sync_streams(self):
+        position = [datetime(2025, 1, 1, tzinfo=timezone.utc), 1]
+        for user in (self.user, self.admin):
+            for stream in get_streams(user):
+                queryset = stream.queryset.order_by(*stream.ordering)
+                self.assertIndexed(queryset.explain())
+                self.assertIndexed(queryset.filter(
+                    KeysetCursorPagination().get_keyset_filter(stream.ordering, position)
+                ).explain())
+
+    def test_chat_list_by_activity(self):
+        position = [datetime(2025, 1, 1, tzinfo=timezone.utc), 1]
+        ordering = ChatPagination.orderings['-last_message_at']
+        for user in (self.user, self.admin):
+            queryset = self.get_queryset(ChatListAPIView, user).order_by(*ordering)
+            self.assertIndexed(queryset.explain())
+            self.assertIndexed(queryset.filter(KeysetCursorPagination().get_keyset_filter(ordering, position)).explain())
@@ -0,0 +1,104 @@
+import os
+import tempfile
+from django.core.cache import cache
+from django.db import connections
+from django.test import TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from api import routers
+from api.models import User, Chat
+from api.replication import replicate
+
+REPLICAS = ['replica_a', 'replica_b']
+
+
+@override_settings(DATABASE_REPLICAS=REPLICAS, REPLICA_HEALTH_CHECK_INTERVAL=0, REPLICA_MAX_LAG=60)
+class ReplicaRouterTests(TransactionTestCase):
+    """
+    Replicas are SQLite files that only see the primary's data once replicate() copied it.
+    """
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.TemporaryDirectory()
+        for alias in REPLICAS:
+            cls.add_database(alias, os.path.join(cls.directory.name, f'{alias}.sqlite3'))
+
+    @classmethod
+    def tearDownClass(cls):
+        for alias in REPLICAS:
+            cls.remove_database(alias)
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+    @classmethod
+    def add_database(cls, alias, name):
+        config = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': name}
+        connections.settings[alias] = connections.configure_settings({'default': config})['default']
+
+    @classmethod
+    def remove_database(cls, alias):
+        connections[alias].close()
+        del connections[alias]
+        del connections.settings[alias]
+
+    def setUp(self):
+        # The replica aliases only exist while the class runs, so they are allowed here
+        # rather than in `databases`, which the test runner checks before.
+        databases = type(self).databases
+        type(self).databases = {*databases, *REPLICAS, 'replica_missing'}
+        self.addCleanup(setattr, type(self), 'databases', databases)
+        routers._health.clear()
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='test')
+        self.user2 = User.objects.create_user(username='testuser2', password='test')
+        self.chat = Chat.objects.create(user=self.user)
+        replicate()
+        self.unreplicated = Chat.objects.create(user=self.user)
+        self.url = reverse('chat-list')
+
+    def client_for(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+        return client
+
+    def chat_ids(self, client):
+        response = client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [chat['id'] for chat in response.data['results']]
+
+    def test_reads_from_replica(self):
+        self.assertEqual(self.chat_ids(self.client_for(self.user)), [self.chat.pk])
+
+    def test_reads_own_writes(self):
+        client = self.client_for(self.user2)
+        response = client.post(reverse('chat-create'), {'user': self.user2.pk}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(self.chat_ids(client)), 1)
+        # Other users keep reading from the replicas.
+        self.assertEqual(self.chat_ids(self.client_for(self.user)), [self.chat.pk])
+
+    @override_settings(REPLICA_STICKY_SECONDS=0)
+    def test_sticky_window(self):
+        client = self.client_for(self.user2)
+        client.post(reverse('chat-create'), {'user': self.user2.pk}, format='json')
+        self.assertEqual(self.chat_ids(client), [])
+
+    @override_settings(REPLICA_MAX_LAG=0)
+    def test_stale_replicas(self):
+        with self.assertLogs('api.routers', 'WARNING'):
+            self.assertEqual(self.chat_ids(self.client_for(self.user)), [self.chat.pk, self.unreplicated.pk])
+
+    def test_unhealthy_replica(self):
+        self.add_database('replica_missing', os.path.join(self.directory.name, 'missing', 'db.sqlite3'))
+        self.addCleanup(self.remove_database, 'replica_missing')
+        with self.settings(DATABASE_REPLICAS=[*REPLICAS, 'replica_missing']), self.assertLogs('api.routers', 'WARNING'):
+            for _ in range(5):
+                self.assertEqual(self.chat_ids(self.client_for(self.user)), [self.chat.pk])
+        self.assertFalse(routers._health['replica_missing'][1])
+
+    def test_outside_requests(self):
+        self.assertEqual(Chat.objects.count(), 2)
+        self.assertEqual(Chat.objects.using('replica_a').count(), 1)
@@ -0,0 +1,125 @@
+import datetime
+import uuid
+from decimal import Decimal
+from io import StringIO
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils.translation import gettext_lazy
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+from api.models import User, Chat, Message
+from api.renderers import FastJSONRenderer
+
+CONTENTS = [
+    'Hello',
+    'Grüße, 你好 and 🙂',
+    'Quotes " and \\ backslashes',
+    'Line\nbreaks\tand\rcontrol \x00\x01\x1f\x7f characters',
+    'Separators \u2028 and \u2029',
+    '</script><script>alert(1)</script>',
+    'x' * 250,
+    '',
+]
+
+
+class FastJSONRendererTests(TestCase):
+    def assertSameBytes(self, data, accepted_media_type=None):
+        self.assertEqual(
+            FastJSONRenderer().render(data, accepted_media_type),
+            JSONRenderer().render(data, accepted_media_type),
+        )
+
+    def test_plain_data(self):
+        self.assertSameBytes({'results': [{'id': 1, 'content': content, 'archived': False, 'next': None} for content in CONTENTS]})
+        self.assertSameBytes([2 ** 63 - 1, -2 ** 63, True, {'nested': [[], {}]}])
+        self.assertSameBytes(None)
+
+    def test_encoder_types(self):
+        moment = datetime.datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=datetime.timezone.utc)
+        self.assertSameBytes({
+            'moment': moment, 'whole_second': moment.replace(microsecond=0), 'naive': moment.replace(tzinfo=None),
+            'date': moment.date(), 'time': moment.time(), 'duration': datetime.timedelta(hours=1),
+            'decimal': Decimal('1.5'), 'uuid': uuid.UUID(int=1), 'lazy': gettext_lazy('Not found.'),
+            'set': {1}, 'tuple': (1, 2), 'bytes': b'raw',
+        })
+
+    def test_fallbacks(self):
+        self.assertSameBytes({'big': 2 ** 64, 'keys': {1: 'one'}})
+        self.assertSameBytes({'indented': [1, 2]}, 'application/json; indent=4')
+
+
+@override_settings(ARCHIVE_JOB_RUNNER='eager')
+class ValuesListParityTests(APITestCase):
+    """
+    The values() path of the list endpoints returns the bytes of the serializer path.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='test')
+        self.staff = User.objects.create_user(username='staff', password='test', is_staff=True)
+        self.chats = [Chat.objects.create(user=self.user) for _ in range(4)] + [Chat.objects.create(user=self.staff)]
+        for i, content in enumerate(CONTENTS * 2):
+            chat = self.chats[i % 3]
+            Message.objects.create(user=chat.user, chat=chat, content=content)
+        Message.objects.filter(content='Hello').update(archived=True)
+        archived = self.chats[1]
+        archived.archived = True
+        with self.captureOnCommitCallbacks(execute=True):
+            archived.save()
+
+    def fetch(self, user, url, params, fast):
+        cache.clear()
+        self.client.force_authenticate(user)
+        with self.settings(FAST_LIST_SERIALIZATION=fast):
+            return self.client.get(url, params)
+
+    def assertParity(self, user, viewname, params=None, pages=5):
+        url, params = reverse(viewname), params or {}
+        for _ in range(pages):
+            slow = self.fetch(user, url, params, False)
+            fast = self.fetch(user, url, params, True)
+            self.assertEqual(slow.status_code, 200)
+            self.assertEqual(fast.content, slow.content)
+            self.assertEqual(fast['ETag'], slow['ETag'])
+            url, params = slow.data['next'], {}
+            if url is None:
+                break
+
+    def test_messages(self):
+        for user in (self.user, self.staff):
+            self.assertParity(user, 'message-list', {'page_size': 3})
+            self.assertParity(user, 'message-list', {'page_size': 100, 'ordering': '-created_at'})
+        self.assertParity(self.user, 'message-list', {'chat': self.chats[0].pk})
+        self.assertParity(self.staff, 'message-list', {'archive': 'true'})
+        self.assertEqual(len(self.fetch(self.user, reverse('message-list'), {'archive': 'true'}, True).data['results']), 5)
+
+    def test_chats(self):
+        for user in (self.user, self.staff):
+            self.assertParity(user, 'chat-list', {'page_size': 2})
+            self.assertParity(user, 'chat-list', {'ordering': '-last_message_at'})
+
+    @override_settings(FAST_LIST_SERIALIZATION=True)
+    def test_fast_path(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(reverse('chat-list'), {'page_size': 100})
+        self.assertIsInstance(response.accepted_renderer, FastJSONRenderer)
+        self.assertEqual(len(response.data['results']), 4)
+        self.assertEqual(
+            [message['content'] for message in response.data['results'][0]['latest_messages']],
+            [CONTENTS[7], CONTENTS[4], CONTENTS[1]],
+        )
+        response = self.client.get(reverse('message-search'), {'q': 'Hello'})
+        self.assertNotIsInstance(response.accepted_renderer, FastJSONRenderer)
+
+
+class BenchSerializationCommandTests(TestCase):
+    def test_report(self):
+        user = User.objects.create_user(username='testuser', password='test')
+        chat = Chat.objects.create(user=user)
+        Message.objects.bulk_create([Message(user=user, chat=chat, content=f'Message {i}') for i in range(10)])
+        out = StringIO()
+        call_command('bench_serialization', rows=10, repeat=2, stdout=out)
+        output = out.getvalue()
+        self.assertIn('messages', output)
+        self.assertIn('chats', output)
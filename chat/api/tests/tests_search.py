@@ -0,0 +1,96 @@
+from io import StringIO
+from django.core.management import call_command
+from django.db import connection
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from api.models import User, Chat, Message
+from api.search import search_query
+
+
+class MessageSearchAPIViewTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='test')
+        self.user2 = User.objects.create_user(username='testuser2', password='test')
+        self.admin = User.objects.create_superuser(username='admin', password='test')
+        self.chat = Chat.objects.create(user=self.user)
+        self.chat2 = Chat.objects.create(user=self.user2)
+        self.once = Message.objects.create(user=self.user, chat=self.chat, content="The cat sat on the mat")
+        self.twice = Message.objects.create(user=self.user, chat=self.chat, content="Cat food for the cat")
+        self.other = Message.objects.create(user=self.user2, chat=self.chat2, content="A cat of another user")
+        self.url = reverse('message-search')
+        self.client.login(username='testuser', password='test')
+
+    def search(self, q, **params):
+        response = self.client.get(self.url, {'q': q, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def ids(self, data):
+        return [message['id'] for message in data['results']]
+
+    def test_not_authenticated(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url, {'q': 'cat'}).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_query_required(self):
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url, {'q': '"*'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_ranked_and_highlighted(self):
+        data = self.search('CAT')
+        self.assertEqual(self.ids(data), [self.twice.id, self.once.id])
+        self.assertLess(data['results'][0]['rank'], data['results'][1]['rank'])
+        self.assertEqual(data['results'][0]['highlight'], "<mark>Cat</mark> food for the <mark>cat</mark>")
+
+        self.assertEqual(self.ids(self.search('cat mat')), [self.once.id])
+        self.assertEqual(self.ids(self.search('fo*')), [self.twice.id])
+        self.assertEqual(self.ids(self.search('dog')), [])
+
+    def test_highlight_is_escaped(self):
+        Message.objects.create(user=self.user, chat=self.chat, content='<img src=x onerror="alert(1)"> cat & <mark>dog</mark>')
+        data = self.search('onerror')
+        self.assertEqual(
+            data['results'][0]['highlight'],
+            '&lt;img src=x <mark>onerror</mark>=&quot;alert(1)&quot;&gt; cat &amp; &lt;mark&gt;dog&lt;/mark&gt;',
+        )
+
+    def test_visibility(self):
+        self.assertEqual(self.ids(self.search('another')), [])
+        self.client.login(username='admin', password='test')
+        self.assertEqual(self.ids(self.search('another')), [self.other.id])
+        self.assertEqual(self.ids(self.search('cat', user=self.user2.id)), [self.other.id])
+
+    def test_pagination(self):
+        ids = self.ids(self.search('the'))
+        data = self.search('the', page_size=1)
+        paged = self.ids(data)
+        while data['next']:
+            data = self.client.get(data['next']).data
+            paged += self.ids(data)
+        self.assertEqual(paged, ids)
+        self.assertEqual(len(ids), 2)
+
+    def test_index_follows_changes(self):
+        self.once.content = "The dog sat on the mat"
+        self.once.save()
+        self.assertEqual(self.ids(self.search('cat')), [self.twice.id])
+        self.assertEqual(self.ids(self.search('dog')), [self.once.id])
+
+        self.twice.archived = True
+        self.twice.save()
+        self.assertEqual(self.search('cat')['results'][0]['archived'], True)
+
+        self.twice.delete()
+        self.assertEqual(self.ids(self.search('cat')), [])
+
+    def test_rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO api_message_fts(api_message_fts) VALUES ('delete-all')")
+        self.assertEqual(self.ids(self.search('cat')), [])
+        call_command('rebuild_search_index', optimize=True, stdout=StringIO())
+        self.assertEqual(self.ids(self.search('cat')), [self.twice.id, self.once.id])
+
+    def test_search_query(self):
+        self.assertEqual(search_query('cat AND "dog'), '"cat" "AND" """dog"')
+        self.assertEqual(search_query('ca* - *'), '"ca"*')
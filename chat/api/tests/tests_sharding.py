@@ -0,0 +1,331 @@
+import os
+import tempfile
+from io import StringIO
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connections
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from api.counters import refresh_chat_counters
+from api.models import User, Chat, Message, ArchivedMessage, Tombstone
+from api.sharding import copy_rows, directory_key, move_chat, plan_rebalance, purge_moved_chats
+
+SHARDS = ['shard_a', 'shard_b']
+
+
+@override_settings(MESSAGE_SHARDS=['default', *SHARDS], ARCHIVE_JOB_RUNNER='eager')
+class ShardingTests(TransactionTestCase):
+    """
+    Messages partitioned over the default test database and two SQLite files.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        for alias in SHARDS:
+            config = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(cls.directory.name, f'{alias}.sqlite3')}
+            connections.settings[alias] = connections.configure_settings({'default': config})['default']
+            with override_settings(MESSAGE_SHARDS=['default', *SHARDS]):
+                call_command('migrate', database=alias, verbosity=0)
+        # The shard aliases only exist while the class runs, so they are allowed here
+        # rather than in `databases`, which the test runner checks before.
+        cls.databases = {*cls.databases, *SHARDS}
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        del cls.databases
+        for alias in SHARDS:
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+        cls.directory.cleanup()
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='test')
+        self.other = User.objects.create_user(username='other', password='test')
+        self.staff = User.objects.create_user(username='staff', password='test', is_staff=True)
+        self.chats = {
+            alias: Chat.objects.create(user=self.user, shard=alias) for alias in ('default', *SHARDS)
+        }
+        self.other_chat = Chat.objects.create(user=self.other, shard='shard_b')
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def post(self, chat, content, user=None):
+        user = user or chat.user
+        response = self.client_for(user).post(reverse('message-create'), {'user': user.pk, 'chat': chat.pk, 'content': content})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        return Message.objects.filter(chat_id=chat.pk).latest('id')
+
+    def populate(self):
+        """
+        Three messages per chat of self.user, posted round robin over the shards.
+        """
+        messages = []
+        for i in range(3):
+            for alias, chat in self.chats.items():
+                messages.append(self.post(chat, f'{alias} message {i}'))
+        return messages
+
+    def test_messages_stay_on_chat_shard(self):
+        for alias, chat in self.chats.items():
+            self.post(chat, f'Hello {alias}')
+        for alias, chat in self.chats.items():
+            self.assertEqual(list(Message.objects.using(alias).values_list('chat_id', flat=True)), [chat.pk])
+            chat.refresh_from_db()
+            self.assertEqual(chat.message_count, 1)
+            self.assertEqual(chat.last_message_id, chat.messages.get().pk)
+
+    def test_new_chats_are_placed_on_a_shard(self):
+        chat = Chat.objects.create(user=self.user)
+        self.assertIn(chat.shard, ['default', *SHARDS])
+        chat.shard = 'elsewhere'
+        chat.save()
+        chat.refresh_from_db()
+        self.assertNotEqual(chat.shard, 'elsewhere')
+
+    def test_ids_are_unique_over_shards(self):
+        messages = self.populate()
+        ids = [message.pk for message in messages]
+        self.assertEqual(ids, sorted(set(ids)))
+
+    def test_chat_reads_use_one_shard(self):
+        self.populate()
+        chat = self.chats['shard_a']
+        with CaptureQueriesContext(connections['shard_b']) as other, CaptureQueriesContext(connections['default']) as default:
+            self.assertEqual(chat.messages.count(), 3)
+            self.assertEqual(len(Message.objects.filter(chat_id=chat.pk, content__endswith='1')), 1)
+        self.assertEqual((len(other), len(default)), (0, 0))
+
+    def test_staff_list_merges_shards_in_order(self):
+        messages = self.populate()
+        client = self.client_for(self.staff)
+        url = reverse('message-list') + '?page_size=4'
+        seen = []
+        while url:
+            response = client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 4)
+            seen += [message['id'] for message in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(seen, [message.pk for message in messages])
+
+        response = client.get(reverse('message-list'), {'ordering': '-created_at', 'page_size': 100})
+        self.assertEqual(len(response.data['results']), len(messages))
+
+    def test_list_by_chat_and_user(self):
+        self.populate()
+        self.post(self.other_chat, 'Not yours')
+        client = self.client_for(self.user)
+        chat = self.chats['shard_b']
+        with CaptureQueriesContext(connections['shard_a']) as other:
+            response = client.get(reverse('message-list'), {'chat': chat.pk})
+        self.assertEqual(len(other), 0)
+        self.assertEqual([message['chat'] for message in response.data['results']], [chat.pk] * 3)
+
+        response = client.get(reverse('message-list'), {'page_size': 100})
+        self.assertEqual(len(response.data['results']), 9)
+        self.assertNotIn('Not yours', [message['content'] for message in response.data['results']])
+
+    def test_conditional_list(self):
+        self.populate()
+        client = self.client_for(self.staff)
+        response = client.get(reverse('message-list'))
+        etag = response['ETag']
+        self.assertEqual(client.get(reverse('message-list'), HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        message = Message.objects.filter(chat_id=self.chats['shard_b'].pk).first()
+        message.content = 'Edited'
+        message.save()
+        self.assertEqual(client.get(reverse('message-list'), HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+    def test_retrieve_update_delete(self):
+        self.populate()
+        chat = self.chats['shard_b']
+        last = chat.messages.latest('id')
+        client = self.client_for(self.user)
+        url = reverse('message-action', args=[last.pk])
+        self.assertEqual(client.get(url).data['content'], 'shard_b message 2')
+        self.assertEqual(client.patch(url, {'content': 'Edited'}).status_code, status.HTTP_200_OK)
+        self.assertEqual(Message.objects.using('shard_b').get(pk=last.pk).content, 'Edited')
+
+        self.assertEqual(client.delete(url).status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Message.objects.filter(pk=last.pk).exists())
+        self.assertTrue(Tombstone.objects.filter(kind='message', object_id=last.pk).exists())
+        chat.refresh_from_db()
+        previous = chat.messages.latest('id')
+        self.assertEqual((chat.message_count, chat.last_message_id), (2, previous.pk))
+        self.assertEqual(chat.last_message_at, previous.created_at)
+
+    def test_bulk_create(self):
+        items = [{'user': self.user.pk, 'chat': chat.pk, 'content': f'Bulk {alias}'} for alias, chat in self.chats.items()]
+        response = self.client_for(self.user).post(reverse('message-bulk-create'), items, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        ids = [result['message']['id'] for result in response.data]
+        self.assertEqual(len(set(ids)), 3)
+        for alias, chat in self.chats.items():
+            self.assertEqual(Message.objects.using(alias).get().content, f'Bulk {alias}')
+            chat.refresh_from_db()
+            self.assertEqual(chat.message_count, 1)
+
+    def test_chat_list_preview_and_counts(self):
+        self.populate()
+        response = self.client_for(self.user).get(reverse('chat-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for chat in response.data['results']:
+            alias = Chat.objects.get(pk=chat['id']).shard
+            self.assertEqual(chat['message_count'], 3)
+            self.assertEqual([message['content'] for message in chat['latest_messages']],
+                             [f'{alias} message {i}' for i in (2, 1, 0)])
+
+        response = self.client_for(self.user).get(reverse('user-me'))
+        self.assertEqual(response.data['message_count'], 9)
+
+    def test_search_and_sync(self):
+        self.populate()
+        client = self.client_for(self.user)
+        response = client.get(reverse('message-search'), {'q': 'message'})
+        self.assertEqual(len(response.data['results']), 5)
+        response = client.get(reverse('message-search'), {'q': 'shard_a'})
+        self.assertEqual({message['chat'] for message in response.data['results']}, {self.chats['shard_a'].pk})
+
+        response = client.get(reverse('sync'), {'page_size': 1000})
+        self.assertEqual(len(response.data['messages']), 9)
+
+    def test_archive_on_shard(self):
+        self.populate()
+        chat = self.chats['shard_a']
+        response = self.client_for(self.staff).patch(reverse('chat-action', args=[chat.pk]), {'archived': True})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(ArchivedMessage.objects.using('shard_a').count(), 3)
+        self.assertFalse(chat.messages.exists())
+        chat.refresh_from_db()
+        self.assertEqual((chat.message_count, chat.last_message_id), (0, None))
+
+    def test_recount(self):
+        self.populate()
+        Chat.objects.update(message_count=0, last_message_id=None)
+        self.assertEqual(refresh_chat_counters(Chat.objects.all(), batch_size=2), 3)
+        for chat in self.chats.values():
+            chat.refresh_from_db()
+            self.assertEqual((chat.message_count, chat.last_message_id), (3, chat.messages.latest('id').pk))
+        self.assertEqual(refresh_chat_counters(Chat.objects.all()), 0)
+
+    def test_delete_chat_and_user(self):
+        self.populate()
+        self.post(self.chats['shard_b'], 'By staff', user=self.staff)
+        self.chats['shard_a'].delete()
+        self.assertFalse(Message.objects.using('shard_a').exists())
+        self.assertFalse(Tombstone.objects.filter(kind='message').exists())
+
+        self.staff.delete()
+        self.assertFalse(Message.objects.filter(content='By staff').exists())
+        self.user.delete()
+        self.assertFalse(Message.objects.exists())
+
+    @override_settings(SHARD_DIRECTORY_TIMEOUT=0)
+    def test_move_chat(self):
+        self.populate()
+        chat = self.chats['shard_a']
+        self.client_for(self.staff).patch(reverse('chat-action', args=[self.chats['default'].pk]), {'archived': True})
+        out = StringIO()
+        call_command('rebalance_shards', chat.pk, self.chats['default'].pk, '--to', 'shard_b', '--batch-size', '2', stdout=out)
+        self.assertIn('Moved 2 chats with 6 messages.', out.getvalue())
+        self.assertFalse(Message.objects.using('shard_a').exists())
+        self.assertFalse(ArchivedMessage.objects.using('default').exists())
+        self.assertEqual(ArchivedMessage.objects.using('shard_b').count(), 3)
+        chat.refresh_from_db()
+        self.assertEqual(chat.shard, 'shard_b')
+        self.assertEqual(chat.messages.count(), 3)
+
+        response = self.client_for(self.user).get(reverse('message-search'), {'q': 'shard_a'})
+        self.assertEqual(len(response.data['results']), 3)
+        self.post(chat, 'After the move')
+        self.assertEqual(Message.objects.using('shard_b').filter(chat_id=chat.pk).count(), 4)
+        self.assertEqual(move_chat(chat.pk, 'shard_b'), 0)
+
+    @override_settings(SHARD_DIRECTORY_TIMEOUT=0)
+    def test_rebalance(self):
+        for i in range(4):
+            self.post(self.chats['shard_b'], f'Message {i}')
+        self.post(self.other_chat, 'Message')
+        out = StringIO()
+        call_command('rebalance_shards', '--dry-run', stdout=out)
+        self.assertIn('would move', out.getvalue())
+        self.assertTrue(Message.objects.using('shard_b').exists())
+        call_command('rebalance_shards', stdout=out)
+        self.assertEqual(Message.objects.using('shard_b').count(), 4)
+        self.assertEqual(Message.objects.count(), 5)
+
+    def test_writes_refused_while_moving(self):
+        message, = [message for message in self.populate() if message.chat_id == self.chats['shard_a'].pk][:1]
+        chat = self.chats['shard_a']
+        Chat.objects.filter(pk=chat.pk).update(moving_to='shard_b')
+        client = self.client_for(self.user)
+        response = client.post(reverse('message-create'), {'user': self.user.pk, 'chat': chat.pk, 'content': 'Moving'})
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        response = client.post(reverse('message-bulk-create'), [{'chat': chat.pk, 'content': 'Moving'}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        url = reverse('message-action', args=[message.pk])
+        self.assertEqual(client.patch(url, {'content': 'Moving'}).status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(client.delete(url).status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertFalse(Message.objects.filter(content='Moving').exists())
+        self.assertTrue(Message.objects.filter(pk=message.pk).exists())
+
+        Chat.objects.filter(pk=chat.pk).update(moving_to='')
+        self.assertEqual(client.patch(url, {'content': 'Moved'}).status_code, status.HTTP_200_OK)
+
+    def test_writes_after_move_with_stale_directory(self):
+        self.populate()
+        chat = self.chats['shard_a']
+        message = Message.objects.filter(chat_id=chat.pk).earliest('id')
+        self.assertEqual(move_chat(chat.pk, 'shard_b'), 3)
+        # The directory of a process that has not seen the move yet, the old rows are still there.
+        cache.set(directory_key(chat.pk), 'shard_a')
+        self.assertEqual(Message.objects.using('shard_a').filter(chat_id=chat.pk).count(), 3)
+
+        self.post(chat, 'After the move')
+        response = self.client_for(self.user).patch(reverse('message-action', args=[message.pk]), {'content': 'Edited'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        moved = Message.objects.using('shard_b').filter(chat_id=chat.pk)
+        self.assertEqual(moved.count(), 4)
+        self.assertEqual(moved.get(pk=message.pk).content, 'Edited')
+        self.assertEqual(Message.objects.using('shard_a').filter(chat_id=chat.pk).count(), 3)
+
+        self.assertEqual(purge_moved_chats(), 3)
+        self.assertFalse(Message.objects.using('shard_a').exists())
+        chat.refresh_from_db()
+        self.assertEqual((chat.shard, chat.moving_to, chat.moved_from, chat.message_count), ('shard_b', '', '', 4))
+
+    @override_settings(SHARD_DIRECTORY_TIMEOUT=0)
+    def test_interrupted_moves_resume(self):
+        self.populate()
+        copying, switched = self.chats['shard_a'], self.chats['default']
+        # Interrupted while copying to shard_b, and after switching to shard_b before the purge.
+        Chat.objects.filter(pk=copying.pk).update(moving_to='shard_b')
+        copy_rows(Message, copying.pk, 'shard_a', 'shard_b')
+        copy_rows(Message, switched.pk, 'default', 'shard_b')
+        Chat.objects.filter(pk=switched.pk).update(shard='shard_b', moved_from='default')
+
+        out = StringIO()
+        call_command('rebalance_shards', '--tolerance', '100', stdout=out)
+        self.assertIn('Moved 1 chats with 3 messages.', out.getvalue())
+        for chat in (copying, switched):
+            chat.refresh_from_db()
+            self.assertEqual((chat.shard, chat.moving_to, chat.moved_from), ('shard_b', '', ''))
+            self.assertEqual(Message.objects.using('shard_b').filter(chat_id=chat.pk).count(), 3)
+        self.assertFalse(Message.objects.using('shard_a').exists())
+        self.assertFalse(Message.objects.using('default').exists())
+
+    def test_plan_rebalance(self):
+        chats = [(1, 'a', 10), (2, 'a', 6), (3, 'a', 3), (4, 'b', 1), (5, 'b', 0)]
+        self.assertEqual(plan_rebalance(chats, ['a', 'b', 'c']), [(2, 'a', 'c'), (3, 'a', 'b')])
+        self.assertEqual(plan_rebalance([(1, 'a', 10)], ['a', 'b']), [])
+        self.assertEqual(plan_rebalance([(1, 'a', 5), (2, 'b', 5)], ['a', 'b']), [])
@@ -0,0 +1,76 @@
+import asyncio
+from channels.db import database_sync_to_async
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework_simplejwt.tokens import AccessToken
+from api.models import User, Chat, Message
+
+
+class ChatStreamTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='test')
+        self.user2 = User.objects.create_user(username='testuser2', password='test')
+        self.chat = Chat.objects.create(user=self.user)
+        self.message = Message.objects.create(user=self.user, chat=self.chat, content="Hello!")
+        self.url = reverse('chat-stream', args=[self.chat.pk])
+
+    def auth(self, user):
+        return {'Authorization': f'Bearer {AccessToken.for_user(user)}'}
+
+    @database_sync_to_async
+    def create_message(self, content):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Message.objects.create(user=self.user, chat=self.chat, content=content)
+
+    async def test_not_authenticated(self):
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    async def test_invalid_token(self):
+        headers = {'Authorization': 'Bearer nonsense'}
+        expected = await self.async_client.get(reverse('chat-list'), headers=headers)
+        response = await self.async_client.get(self.url, headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response.json(), expected.json())
+        self.assertEqual(response['WWW-Authenticate'], expected['WWW-Authenticate'])
+
+    async def test_non_owner(self):
+        response = await self.async_client.get(self.url, headers=self.auth(self.user2))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    async def test_returns_newer_messages_immediately(self):
+        response = await self.async_client.get(self.url, {'since': 0}, headers=self.auth(self.user))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual([m['content'] for m in data['results']], ["Hello!"])
+        self.assertEqual(data['since'], self.message.pk)
+
+    async def test_timeout_without_new_messages(self):
+        response = await self.async_client.get(
+            self.url, {'since': self.message.pk, 'timeout': 0.1}, headers=self.auth(self.user)
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {'since': self.message.pk, 'results': []})
+
+    async def test_wakes_up_on_new_message(self):
+        async def send_later():
+            await asyncio.sleep(0.2)
+            return await self.create_message("New message")
+
+        response, message = await asyncio.gather(
+            self.async_client.get(self.url, {'since': self.message.pk, 'timeout': 5}, headers=self.auth(self.user)),
+            send_later(),
+        )
+        data = response.json()
+        self.assertEqual([m['content'] for m in data['results']], ["New message"])
+        self.assertEqual(data['since'], message.pk)
+
+    async def test_event_stream(self):
+        response = await self.async_client.get(
+            self.url, {'since': 0, 'timeout': 0.1}, headers={'Accept': 'text/event-stream', **self.auth(self.user)}
+        )
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertIn(f'id: {self.message.pk}\nevent: message\n', body)
+        self.assertIn('"content": "Hello!"', body)
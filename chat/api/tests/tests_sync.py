@@ -0,0 +1,132 @@
+from datetime import timedelta
+from io import StringIO
+from django.core.management import call_command
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+from api.models import User, Chat, Message, Tombstone
+
+
+# Without a commit window every sync starts at its position, so each change is delivered once.
+@override_settings(SYNC_COMMIT_WINDOW=timedelta(0))
+class SyncAPIViewTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='test')
+        self.user2 = User.objects.create_user(username='testuser2', password='test')
+        self.admin = User.objects.create_superuser(username='admin', password='test')
+        self.chat = Chat.objects.create(user=self.user)
+        self.messages = [Message.objects.create(user=self.user, chat=self.chat, content=f"Hello {i}") for i in range(3)]
+        self.other_chat = Chat.objects.create(user=self.user2)
+        Message.objects.create(user=self.user2, chat=self.other_chat, content="Not yours")
+        self.url = reverse('sync')
+        self.client.login(username='testuser', password='test')
+
+    def sync(self, since=None, **params):
+        if since is not None:
+            params['since'] = since
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def sync_all(self, since=None, **params):
+        chats, messages, deleted = [], [], {'chats': [], 'messages': []}
+        while True:
+            data = self.sync(since, **params)
+            chats += [chat['id'] for chat in data['chats']]
+            messages += [message['id'] for message in data['messages']]
+            for kind in deleted:
+                deleted[kind] += data['deleted'][kind]
+            since = data['next']
+            if not data['more']:
+                return chats, messages, deleted, since
+
+    def test_not_authenticated(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_initial_sync(self):
+        data = self.sync()
+        self.assertEqual([chat['id'] for chat in data['chats']], [self.chat.id])
+        self.assertEqual([message['id'] for message in data['messages']], [m.id for m in self.messages])
+        self.assertEqual(data['deleted'], {'chats': [], 'messages': []})
+        self.assertFalse(data['more'])
+
+        self.assertEqual(self.sync(data['next'])['messages'], [])
+
+    def test_paginated(self):
+        expected = self.sync_all()[:2]
+        self.assertEqual(self.sync_all(page_size=1)[:2], expected)
+        self.assertEqual(self.sync(page_size=2)['more'], True)
+
+    def test_changes_since(self):
+        since = self.sync_all()[3]
+        message = Message.objects.create(user=self.user, chat=self.chat, content="New")
+        self.messages[0].content = "Edited"
+        self.messages[0].save()
+        self.client.delete(reverse('message-action', args=[self.messages[1].id]))
+        Message.objects.create(user=self.user2, chat=self.other_chat, content="Still not yours")
+
+        chats, messages, deleted, since = self.sync_all(since, page_size=1)
+        self.assertEqual(chats, [])
+        self.assertEqual(messages, [message.id, self.messages[0].id])
+        self.assertEqual(deleted, {'chats': [], 'messages': [self.messages[1].id]})
+
+        chat_id = self.chat.id
+        self.chat.delete()
+        chats, messages, deleted, since = self.sync_all(since)
+        self.assertEqual(deleted, {'chats': [chat_id], 'messages': []})
+
+        self.assertEqual(self.sync_all(since)[:3], ([], [], {'chats': [], 'messages': []}))
+
+    def test_late_commits(self):
+        since = self.sync_all()[3]
+        # Written before the last synced message but committed after the sync.
+        late = Message.objects.create(user=self.user, chat=self.chat, content="Late")
+        Message.objects.filter(pk=late.pk).update(updated_at=self.messages[-1].updated_at - timedelta(seconds=1))
+        self.assertEqual(self.sync_all(since)[1], [])
+
+        with override_settings(SYNC_COMMIT_WINDOW=timedelta(seconds=10)):
+            chats, messages, deleted, since = self.sync_all(since, page_size=1)
+            # The window is read again, the client drops the rows it already has by id.
+            self.assertEqual(chats, [self.chat.id])
+            self.assertEqual(set(messages), {late.id, *[m.id for m in self.messages]})
+
+    @override_settings(SYNC_COMMIT_WINDOW=timedelta(seconds=10))
+    def test_token_size(self):
+        since = self.sync_all()[3]
+        Message.objects.bulk_create([Message(user=self.user, chat=self.chat, content=f"Burst {i}") for i in range(1000)])
+        messages, pages, more = set(), 0, True
+        while more:
+            data = self.sync(since, page_size=100)
+            self.assertLess(len(data['next']), 400)
+            messages.update(message['id'] for message in data['messages'])
+            since, more = data['next'], data['more']
+            pages += 1
+        self.assertEqual(len(messages), 1003)
+        self.assertLessEqual(pages, 12)
+
+    def test_staff_sees_everything(self):
+        self.client.login(username='admin', password='test')
+        since = self.sync_all()[3]
+        chat_id = self.other_chat.id
+        self.other_chat.delete()
+        self.assertEqual(self.sync_all(since)[2], {'chats': [chat_id], 'messages': []})
+
+    def test_invalid_and_expired_tokens(self):
+        response = self.client.get(self.url, {'since': 'nonsense'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        since = self.sync()['next']
+        with override_settings(SYNC_TOMBSTONE_RETENTION=timedelta(0)):
+            response = self.client.get(self.url, {'since': since})
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+
+    def test_purge_tombstones(self):
+        old, recent = [message.id for message in self.messages[:2]]
+        self.messages[0].delete()
+        self.messages[1].delete()
+        Tombstone.objects.filter(object_id=old).update(deleted_at=timezone.now() - timedelta(days=31))
+        call_command('purge_tombstones', stdout=StringIO())
+        self.assertEqual(list(Tombstone.objects.values_list('object_id', flat=True)), [recent])
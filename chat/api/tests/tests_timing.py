@@ -0,0 +1,48 @@
+import re
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APITestCase
+from api.models import User, Chat, Message
+
+
+class ServerTimingMiddlewareTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='test')
+        self.chat = Chat.objects.create(user=self.user)
+        Message.objects.create(user=self.user, chat=self.chat, content="Hello!")
+        self.client.login(username='testuser', password='test')
+
+    def get_metrics(self, response):
+        return {
+            name: (float(duration), desc)
+            for name, duration, desc in re.findall(r'(\w+);dur=([\d.]+)(?:;desc="([^"]*)")?', response['Server-Timing'])
+        }
+
+    @override_settings(REQUEST_TIMING=False)
+    def test_disabled(self):
+        response = self.client.get(reverse('message-list'))
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(REQUEST_TIMING=True, SLOW_REQUEST_THRESHOLD=10000)
+    def test_server_timing(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('message-list'))
+        metrics = self.get_metrics(response)
+        self.assertEqual(set(metrics), {'db', 'auth', 'serialize', 'render', 'view'})
+        self.assertEqual(metrics['db'][1], f'{len(queries)} queries')
+        self.assertGreater(metrics['serialize'][0] + metrics['render'][0], 0)
+        self.assertLessEqual(metrics['db'][0], metrics['view'][0])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('chat-stream', args=[self.chat.pk]))
+        self.assertEqual(self.get_metrics(response)['db'][1], f'{len(queries)} queries')
+
+    @override_settings(REQUEST_TIMING=True, SLOW_REQUEST_THRESHOLD=0, SLOW_REQUEST_STATEMENTS=1)
+    def test_slow_request_log(self):
+        with self.assertLogs('api.middleware', 'WARNING') as logs:
+            self.client.get(reverse('message-list'))
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('Slow request GET /api/messages/ 200', logs.output[0])
+        self.assertEqual(logs.output[0].count('SELECT'), 1)
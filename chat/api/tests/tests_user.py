@@ -1,7 +1,10 @@
 from rest_framework.test import APITestCase
 from rest_framework import status
+from django.core.cache import cache
 from django.urls import reverse
-from api.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from api.models import User, Chat, Message
 
 class UserListAPIViewTests(APITestCase):
     def setUp(self):
@@ -24,8 +27,25 @@ class UserListAPIViewTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['count'], 2)
 
+    def test_queries_do_not_grow_with_users(self):
+        self.client.login(username='admin', password='test')
+        with CaptureQueriesContext(connection) as few_users:
+            self.client.get(self.url)
+        for i in range(3):
+            user = User.objects.create_user(username=f'user{i}', password='test')
+            chat = Chat.objects.create(user=user)
+            Message.objects.create(user=user, chat=chat, content="Hello!")
+        with CaptureQueriesContext(connection) as many_users:
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertEqual(len(few_users), len(many_users))
+        with CaptureQueriesContext(connection) as expanded:
+            self.client.get(self.url, {'expand': 'chats,messages'})
+        self.assertEqual(len(expanded), len(many_users) + 2)
+
 class UserRetrieveAPIViewTests(APITestCase):
     def setUp(self):
+        cache.clear()
         self.user = User.objects.create_user(username='testuser', password='test')
         self.admin = User.objects.create_superuser(username='admin', password='test')
         self.url = reverse('user-me')
@@ -46,6 +66,27 @@ class UserRetrieveAPIViewTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['username'], 'admin')
 
+    def test_counts_and_links(self):
+        chat = Chat.objects.create(user=self.user)
+        Message.objects.create(user=self.user, chat=chat, content="Hello!")
+        Message.objects.create(user=self.user, chat=chat, content="Hi!")
+        self.client.login(username='testuser', password='test')
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['chat_count'], 1)
+        self.assertEqual(response.data['message_count'], 2)
+        self.assertNotIn('chats', response.data)
+        self.assertNotIn('messages', response.data)
+        response = self.client.get(response.data['messages_url'])
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_expand(self):
+        chat = Chat.objects.create(user=self.user)
+        message = Message.objects.create(user=self.user, chat=chat, content="Hello!")
+        self.client.login(username='testuser', password='test')
+        response = self.client.get(self.url, {'expand': 'chats,messages'})
+        self.assertEqual(response.data['chats'], [chat.pk])
+        self.assertEqual(response.data['messages'], [message.pk])
+
 class UserUpdateAPIViewTests(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='testuser', password='test')
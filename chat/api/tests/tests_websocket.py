@@ -0,0 +1,109 @@
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.test import TestCase, override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from api.models import User, Chat, Message
+from chat.asgi import application
+
+
+@override_settings(ARCHIVE_JOB_RUNNER='eager')
+class ChatConsumerTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='test')
+        self.user2 = User.objects.create_user(username='testuser2', password='test')
+        self.admin = User.objects.create_superuser(username='admin', password='test')
+        self.chat = Chat.objects.create(user=self.user)
+
+    def connect(self, user=None, chat=None):
+        path = f'/ws/chats/{(chat or self.chat).pk}/'
+        if user is not None:
+            path += f'?token={AccessToken.for_user(user)}'
+        return WebsocketCommunicator(application, path)
+
+    @database_sync_to_async
+    def run_committed(self, func):
+        with self.captureOnCommitCallbacks(execute=True):
+            return func()
+
+    async def test_not_authenticated(self):
+        connected, code = await self.connect().connect()
+        self.assertFalse(connected)
+        self.assertEqual(code, 4401)
+
+    async def test_invalid_token(self):
+        communicator = WebsocketCommunicator(application, f'/ws/chats/{self.chat.pk}/?token=invalid')
+        connected, code = await communicator.connect()
+        self.assertFalse(connected)
+        self.assertEqual(code, 4401)
+
+    async def test_non_owner(self):
+        connected, code = await self.connect(self.user2).connect()
+        self.assertFalse(connected)
+        self.assertEqual(code, 4403)
+
+    async def test_message_events(self):
+        communicator = self.connect(self.user)
+        admin_communicator = self.connect(self.admin)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        connected, _ = await admin_communicator.connect()
+        self.assertTrue(connected)
+
+        message = await self.run_committed(
+            lambda: Message.objects.create(user=self.user, chat=self.chat, content="Hello!")
+        )
+        for receiver in (communicator, admin_communicator):
+            event = await receiver.receive_json_from()
+            self.assertEqual(event['type'], 'message.created')
+            self.assertEqual(event['data']['id'], message.pk)
+            self.assertEqual(event['data']['content'], "Hello!")
+
+        def edit():
+            message.content = "Edited"
+            message.save()
+        await self.run_committed(edit)
+        event = await communicator.receive_json_from()
+        self.assertEqual(event['type'], 'message.updated')
+        self.assertEqual(event['data']['content'], "Edited")
+
+        def archive():
+            self.chat.archived = True
+            self.chat.save()
+        await self.run_committed(archive)
+        event = await communicator.receive_json_from()
+        self.assertEqual(event, {'type': 'chat.archived', 'data': {'chat': self.chat.pk}})
+
+        await communicator.disconnect()
+        await admin_communicator.disconnect()
+
+    async def test_archive_message_events(self):
+        communicator = self.connect(self.user)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        message = await self.run_committed(
+            lambda: Message.objects.create(user=self.user, chat=self.chat, content="Hello!")
+        )
+        self.assertEqual((await communicator.receive_json_from())['type'], 'message.created')
+
+        def update(**fields):
+            for name, value in fields.items():
+                setattr(message, name, value)
+            message.save()
+        for fields, expected in [
+            ({'archived': True}, 'message.archived'),
+            ({'content': "Edited while archived"}, 'message.updated'),
+            ({'archived': False}, 'message.updated'),
+        ]:
+            await self.run_committed(lambda: update(**fields))
+            self.assertEqual((await communicator.receive_json_from())['type'], expected, fields)
+        await communicator.disconnect()
+
+    async def test_other_chat_events_are_not_delivered(self):
+        other_chat = await database_sync_to_async(Chat.objects.create)(user=self.user2)
+        communicator = self.connect(self.user)
+        await communicator.connect()
+        await self.run_committed(
+            lambda: Message.objects.create(user=self.user2, chat=other_chat, content="Hello!")
+        )
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
@@ -0,0 +1,95 @@
+import time
+from contextvars import ContextVar
+from functools import wraps
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.serializers import BaseSerializer
+
+_current = ContextVar('request_timings', default=None)
+_installed = False
+
+
+class RequestTimings:
+    """
+    Time spent by one request in SQL, authentication, serialization and rendering.
+    """
+    def __init__(self):
+        self.queries = []
+        self.durations = {'auth': 0.0, 'serialize': 0.0, 'render': 0.0}
+        self.active = set()
+
+    @property
+    def query_count(self):
+        return len(self.queries)
+
+    @property
+    def sql_time(self):
+        return sum(duration for duration, sql in self.queries)
+
+    def slowest(self, count):
+        return sorted(self.queries, key=lambda query: query[0], reverse=True)[:count]
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _current.reset(self._token)
+
+
+def record_query(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.queries.append((time.perf_counter() - start, sql))
+
+
+def timed(name, function):
+    """
+    Wrap function to add its duration to the current request's timings under name.
+    Nested calls, such as a serializer's .data inside another one, are counted once.
+    """
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        timings = _current.get()
+        if timings is None or name in timings.active:
+            return function(*args, **kwargs)
+        timings.active.add(name)
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timings.durations[name] += time.perf_counter() - start
+            timings.active.discard(name)
+    return wrapper
+
+
+def instrument_connection(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def instrument_connections():
+    for connection in connections.all(initialized_only=True):
+        instrument_connection(connection)
+
+
+def install():
+    """
+    Hook the timers into database connections, DRF authentication, serializers and
+    rendering. Only called when REQUEST_TIMING is enabled, so nothing is wrapped otherwise.
+    """
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    connection_created.connect(lambda sender, connection, **kwargs: instrument_connection(connection), weak=False)
+    Request._authenticate = timed('auth', Request._authenticate)
+    BaseSerializer.data = property(timed('serialize', BaseSerializer.data.fget))
+    Response.rendered_content = property(timed('render', Response.rendered_content.fget))
@@ -1,5 +1,6 @@
 from django.urls import path
 from api.views import *
+from api.async_views import chat_stream
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 urlpatterns = [
@@ -13,9 +14,20 @@ urlpatterns = [
     
     path('chats/', ChatListAPIView.as_view(), name='chat-list'),
     path('chats/create/', ChatCreateAPIView.as_view(), name='chat-create'),
+    path('chats/archive/', ChatBulkArchiveAPIView.as_view(), name='chat-bulk-archive'),
     path('chats/<int:pk>/', ChatRetrieveUpdateDestroyAPIView.as_view(), name='chat-action'),
+    path('chats/<int:pk>/stream/', chat_stream, name='chat-stream'),
+    path('chats/<int:pk>/export/', ChatExportAPIView.as_view(), name='chat-export'),
     
+    path('archive-jobs/', ArchiveJobListAPIView.as_view(), name='archive-job-list'),
+    path('archive-jobs/<int:pk>/', ArchiveJobRetrieveAPIView.as_view(), name='archive-job-action'),
+    path('sync/', SyncAPIView.as_view(), name='sync'),
+    path('cache/stats/', CacheStatsAPIView.as_view(), name='cache-stats'),
+    path('group-commit/stats/', GroupCommitStatsAPIView.as_view(), name='group-commit-stats'),
+
     path('messages/', MessageListAPIView.as_view(), name='message-list'),
     path('messages/create/', MessageCreateAPIView.as_view(), name='message-create'),
+    path('messages/search/', MessageSearchAPIView.as_view(), name='message-search'),
+    path('messages/bulk/', MessageBulkCreateAPIView.as_view(), name='message-bulk-create'),
     path('messages/<int:pk>/', MessageRetrieveUpdateDestroyAPIView.as_view(), name='message-action'),
 ]
\ No newline at end of file
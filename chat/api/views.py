@@ -1,15 +1,41 @@
 from django.shortcuts import render
-from api.models import User, Chat, Message
-from api.serializers import UserSerializer, ChatSerializer, ChatCreateSerializer, MessageSerializer, MessageCreateSerializer
-from rest_framework import filters, generics, viewsets
+from api.models import User, Chat, Message, ArchivedMessage, ArchiveJob
+from api.serializers import (
+    UserSerializer, ChatSerializer, ChatCreateSerializer, MessageSerializer, MessageCreateSerializer,
+    MessageBulkItemSerializer, MessageSearchSerializer, ArchiveJobSerializer, ChatBulkArchiveSerializer,
+    ChatSyncSerializer,
+)
+from api.jobs import start_archive_jobs
+from api.conditional import ConditionalListMixin, ConditionalRetrieveMixin
+from api.cache import CachedResponseMixin, get_stats, invalidate_chats, invalidate_users
+from api.realtime import publish
+from api.representations import (
+    CHAT_VALUES_FIELDS, MESSAGE_FIELDS, ValuesListMixin, represent_chats, represent_messages,
+)
+from api.pagination import ChatPagination, KeysetCursorPagination, SearchPagination
+from api.search import Highlight, search_query
+from api.sync import get_changes
+from api.history import export_response
+from api.counters import messages_added
+from api.db import atomic_with_retry
+from api.groupcommit import message_queue, save_message
+from api.sharding import is_sharded, lock_chats
+from api.filters import ChatFilter, MessageFilter, ArchivedMessageFilter, ArchiveJobFilter
+from rest_framework import filters, generics, status, viewsets
 from rest_framework.permissions import IsAdminUser, IsAuthenticated, BasePermission
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from django.shortcuts import get_object_or_404
+from django.conf import settings
+from django.utils import timezone
+from django.db.models import Count, F, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
+from django_filters.rest_framework import DjangoFilterBackend
 
 class IsOwnerOrAdmin(BasePermission):
     def has_object_permission(self, request, view, obj):
-        if obj.user == request.user:
+        if obj.user_id == request.user.pk:
             return True
         if request.user.is_superuser or request.user.is_staff:
             return True
@@ -17,20 +43,64 @@ class IsOwnerOrAdmin(BasePermission):
     
 class IsOwner(BasePermission):
     def has_object_permission(self, request, view, obj):
-        return obj.user == request.user
+        return obj.user_id == request.user.pk
 
-class UserListAPIView(generics.ListAPIView):
+def count_subquery(model, field):
+    """
+    Count rows of model pointing at the outer row through field, as a correlated subquery.
+    """
+    counts = model.objects.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(count=Count('pk'))
+    return Coalesce(Subquery(counts.values('count')), 0)
+
+class UserQuerysetMixin:
+    """
+    Annotates the relation counts of UserSerializer and prefetches the relations
+    requested through `?expand=`, so a page of users costs a constant number of queries.
+    Sharded messages cannot be counted in a subquery, UserSerializer counts them per user.
+    """
+    def get_queryset(self):
+        qs = super().get_queryset().annotate(chat_count=count_subquery(Chat, 'user'))
+        if not is_sharded():
+            qs = qs.annotate(message_count=count_subquery(Message, 'user'))
+        expand = self.get_serializer_class().get_expand(self.request)
+        if 'chats' in expand:
+            qs = qs.prefetch_related(Prefetch('chats', queryset=Chat.objects.only('id', 'user')))
+        if 'messages' in expand:
+            qs = qs.prefetch_related(Prefetch('messages', queryset=Message.objects.only('id', 'user')))
+        return qs
+
+class ChatQuerysetMixin:
+    """
+    Prefetches the latest messages of every chat for ChatSerializer with a single
+    windowed query, instead of one query per chat. The message count is a column.
+    """
+    def get_queryset(self):
+        latest = (
+            Message.objects.filter(archived=False).only('id', 'chat', 'user', 'content', 'created_at')
+            .order_by('-created_at', '-id')
+        )
+        return super().get_queryset().prefetch_related(
+            Prefetch('messages', queryset=latest[:settings.CHAT_PREVIEW_SIZE], to_attr='latest_messages'),
+        )
+
+    def get_related_validator_querysets(self, queryset):
+        # The message count and preview change with the messages of the chats. Sharded
+        # messages cannot be filtered with a subquery on the chats.
+        chats = list(queryset.values_list('pk', flat=True)) if is_sharded() else queryset.values('pk')
+        return [Message.objects.filter(chat_id__in=chats)]
+
+class UserListAPIView(UserQuerysetMixin, generics.ListAPIView):
     queryset = User.objects.all().order_by('pk')
     serializer_class = UserSerializer
     permission_classes = [IsAdminUser]
     
-class UserRetrieveAPIView(generics.RetrieveAPIView):
+class UserRetrieveAPIView(CachedResponseMixin, UserQuerysetMixin, generics.RetrieveAPIView):
     queryset = User.objects.all().order_by('pk')
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated]
 
-    def get(self, request, *args, **kwargs):
-        return Response(self.get_serializer(request.user).data)
+    def retrieve(self, request, *args, **kwargs):
+        return Response(self.get_serializer(self.get_queryset().get(pk=request.user.pk)).data)
 
 class UserCreateAPIView(generics.CreateAPIView):
     queryset = User.objects.all().order_by('pk')
@@ -39,28 +109,35 @@ class UserCreateAPIView(generics.CreateAPIView):
     def perform_create(self, serializer):
         serializer.save(is_staff=False, is_superuser=False)
 
-class UserRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
+class UserRetrieveUpdateDestroyAPIView(UserQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = User.objects.all().order_by('pk')
     serializer_class = UserSerializer
     permission_classes = [IsAdminUser]
 
-class ChatListAPIView(generics.ListAPIView):
+class ChatListAPIView(CachedResponseMixin, ChatQuerysetMixin, ConditionalListMixin, ValuesListMixin, generics.ListAPIView):
     queryset = Chat.objects.all().order_by('pk')
     serializer_class = ChatSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = ChatPagination
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = ChatFilter
+    values_fields = CHAT_VALUES_FIELDS
 
     def get_queryset(self):
         qs = super().get_queryset()
         if not self.request.user.is_staff:
-            qs = qs.filter(user=self.request.user)
+            qs = qs.filter(user_id=self.request.user.pk)
         return qs
 
+    def represent_rows(self, rows):
+        return represent_chats(rows)
+
 class ChatCreateAPIView(generics.CreateAPIView):
     queryset = Chat.objects.all().order_by('pk')
     serializer_class = ChatCreateSerializer
     permission_classes = [IsAuthenticated]
 
-class ChatRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
+class ChatRetrieveUpdateDestroyAPIView(ChatQuerysetMixin, ConditionalRetrieveMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Chat.objects.all().order_by('pk')
     serializer_class = ChatSerializer
     permission_classes = [IsAdminUser]
@@ -70,17 +147,162 @@ class ChatRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
             return [IsAuthenticated(), IsOwnerOrAdmin()]
         return [IsAdminUser()]
 
-class MessageListAPIView(generics.ListAPIView):
+class ChatExportAPIView(generics.GenericAPIView):
+    """
+    The chat with all its messages, live and archived, streamed as NDJSON, or as gzipped
+    NDJSON with `?compression=gzip`. Memory use does not grow with the chat, see api.history.
+    """
+    queryset = Chat.objects.all()
+    permission_classes = [IsAuthenticated, IsOwnerOrAdmin]
+
+    def perform_content_negotiation(self, request, force=False):
+        # The export is not rendered, errors are rendered as JSON whatever is accepted.
+        return super().perform_content_negotiation(request, force=True)
+
+    def get(self, request, *args, **kwargs):
+        chat = self.get_object()
+        compression = request.query_params.get('compression', '')
+        if compression not in ('', 'gzip'):
+            raise ValidationError({'compression': ["Only gzip is supported."]})
+        return export_response(
+            Chat.objects.filter(pk=chat.pk), f'chat-{chat.pk}', compress=compression == 'gzip', request=request,
+        )
+
+class ChatBulkArchiveAPIView(generics.GenericAPIView):
+    """
+    Archive or unarchive many chats at once. The chats are flipped in one UPDATE and
+    their messages are handled by one archive job per chat.
+    """
+    queryset = Chat.objects.all()
+    serializer_class = ChatBulkArchiveSerializer
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        archived = serializer.validated_data['archived']
+
+        def archive():
+            chats = Chat.objects.filter(pk__in=serializer.validated_data['chats']).exclude(archived=archived)
+            chat_ids = list(chats.values_list('pk', flat=True))
+            Chat.objects.filter(pk__in=chat_ids).update(archived=archived, updated_at=timezone.now())
+            jobs = ArchiveJob.objects.bulk_create([ArchiveJob(chat_id=chat_id, archived=archived) for chat_id in chat_ids])
+            invalidate_chats(chat_ids)
+            start_archive_jobs(jobs)
+            return jobs
+
+        jobs = atomic_with_retry(archive)
+        return Response(ArchiveJobSerializer(jobs, many=True).data, status=status.HTTP_202_ACCEPTED)
+
+class ArchiveJobListAPIView(generics.ListAPIView):
+    queryset = ArchiveJob.objects.all().order_by('pk')
+    serializer_class = ArchiveJobSerializer
+    permission_classes = [IsAdminUser]
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = ArchiveJobFilter
+
+class ArchiveJobRetrieveAPIView(generics.RetrieveAPIView):
+    queryset = ArchiveJob.objects.all().order_by('pk')
+    serializer_class = ArchiveJobSerializer
+    permission_classes = [IsAdminUser]
+
+class CacheStatsAPIView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(get_stats())
+
+class GroupCommitStatsAPIView(APIView):
+    """
+    Batch sizes and flush latencies of the message group commit in this process.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(message_queue.get_stats())
+
+class SyncAPIView(APIView):
+    """
+    Change feed of the caller's chats and messages: `?since=<next of the previous page>`
+    returns what was created, updated or deleted since, oldest first. While `more` is
+    true the next page follows immediately.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        changes = get_changes(request.user, request.query_params.get('since'), self.get_page_size(request))
+        return Response({
+            'chats': ChatSyncSerializer(changes['chats'], many=True).data,
+            'messages': MessageSerializer(changes['messages'], many=True).data,
+            'deleted': changes['deleted'],
+            'next': changes['next'],
+            'more': changes['more'],
+        })
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params['page_size'])
+            if page_size > 0:
+                return min(page_size, settings.SYNC_MAX_PAGE_SIZE)
+        except (KeyError, ValueError):
+            pass
+        return settings.SYNC_PAGE_SIZE
+
+class MessageListAPIView(ConditionalListMixin, ValuesListMixin, generics.ListAPIView):
+    """
+    Messages of live chats, or with `?archive=true` the messages moved to the archive
+    along with their chat.
+    """
     queryset = Message.objects.all().order_by('pk')
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetCursorPagination
+    filter_backends = [DjangoFilterBackend]
+    archive_query_param = 'archive'
+    values_fields = MESSAGE_FIELDS
+
+    @property
+    def filterset_class(self):
+        return ArchivedMessageFilter if self.reads_archive() else MessageFilter
+
+    def reads_archive(self):
+        return self.request.query_params.get(self.archive_query_param, '').lower() in ('1', 'true', 'yes')
 
     def get_queryset(self):
-        qs = super().get_queryset()
+        if self.reads_archive():
+            qs = ArchivedMessage.objects.all().order_by('pk')
+        else:
+            qs = super().get_queryset()
         if not self.request.user.is_staff:
-            qs = qs.filter(user=self.request.user)
+            qs = qs.filter(user_id=self.request.user.pk)
         return qs
 
+    def represent_rows(self, rows):
+        return represent_messages(rows)
+
+class MessageSearchAPIView(MessageListAPIView):
+    """
+    Full-text search over the messages visible in MessageListAPIView with `?q=`,
+    ranked by relevance and with the matches highlighted.
+    """
+    serializer_class = MessageSearchSerializer
+    pagination_class = SearchPagination
+    # The float ranks are rendered by JSONRenderer.
+    values_fields = ()
+
+    def reads_archive(self):
+        # Archived messages are not indexed.
+        return False
+
+    def get_queryset(self):
+        query = search_query(self.request.query_params.get('q', ''))
+        if not query:
+            raise ValidationError({'q': ["Enter the words to search for."]})
+        return super().get_queryset().filter(search_index__content__match=query).annotate(
+            rank=F('search_index__rank'),
+            highlight=Highlight(),
+        )
+
 class MessageCreateAPIView(generics.CreateAPIView):
     queryset = Chat.objects.all().order_by('pk')
     serializer_class = MessageCreateSerializer
@@ -90,11 +312,81 @@ class MessageCreateAPIView(generics.CreateAPIView):
         chat_id = self.request.data.get('chat')
         chat = get_object_or_404(Chat, id=chat_id)
 
-        if chat.user != self.request.user and not self.request.user.is_staff:
+        if chat.user_id != self.request.user.pk and not self.request.user.is_staff:
             raise PermissionDenied("You can only post messages in chats you created.")
-        serializer.save(user=self.request.user, chat=chat)
+        if settings.MESSAGE_GROUP_COMMIT:
+            message = save_message(Message(user_id=self.request.user.pk, chat=chat, content=serializer.validated_data['content']))
+            serializer.instance = message
+            publish(chat.pk, 'message.created', dict(MessageSerializer(message).data))
+            invalidate_users({message.user_id, chat.user_id})
+            return
+        # The chat's counters are updated by a signal, in the same transaction as the insert.
+        def create():
+            serializer.instance = None
+            with lock_chats([chat.pk]):
+                serializer.save(user_id=self.request.user.pk, chat=chat)
+
+        atomic_with_retry(create)
+    
+class MessageBulkCreateAPIView(generics.GenericAPIView):
+    """
+    Create up to MESSAGE_BULK_MAX_SIZE messages in one request.
+
+    The referenced chats are checked with a single query and all valid messages are
+    inserted with one bulk_create in one transaction. The response holds one result
+    per submitted item, in order.
+    """
+    queryset = Message.objects.all()
+    serializer_class = MessageBulkItemSerializer
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        items = request.data
+        if not isinstance(items, list):
+            raise ValidationError("Expected a list of messages.")
+        if len(items) > settings.MESSAGE_BULK_MAX_SIZE:
+            raise ValidationError(f"At most {settings.MESSAGE_BULK_MAX_SIZE} messages can be created at once.")
+
+        item_serializers = [self.get_serializer(data=item) for item in items]
+        chat_ids = {s.validated_data['chat'] for s in item_serializers if s.is_valid()}
+        chat_owners = dict(Chat.objects.filter(pk__in=chat_ids).values_list('pk', 'user_id'))
+
+        results = []
+        messages = []
+        for serializer in item_serializers:
+            if serializer.errors:
+                results.append({'status': status.HTTP_400_BAD_REQUEST, 'errors': serializer.errors})
+                continue
+            chat_id = serializer.validated_data['chat']
+            if chat_id not in chat_owners:
+                results.append({'status': status.HTTP_404_NOT_FOUND, 'errors': {'chat': ["Chat not found."]}})
+            elif chat_owners[chat_id] != request.user.pk and not request.user.is_staff:
+                results.append({'status': status.HTTP_403_FORBIDDEN, 'errors': {'chat': ["You can only post messages in chats you created."]}})
+            else:
+                message = Message(user_id=request.user.pk, chat_id=chat_id, content=serializer.validated_data['content'])
+                results.append({'status': status.HTTP_201_CREATED, 'message': message})
+                messages.append(message)
+
+        def create():
+            for message in messages:
+                message.pk = None
+            with lock_chats(message.chat_id for message in messages):
+                Message.objects.bulk_create(messages)
+                messages_added(messages)
+            for message in messages:
+                publish(message.chat_id, 'message.created', dict(MessageSerializer(message).data))
+            if messages:
+                invalidate_users({request.user.pk, *(chat_owners[message.chat_id] for message in messages)})
+
+        atomic_with_retry(create)
+
+        for result in results:
+            if 'message' in result:
+                result['message'] = MessageSerializer(result['message']).data
+        created = len(messages) == len(results)
+        return Response(results, status=status.HTTP_201_CREATED if created else status.HTTP_207_MULTI_STATUS)
     
-class MessageRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
+class MessageRetrieveUpdateDestroyAPIView(ConditionalRetrieveMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Message.objects.all().order_by('pk')
     serializer_class = MessageSerializer
 
@@ -103,3 +395,26 @@ class MessageRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView)
             return [IsAuthenticated()]
         return [IsAuthenticated(), IsOwner()]
 
+    def locked(self, instance, write):
+        """
+        Run write on the instance as found on its chat's shard under lock_chats, the one it
+        was read from may be the shard a moved chat left.
+        """
+        def locked_write():
+            with lock_chats([instance.chat_id]) as shards:
+                found = instance
+                if is_sharded() and instance._state.db != shards[instance.chat_id]:
+                    found = type(instance).objects.using(shards[instance.chat_id]).get(pk=instance.pk)
+                return write(found)
+
+        return atomic_with_retry(locked_write)
+
+    def perform_update(self, serializer):
+        def update(instance):
+            serializer.instance = instance
+            serializer.save()
+
+        self.locked(serializer.instance, update)
+
+    def perform_destroy(self, instance):
+        self.locked(instance, lambda found: found.delete())
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
 
@@ -32,6 +33,7 @@ ALLOWED_HOSTS = []
 # Application definition
 
 INSTALLED_APPS = [
+    'daphne',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -43,10 +45,13 @@ INSTALLED_APPS = [
     'django_filters',
     'health_check',
     'corsheaders',
+    'channels',
     'api'
 ]
 
 MIDDLEWARE = [
+    'api.middleware.ServerTimingMiddleware',
+    'api.middleware.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -76,6 +81,15 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'chat.wsgi.application'
+ASGI_APPLICATION = 'chat.asgi.application'
+
+# Fan-out backend for the WebSocket consumers. The in-memory layer only works within
+# a single process, use channels_redis.core.RedisChannelLayer when running several workers.
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+    },
+}
 
 
 # Database
@@ -88,6 +102,75 @@ DATABASES = {
     }
 }
 
+# Production SQLite profile. WAL lets readers work while a write commits, and IMMEDIATE
+# transactions take the write lock when they begin, so waiting for it is covered by the
+# busy timeout instead of failing with "database is locked" halfway through.
+SQLITE_PRODUCTION = os.environ.get('SQLITE_PRODUCTION', '').lower() in ('1', 'true', 'yes')
+SQLITE_PRODUCTION_OPTIONS = {
+    'init_command': (
+        'PRAGMA journal_mode=WAL;'
+        'PRAGMA synchronous=NORMAL;'
+        'PRAGMA cache_size=-65536;'  # KiB, 64 MiB per connection
+        'PRAGMA mmap_size=268435456;'
+        'PRAGMA temp_store=MEMORY;'
+    ),
+    'transaction_mode': 'IMMEDIATE',
+    'timeout': 5,  # busy timeout in seconds
+}
+if SQLITE_PRODUCTION:
+    DATABASES['default'].update(OPTIONS=SQLITE_PRODUCTION_OPTIONS, CONN_MAX_AGE=600, CONN_HEALTH_CHECKS=True)
+
+# Read replicas, see api.routers.ReplicaRouter. SQLITE_REPLICAS lists SQLite files, kept up to
+# date locally with the replicate_sqlite command, that become the replica_<n> aliases.
+SQLITE_REPLICAS = [path for path in os.environ.get('SQLITE_REPLICAS', '').split(',') if path]
+for index, path in enumerate(SQLITE_REPLICAS):
+    DATABASES[f'replica_{index}'] = {**DATABASES['default'], 'NAME': path, 'TEST': {'MIRROR': 'default'}}
+DATABASE_REPLICAS = [f'replica_{index}' for index in range(len(SQLITE_REPLICAS))]
+DATABASE_ROUTERS = ['api.routers.ReplicaRouter', 'api.routers.ShardRouter']
+# Seconds a user keeps reading from the primary after a write
+REPLICA_STICKY_SECONDS = 5
+# Seconds a replica may lag behind before reads fall back to the primary, and how often it is checked
+REPLICA_MAX_LAG = 2
+REPLICA_HEALTH_CHECK_INTERVAL = 1
+
+# Databases holding the messages, partitioned by chat, see api.sharding. SQLITE_MESSAGE_SHARDS
+# lists SQLite files that become the shard_<n> aliases next to the default database.
+SQLITE_MESSAGE_SHARDS = [path for path in os.environ.get('SQLITE_MESSAGE_SHARDS', '').split(',') if path]
+for index, path in enumerate(SQLITE_MESSAGE_SHARDS):
+    DATABASES[f'shard_{index}'] = {**DATABASES['default'], 'NAME': path}
+MESSAGE_SHARDS = ['default', *(f'shard_{index}' for index in range(len(SQLITE_MESSAGE_SHARDS)))]
+# Seconds a chat's shard is cached, the longest a writer can miss that the chat moved
+SHARD_DIRECTORY_TIMEOUT = 60
+
+# Write transactions run with api.db.atomic_with_retry are retried this many times when the
+# database stays locked, after DATABASE_WRITE_RETRY_DELAY seconds doubling on every attempt.
+DATABASE_WRITE_RETRIES = 5
+DATABASE_WRITE_RETRY_DELAY = 0.05
+
+# Per-request SQL and timing breakdown in a Server-Timing header, see api.middleware.ServerTimingMiddleware
+REQUEST_TIMING = os.environ.get('REQUEST_TIMING', '').lower() in ('1', 'true', 'yes')
+
+# Milliseconds after which a timed request is logged together with its slowest statements
+SLOW_REQUEST_THRESHOLD = 500
+SLOW_REQUEST_STATEMENTS = 5
+
+# List chats and messages from values() rows rendered with orjson instead of serializing model
+# instances, see api.representations.ValuesListMixin
+FAST_LIST_SERIALIZATION = os.environ.get('FAST_LIST_SERIALIZATION', '').lower() in ('1', 'true', 'yes')
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Seconds a cached /api/users/me/ or /api/chats/ response is kept, changes invalidate it earlier
+RESPONSE_CACHE_TIMEOUT = 300
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -131,9 +214,13 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = 'api.User'
 
+# Authorize JWT requests from the token claims instead of loading the user, see api.authentication
+JWT_STATELESS_AUTH = os.environ.get('JWT_STATELESS_AUTH', '').lower() in ('1', 'true', 'yes')
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.StatelessJWTAuthentication' if JWT_STATELESS_AUTH
+        else 'rest_framework_simplejwt.authentication.JWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PAGINATION_CLASS':'rest_framework.pagination.PageNumberPagination',
@@ -143,8 +230,54 @@ REST_FRAMEWORK = {
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60), # Token lifetime set to some convinient value for testing
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
+    'TOKEN_OBTAIN_SERIALIZER': 'api.serializers.ClaimsTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'api.serializers.ClaimsTokenRefreshSerializer',
 }
 
+# Seconds the full user row behind a stateless token user is cached, see api.authentication
+USER_ROW_CACHE_TIMEOUT = 30
+
+
+# Number of latest messages and characters per message shown in the chat list preview
+CHAT_PREVIEW_SIZE = 3
+CHAT_PREVIEW_LENGTH = 100
+
+# Maximum seconds a long-poll or event stream on /api/chats/<id>/stream/ is held open
+CHAT_STREAM_TIMEOUT = 25
+CHAT_STREAM_KEEPALIVE = 10
+
+# Maximum number of messages accepted by /api/messages/bulk/
+MESSAGE_BULK_MAX_SIZE = 500
+
+# Group commit of /api/messages/create/, see api.groupcommit. Concurrent messages are inserted
+# together once MESSAGE_GROUP_COMMIT_MAX_BATCH are queued or the oldest waited MAX_DELAY seconds.
+MESSAGE_GROUP_COMMIT = os.environ.get('MESSAGE_GROUP_COMMIT', '').lower() in ('1', 'true', 'yes')
+MESSAGE_GROUP_COMMIT_MAX_BATCH = 100
+MESSAGE_GROUP_COMMIT_MAX_DELAY = 0.002
+
+# Changes per /api/sync/ page, by default and at most
+SYNC_PAGE_SIZE = 100
+SYNC_MAX_PAGE_SIZE = 1000
+
+# Rows read per query by chat exports, see api.history
+EXPORT_CHUNK_SIZE = 1000
+
+# How long deletions are kept for /api/sync/, older sync tokens have to start over
+SYNC_TOMBSTONE_RETENTION = timedelta(days=30)
+
+# Longest time between setting updated_at and committing, /api/sync/ reads that far back again
+SYNC_COMMIT_WINDOW = timedelta(seconds=10)
+
+# Markup around the matched words in the HTML-escaped highlight of /api/messages/search/ results
+SEARCH_HIGHLIGHT = ('<mark>', '</mark>')
+
+# How archive jobs run: 'thread' (background thread), 'eager' (inline after commit)
+# or 'worker' (left to `manage.py run_archive_jobs`), and how many messages each chunk updates
+ARCHIVE_JOB_RUNNER = 'thread'
+ARCHIVE_JOB_CHUNK_SIZE = 1000
+
+# Seconds after its last chunk a running archive job counts as interrupted and can be claimed again
+ARCHIVE_JOB_LEASE = 300
 
 
 CORS_ALLOW_ALL_ORIGINS = True